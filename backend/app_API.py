@@ -3,22 +3,51 @@ import os
 from fastapi import FastAPI, Query, Depends, Body, Request, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from database import SessionLocal, engine
-from models import Base, TerrainRisk, Favorite, User, Shelter
+from sqlalchemy import String, delete, func, insert, or_, select, text, tuple_, type_coerce, update
+from pydantic import BaseModel
+from database import (
+    DATABASE_URL, DB_PATH, DB_READ_MAX_OVERFLOW, DB_READ_POOL_SIZE, AsyncSessionLocal, ReadSessionLocal,
+    async_engine, engine, read_engine,
+)
+from models import Base, Favorite, DeletedFavorite, User, Shelter, WardRiskCount, WardStats
+from spatial_index import (
+    MAX_DISTANCE_M, build_indexes, get_risk_locator, get_shelter_clusters, get_shelter_index, get_walk_network,
+    indexes_ready, risk_locator_after, swap_indexes, walk_network_ready,
+)
+from dataset_versions import DATASET_VERSIONS_QUERY, RISK_RASTER, SHELTERS, TERRAIN_RISK, WALK_NETWORK
+from cache import SingleFlight, TTLCache, snap_latlon
+from landform import landform_store
+from risk_payloads import RISK_NO_MATCH_BODY, encode_payload, risk_payloads
+from risk_tiles import (
+    RISK_TILE_MAX_AGE_S, RISK_TILE_MAX_ZOOM, RISK_TILE_METRICS, RISK_TILE_MIN_ZOOM, RiskTileRenderer, risk_tiles,
+)
+from tile_proxy import TILE_LAYERS, TILE_MAX_ZOOM, TILE_CLIENT_MAX_AGE_S, TileUpstreamError, tile_proxy
+from schema import ensure_sqlite_schema
+from ward_stats import ward_stats_json
+import metrics
 
 # 認証系
 from passlib.context import CryptContext
-from passlib.hash import pbkdf2_sha256
+from password_pool import PasswordPoolBusy, password_pool
+from principal_cache import Principal, principal_cache
 import jwt  # PyJWT
 from datetime import datetime, timedelta
 
 # ユーティリティ
-from math import radians, cos, sin, asin, sqrt
-import pandas as pd
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import time
+import numpy as np
 from pyproj import Transformer
-from shapely.geometry import Point
 
 
 # app_API.py 冒頭の import 群のすぐ下あたりに
@@ -26,8 +55,15 @@ from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=Path(__file__).parent / ".env")  # backend/.env を読む
 
-print("DEBUG SECRET_KEY set? ->", bool(os.getenv("SECRET_KEY")))
-print("DEBUG CORS_ALLOW_ORIGINS raw ->", os.getenv("CORS_ALLOW_ORIGINS"))
+# uvicorn のログ設定とは別に、アプリのロガー（app.*）の出力先をここで決める
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logging.getLogger("httpx").setLevel(logging.WARNING)  # タイルの上流取得を1件ずつ INFO で出さない
+logger = logging.getLogger("app")
+logger.debug("SECRET_KEY set? -> %s", bool(os.getenv("SECRET_KEY")))
+logger.debug("CORS_ALLOW_ORIGINS raw -> %s", os.getenv("CORS_ALLOW_ORIGINS"))
 
 # ===== Env から読む =====
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -63,84 +99,171 @@ app = FastAPI(
     # root_path="/api",
     servers=[{"url": "/api"}],       # ← 任意：表示上のベースURL
 )
+# 以降に定義するルートはリクエスト数・処理時間・SQL の数を計測する（GET /metrics）
+app.router.route_class = metrics.InstrumentedRoute
+metrics.instrument_engine(engine, "write")
+metrics.instrument_engine(async_engine.sync_engine, "write")
+if read_engine is not engine:
+    metrics.instrument_engine(read_engine, "read")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOW_ORIGINS,
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Shelter-Mode"],  # GET /favorites のページングと再検証・徒歩距離の代替
 )
 
-Base.metadata.create_all(bind=engine)
-
-# -----------------------------------------------------------------------------
-# スキーマ整備（※1回だけ定義・呼び出し）
-# -----------------------------------------------------------------------------
-def ensure_sqlite_schema(engine):
-    with engine.begin() as conn:
-        # users テーブル新規 or 既存拡張
-        conn.exec_driver_sql("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            device_id TEXT UNIQUE,
-            email TEXT UNIQUE,
-            password_hash TEXT,
-            nickname TEXT,
-            created_at TEXT DEFAULT (datetime('now')),
-            last_seen  TEXT DEFAULT (datetime('now'))
-        )""")
-
-        cols = conn.exec_driver_sql("PRAGMA table_info(users)").fetchall()
-        ucols = {c[1] for c in cols}
-        if "email" not in ucols:
-            conn.exec_driver_sql("ALTER TABLE users ADD COLUMN email TEXT")
-        if "password_hash" not in ucols:
-            conn.exec_driver_sql("ALTER TABLE users ADD COLUMN password_hash TEXT")
-
-        cols = conn.exec_driver_sql("PRAGMA table_info(favorites)").fetchall()
-        fcols = {c[1] for c in cols}
-        if "device_id" not in fcols:
-            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN device_id TEXT")
-        if "user_id" not in fcols:
-            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN user_id INTEGER")
-        if "simple_warnings" not in fcols:
-            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN simple_warnings TEXT")
-        if "created_at" not in fcols:
-            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN created_at TEXT")
-        if "updated_at" not in fcols:
-            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN updated_at TEXT")
-
-        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_users_email ON users (email)")
-        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_favorites_user_id ON favorites (user_id)")
-        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_favorites_device_id ON favorites (device_id)")
-
-ensure_sqlite_schema(engine)
+@app.on_event("startup")
+def build_spatial_indexes():
+    logger.info("DB: %s%s", make_url(DATABASE_URL).render_as_string(hide_password=True),
+                "" if DB_PATH is None else f" (exists={DB_PATH.exists()}, path={DB_PATH.resolve()})")
+    # スキーマ整備は import 時ではなくここで（PRAGMA user_version が最新なら DB には書かない）
+    Base.metadata.create_all(bind=engine)
+    ensure_sqlite_schema(engine)
+    # 初回リクエストで構築待ちが発生しないよう起動時に作っておく（同期エンジンで1回だけ）
+    # 版は読み込む前に記録する（読み込み中に上がった版は次の確認で読み直す）
+    with ReadSessionLocal() as db:
+        dataset_versions.update(db.execute(DATASET_VERSIONS_QUERY).all())
+    get_risk_locator()
+    risk_payloads.store()
+    get_shelter_index()
+    get_shelter_clusters()
+    get_walk_network()  # WALK_NETWORK_DIR を設定している時だけ読む
+    warn_if_walk_network_stale()
+    tile_proxy.cache.start_scan()  # タイルキャッシュの容量集計はバックグラウンドで
+
+@app.on_event("startup")
+async def start_dataset_watch():
+    global dataset_watch_task
+    dataset_watch_task = asyncio.create_task(watch_dataset_versions())
+
+@app.on_event("shutdown")
+def stop_password_pool():
+    password_pool.shutdown()
+
+@app.on_event("shutdown")
+async def close_tile_proxy():
+    await tile_proxy.aclose()
+
+@app.on_event("shutdown")
+async def stop_dataset_watch():
+    if dataset_watch_task is not None:
+        dataset_watch_task.cancel()
 
 # -----------------------------------------------------------------------------
-# 投影変換 / Geo ユーティリティ
+# レスポンスキャッシュ（/risk, /shelters/nearest）
+#   同じ街区へのクリックが集中するので、約 RESPONSE_CACHE_GRID_M 四方に丸めた座標で引く
 # -----------------------------------------------------------------------------
-transformer = Transformer.from_crs("EPSG:4326", "EPSG:6674", always_xy=True)
+RESPONSE_CACHE_GRID_M = float(os.getenv("RESPONSE_CACHE_GRID_M", "10"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "600"))
+DATASET_CHECK_INTERVAL_S = float(os.getenv("DATASET_CHECK_INTERVAL_S", "10"))
 
-def latlon_to_6674(lat, lon):
-    x, y = transformer.transform(lon, lat)
-    return Point(x, y)
+risk_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_S)
+shelter_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_S)
 
-def haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    return 2 * R * asin(sqrt(a))
+# -----------------------------------------------------------------------------
+# データの読み直し（import / build スクリプトが dataset_versions の版を上げたら）
+#   DATASET_CHECK_INTERVAL_S ごとに版の表（数行）だけを読む。変わっていたらインデックスと /risk の応答を
+#   スレッドで作り直し、できあがってからイベントループ上でまとめて差し替えてキャッシュを捨てる。
+#   差し替えの前後で止まるリクエストはなく、処理中のリクエストは手元の古いインデックスで最後まで応答する
+# -----------------------------------------------------------------------------
+dataset_versions: dict[str, int] = {}  # このワーカーが読み込んでいるデータの版
+dataset_reloads = {"checks": 0, "reloads": 0, "failures": 0, "last_reload": None, "last_error": None}
+dataset_watch_task: asyncio.Task | None = None
+
+def _build_datasets(changed: set[str]) -> dict:
+    built = {"indexes": build_indexes(changed)}
+    if TERRAIN_RISK in changed:
+        built["risk_payloads"] = risk_payloads.build()
+    if changed & {TERRAIN_RISK, RISK_RASTER}:
+        # ヒートマップは使われていた時だけ作っておく（版が変わるのでディスク上の古いタイルは使われない）
+        locator = risk_locator_after(built["indexes"])
+        built["risk_tiles"] = RiskTileRenderer.from_db(locator) if risk_tiles.ready() else None
+    return built
+
+def _swap_datasets(changed: set[str], built: dict):
+    # イベントループのスレッドで呼ぶ（非同期のハンドラからは、差し替えの途中の状態は見えない）
+    swap_indexes(built["indexes"])
+    if TERRAIN_RISK in changed:
+        risk_payloads.swap(built["risk_payloads"])
+    if changed & {TERRAIN_RISK, RISK_RASTER}:
+        risk_tiles.swap(built["risk_tiles"])
+    if changed & {TERRAIN_RISK, RISK_RASTER}:
+        risk_cache.clear()
+    if changed & {SHELTERS, WALK_NETWORK}:
+        shelter_cache.clear()
+        warn_if_walk_network_stale()
+
+async def reload_changed_datasets() -> set[str]:
+    dataset_reloads["checks"] += 1
+    versions = dict(await run_read(lambda db: db.execute(DATASET_VERSIONS_QUERY).all()))
+    changed = {name for name, version in versions.items() if dataset_versions.get(name) != version}
+    if not changed:
+        return changed
+    started = time.perf_counter()
+    built = await run_in_threadpool(_build_datasets, changed)
+    _swap_datasets(changed, built)
+    dataset_versions.update(versions)
+    seconds = round(time.perf_counter() - started, 2)
+    dataset_reloads["reloads"] += 1
+    dataset_reloads["last_reload"] = {
+        "datasets": sorted(changed), "seconds": seconds, "at": datetime.utcnow().isoformat(timespec="seconds"),
+    }
+    logger.info("データを読み直しました: %s (%.2f 秒)", ", ".join(f"{n} v{versions[n]}" for n in sorted(changed)), seconds)
+    return changed
+
+async def watch_dataset_versions():
+    while True:
+        await asyncio.sleep(DATASET_CHECK_INTERVAL_S)
+        try:
+            await reload_changed_datasets()
+        except Exception as e:
+            # 版は記録し直していないので、次の確認でもう一度作り直す
+            dataset_reloads["failures"] += 1
+            dataset_reloads["last_error"] = repr(e)
+            logger.exception("データの読み直しに失敗しました")
+
+async def ensure_indexes():
+    # 再インポート直後はインデックスの作り直しが走るので、イベントループを止めないようスレッドで
+    if not indexes_ready() or not risk_payloads.ready():
+        await run_in_threadpool(
+            lambda: (get_risk_locator(), risk_payloads.store(), get_shelter_index(), get_shelter_clusters())
+        )
+
+# -----------------------------------------------------------------------------
+# 投影変換 / Geo ユーティリティ
+# -----------------------------------------------------------------------------
+transformer = Transformer.from_crs("EPSG:4326", "EPSG:6674", always_xy=True)
 
 # -----------------------------------------------------------------------------
 # DB セッション（← 先に定義しておく：Depends で参照されるため）
 # -----------------------------------------------------------------------------
-def get_db():
-    db = SessionLocal()
-    try:
+# 書き込み: aiosqlite の非同期セッション（接続1本）。SQLAlchemy の非同期プールは空き待ちの順番が保証されず、
+# 混雑時に一部のリクエストだけ何秒も待たされるので、Semaphore（FIFO）で先に順番を決めておく
+write_slots = asyncio.Semaphore(1)
+
+async def get_db():
+    # 書き込み用（接続は1本。書き込み同士はここで順番待ちになる）
+    async with write_slots, AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+# 読み取り: 同期の read_engine で、1リクエスト分のクエリをまとめて1回だけスレッドに渡して実行する。
+#   aiosqlite は文ごとに接続スレッドとの往復があり、ループが忙しいと往復のたびに GIL 待ちが挟まる
+#   （GET /favorites は1リクエストで約18往復。32並列の混合負荷で p50 300 ms、/risk は 23 ms だった）
+#   イベントループ上では実行しない（busy_timeout の待ちで /risk まで止まるため）
+#   専用スレッドは読み取りプールの接続数まで（接続の空き待ちが起きない。タイル描画などの共用スレッドプールも使わない）
+#   run_in_threadpool（anyio）は渡す前にループを1周譲るので、混雑時はその分だけ待ちが伸びる。ここは直接渡す
+read_executor = ThreadPoolExecutor(DB_READ_POOL_SIZE + DB_READ_MAX_OVERFLOW, thread_name_prefix="db-read")
+
+def _run_read_sync(fn, *args):
+    with ReadSessionLocal() as db:
+        return fn(db, *args)
+
+async def run_read(fn, *args):
+    # fn(db, *args) を読み取り専用セッションでスレッド実行して結果を返す
+    return await asyncio.get_running_loop().run_in_executor(read_executor, _run_read_sync, fn, *args)
 
 # -----------------------------------------------------------------------------
 # 認証セットアップ（get_db を参照する関数はここから下に）
@@ -154,13 +277,22 @@ pwd_context = CryptContext(
 )
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-def get_password_hash(p: str) -> str:
-    # ← ここを“必ず” bcrypt_sha256 でハッシュ
-    return pbkdf2_sha256.hash(p)  
+async def _run_in_password_pool(submit, *args):
+    # ハッシュ計算は専用プロセスプールで（完了はイベントループ上で待つ）。抱えきれない時は待たせず 503 を返す
+    try:
+        future = submit(*args)
+    except PasswordPoolBusy:
+        raise HTTPException(503, "認証処理が混み合っています。しばらくしてから再試行してください",
+                            headers={"Retry-After": "1"})
+    return await asyncio.wrap_future(future)
+
+async def get_password_hash(p: str) -> str:
+    # ← ここを“必ず” pbkdf2_sha256 でハッシュ（rounds は PASSWORD_HASH_ROUNDS）
+    return await _run_in_password_pool(password_pool.hash, p)
 
-def verify_password(plain: str, hashed: str) -> bool:
+async def verify_password(plain: str, hashed: str) -> bool:
     # 既存bcrypt等も自動判別して検証
-    return pwd_context.verify(plain, hashed)
+    return await _run_in_password_pool(password_pool.verify, plain, hashed)
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -169,14 +301,18 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> User:
+async def load_user(user_id: int) -> User | None:
+    return await run_read(lambda db: db.get(User, user_id))
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
+    # 署名と期限の検証は毎回行い、ユーザーの存在確認だけ principal_cache で省く（ヒット時は DB に触らない）
     cred_exc = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         sub = payload.get("sub")
         if not sub:
             raise cred_exc
-        user = db.query(User).get(int(sub))
+        user = await principal_cache.resolve(int(sub), load_user)
         if not user:
             raise cred_exc
         return user
@@ -184,7 +320,7 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
         raise cred_exc
 
 # Bearer トークンが無い時は None を返す依存関数
-def get_optional_user(request: Request, db: Session = Depends(get_db)) -> User | None:
+async def get_optional_user(request: Request) -> Principal | None:
     auth = request.headers.get("authorization")
     if not auth:
         return None
@@ -194,88 +330,50 @@ def get_optional_user(request: Request, db: Session = Depends(get_db)) -> User |
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         uid = int(payload.get("sub"))
-        return db.query(User).get(uid)
+        return await principal_cache.resolve(uid, load_user)
     except Exception:
         return None
 
 # -----------------------------------------------------------------------------
-# 近傍検索 / 説明生成
+# 近傍検索（応答は risk_payloads に事前に作ってある）
 # -----------------------------------------------------------------------------
-MAX_DISTANCE_M = 400
-
-def nearest_point(lat: float, lon: float, db: Session):
-    all_data = db.query(TerrainRisk).all()
-    pt = latlon_to_6674(lat, lon)
-    min_dist = float("inf")
-    nearest = None
-    for row in all_data:
-        row_point = Point(row.lon, row.lat)
-        dist = row_point.distance(pt)
-        if dist < min_dist:
-            min_dist = dist
-            nearest = row
-    return nearest, min_dist
-
-def generate_risk_explanation(elev_score, slope_score, river_score, risk_description):
-    if pd.isna(risk_description) or risk_description is None:
-        risk_description = ""
-    else:
-        risk_description = str(risk_description)
-
-    explanation = ""
-    if elev_score and slope_score:
-        if elev_score >= 25 and slope_score <= 10:
-            explanation += " 標高が低く、海や河川に近い地域で洪水リスクが高い傾向にあります。"
-        elif elev_score >= 18 and slope_score <= 15:
-            explanation += " 標高がやや低く、浸水被害の可能性があります。"
-        elif slope_score >= 20:
-            explanation += " 傾斜が急で、土砂災害の危険があります。"
-        elif slope_score >= 12:
-            explanation += " やや傾斜地にあり、雨量が多いときは土砂崩れに注意が必要です。"
-        elif elev_score <= 13 and slope_score <= 10:
-            explanation += " 高台に位置し、比較的安定した地形です。災害リスクは低めです。"
-        else:
-            explanation += " 特定の災害リスクは中程度です。"
-    else:
-        explanation += " 地形スコア情報が未登録のため、簡易的な評価です。"
-
-    if "洪水" in risk_description:
-        explanation += " 洪水ハザードマップ上では浸水可能性が示されています。"
-    if "土砂" in risk_description or "崩壊" in risk_description:
-        explanation += " 土砂崩れ・斜面崩壊の危険も考えられます。"
-    if "津波" in risk_description:
-        explanation += " 津波の可能性があり、注意が必要です。"
-
-    return explanation
+async def locate_risk_body(lat: float, lon: float) -> bytes:
+    # 事前計算ラスタ（O(1)）か起動時に作った KD-tree（O(log N)）で最寄り点を探し、その地点の応答 JSON を返す
+    await ensure_indexes()
+    x, y = transformer.transform(lon, lat)
+    nearest_id, _ = get_risk_locator().nearest(x, y, MAX_DISTANCE_M)
+    if nearest_id is None:
+        return RISK_NO_MATCH_BODY
+    return risk_payloads.store().body(nearest_id) or RISK_NO_MATCH_BODY
 
 # -----------------------------------------------------------------------------
 # ユーザー登録（device_id）
 # -----------------------------------------------------------------------------
 @app.post("/users/register")
-def register_user(data: dict = Body(...), db: Session = Depends(get_db)):
+async def register_user(data: dict = Body(...), db: AsyncSession = Depends(get_db)):
     device_id = data.get("device_id")
     nickname  = data.get("nickname")
     if not device_id:
         return {"status": "error", "detail": "device_id is required"}
 
-    user = db.query(User).filter(User.device_id == device_id).first()
+    user = await db.scalar(select(User).where(User.device_id == device_id).limit(1))
     if not user:
         user = User(device_id=device_id, nickname=nickname)
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     else:
         if nickname:
             user.nickname = nickname
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user)
     return {"status": "ok", "id": user.id, "device_id": user.device_id, "nickname": user.nickname}
 
 # -----------------------------------------------------------------------------
 # 認証エンドポイント
 # -----------------------------------------------------------------------------
 @app.post("/auth/register")
-def auth_register(data: dict = Body(...), db: Session = Depends(get_db)):
+async def auth_register(data: dict = Body(...), db: AsyncSession = Depends(get_db)):
     email = (data.get("email") or "").strip().lower()
     password = data.get("password") or ""
     nickname = data.get("nickname")
@@ -283,33 +381,37 @@ def auth_register(data: dict = Body(...), db: Session = Depends(get_db)):
 
     if not email or not password:
         raise HTTPException(400, "email / password は必須です")
-    if db.query(User).filter(User.email == email).first():
+    if await db.scalar(select(User.id).where(User.email == email).limit(1)):
         raise HTTPException(409, "既に登録されています")
 
-    user = User(email=email, password_hash=get_password_hash(password), nickname=nickname, device_id=device_id)
-    db.add(user); db.commit(); db.refresh(user)
+    user = User(email=email, password_hash=await get_password_hash(password), nickname=nickname, device_id=device_id)
+    db.add(user); await db.commit(); await db.refresh(user)
+    principal_cache.put(Principal.from_user(user))
 
     # device_id があれば favorites を引き取り
     if device_id:
-        db.query(Favorite).filter(Favorite.device_id == device_id, Favorite.user_id == None)\
-            .update({Favorite.user_id: user.id})
-        db.commit()
+        await db.execute(
+            update(Favorite).where(Favorite.device_id == device_id, Favorite.user_id == None)
+            .values(user_id=user.id)
+        )
+        await db.commit()
 
     token = create_access_token({"sub": str(user.id)})
     return {"status": "ok", "access_token": token, "token_type": "bearer"}
 
 @app.post("/auth/login")
-def auth_login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def auth_login(form: OAuth2PasswordRequestForm = Depends()):
     email = form.username.strip().lower()
-    user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(form.password, user.password_hash or ""):
+    user = await run_read(lambda db: db.scalar(select(User).where(User.email == email).limit(1)))
+    if not user or not await verify_password(form.password, user.password_hash or ""):
         raise HTTPException(401, "メールまたはパスワードが違います")
+    principal_cache.put(Principal.from_user(user))
 
     token = create_access_token({"sub": str(user.id)})
     return {"access_token": token, "token_type": "bearer"}
 
 @app.get("/me")
-def me(current_user: User = Depends(get_current_user)):
+async def me(current_user: Principal = Depends(get_current_user)):
     return {
         "id": current_user.id,
         "email": current_user.email,
@@ -318,46 +420,137 @@ def me(current_user: User = Depends(get_current_user)):
     }
 
 @app.post("/auth/claim_device")
-def claim_device(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def claim_device(request: Request, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     device_id = request.headers.get("x-device-id")
     if not device_id:
         raise HTTPException(400, "X-Device-ID が必要です")
-    db.query(Favorite).filter(Favorite.device_id == device_id, Favorite.user_id == None)\
-        .update({Favorite.user_id: current_user.id})
-    db.commit()
+    await db.execute(
+        update(Favorite).where(Favorite.device_id == device_id, Favorite.user_id == None)
+        .values(user_id=current_user.id)
+    )
+    await db.commit()
     return {"status": "ok"}
 
 # -----------------------------------------------------------------------------
 # リスク API
 # -----------------------------------------------------------------------------
+async def cached_risk_body(lat: float, lon: float) -> bytes:
+    key = snap_latlon(lat, lon, RESPONSE_CACHE_GRID_M)
+    body = risk_cache.get(key)
+    if body is None:
+        body = await locate_risk_body(lat, lon)
+        risk_cache.set(key, body)
+    return body
+
 @app.get("/risk")
-def get_risk(lat: float = Query(...), lon: float = Query(...), db: Session = Depends(get_db)):
-    nearest, min_dist = nearest_point(lat, lon, db)
-    if not nearest or min_dist > MAX_DISTANCE_M:
-        return {"status": "no_match", "overall_risk": None, "risk_description": "", "explanation": "一致する地点が見つかりませんでした。"}
-
-    explanation = generate_risk_explanation(
-        elev_score=nearest.elev_score or 0,
-        slope_score=nearest.slope_score or 0,
-        river_score=nearest.river_score or 0,
-        risk_description=nearest.risk_description or ""
+async def get_risk(lat: float = Query(...), lon: float = Query(...)):
+    return Response(await cached_risk_body(lat, lon), media_type="application/json")
+
+# 地図クリック1回分（リスク・最寄り避難所・地形分類）をまとめて返す。3つは並行して引く
+#   同じ地点（RESPONSE_CACHE_GRID_M 四方）への同時リクエストは1回の計算に相乗りする
+risk_full_flight = SingleFlight()
+
+async def _shelters_for_full(lat: float, lon: float, limit: int, mode: str) -> tuple[str, list]:
+    # 徒歩距離が使えない時の直線距離への切り替えは find_shelters に任せる（shelters.mode で区別できる）
+    return await find_shelters(lat, lon, limit, mode=mode)
+
+async def _build_risk_full(lat: float, lon: float, limit: int, mode: str) -> bytes:
+    risk, (shelter_mode, shelters), terrain = await asyncio.gather(
+        cached_risk_body(lat, lon),
+        _shelters_for_full(lat, lon, limit, mode),
+        lookup_terrain(lat, lon),
     )
-    return {
-        "status": "ok",
-        "overall_risk": nearest.overall_risk,
-        "risk_description": nearest.risk_description,
-        "explanation": explanation
-    }
+    # risk は事前に作った JSON をそのまま埋め込む
+    return (b'{"risk":' + risk
+            + b',"shelters":' + encode_payload({"mode": shelter_mode, "items": shelters})
+            + b',"terrain":' + encode_payload(terrain) + b"}")
+
+@app.get("/risk/full")
+async def get_risk_full(lat: float = Query(...), lon: float = Query(...), limit: int = 1, mode: str = "straight"):
+    if not (-85.0 < lat < 85.0 and -180.0 <= lon < 180.0):
+        raise HTTPException(400, "lat / lon の範囲が不正です")
+    if mode not in ("straight", "walk"):
+        raise HTTPException(400, "mode は straight / walk のいずれかです")
+    limit = max(1, min(limit, 20))
+    key = (snap_latlon(lat, lon, RESPONSE_CACHE_GRID_M), limit, mode)
+    body = await risk_full_flight.do(key, lambda: _build_risk_full(lat, lon, limit, mode))
+    return Response(body, media_type="application/json")
+
+# リスクのヒートマップタイル（terrain_risk のスコアを描いた PNG。データ版ごとにディスクへ保存）
+@app.get("/risk/tiles/{metric}/{z}/{x}/{y}.png")
+async def get_risk_tile(metric: str, z: int, x: int, y: int, request: Request):
+    if metric not in RISK_TILE_METRICS:
+        raise HTTPException(404, "未対応の指標です")
+    if not (RISK_TILE_MIN_ZOOM <= z <= RISK_TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(404, "タイル座標が範囲外です")
+    headers = {"Cache-Control": f"public, max-age={RISK_TILE_MAX_AGE_S}"}
+    if risk_tiles.ready():
+        # データ版が変わっていなければ読み込みも描画もせずに返せる
+        etag = f'"{risk_tiles.renderer().version}"'
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={**headers, "ETag": etag})
+    png, version = await run_in_threadpool(risk_tiles.get, metric, z, x, y)
+    return Response(png, media_type="image/png", headers={**headers, "ETag": f'"{version}"'})
+
+# 一括リスク検索（ルート上の地点・お気に入り一覧・グリッド集計など）
+RISK_BATCH_MAX_POINTS = int(os.getenv("RISK_BATCH_MAX_POINTS", "20000"))
+RISK_BATCH_STREAM_THRESHOLD = int(os.getenv("RISK_BATCH_STREAM_THRESHOLD", "1000"))
+SQLITE_IN_CHUNK = 500  # IN 句の上限対策
+
+def _parse_batch_points(points) -> tuple[np.ndarray, np.ndarray]:
+    # [{"lat":..,"lon":..}, ...] と [[lat, lon], ...] の両方を受け付ける
+    try:
+        pairs = [(p["lat"], p["lon"]) if isinstance(p, dict) else (p[0], p[1]) for p in points]
+        arr = np.array(pairs, dtype=np.float64).reshape(-1, 2)
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise HTTPException(400, "points は {lat, lon} または [lat, lon] の配列で指定してください")
+    if not np.isfinite(arr).all():
+        raise HTTPException(400, "lat / lon に数値以外が含まれています")
+    return arr[:, 0], arr[:, 1]
+
+def _locate_batch(locator, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    # 投影変換と近傍検索をまとめて1回で（点数が多いとCPUを使うのでスレッドで呼ぶ）
+    xs, ys = transformer.transform(lons, lats)
+    ids, _ = locator.nearest_many(xs, ys, MAX_DISTANCE_M)
+    return ids
+
+@app.post("/risk/batch")
+async def get_risk_batch(request: Request, data: dict = Body(...)):
+    points = data.get("points")
+    if not isinstance(points, list):
+        raise HTTPException(400, "points は必須です")
+    if len(points) > RISK_BATCH_MAX_POINTS:
+        raise HTTPException(413, f"points は最大 {RISK_BATCH_MAX_POINTS} 件までです")
+    lats, lons = _parse_batch_points(points)
+    await ensure_indexes()
+    # スレッドで検索している間にデータが差し替わっても、同じ版のインデックスと応答を組み合わせる
+    locator, store = get_risk_locator(), risk_payloads.store()
+    ids = await run_in_threadpool(_locate_batch, locator, lats, lons)
+    bodies = store.bodies_for(ids)
+
+    # 事前に作った応答 {"status":..} の先頭に index / lat / lon を差し込むだけ（dict は作らない）
+    def result(i) -> bytes:
+        return b'{"index":%d,"lat":%r,"lon":%r,%s' % (i, float(lats[i]), float(lons[i]), bodies[i][1:])
+
+    wants_ndjson = "application/x-ndjson" in (request.headers.get("accept") or "")
+    if wants_ndjson or len(ids) > RISK_BATCH_STREAM_THRESHOLD:
+        def ndjson():
+            for i in range(len(ids)):
+                yield result(i) + b"\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    body = b'{"status":"ok","results":[' + b",".join(result(i) for i in range(len(ids))) + b"]}"
+    return Response(body, media_type="application/json")
 
 # -----------------------------------------------------------------------------
 # お気に入り API（ログイン優先 / 未ログインは device_id）
 # -----------------------------------------------------------------------------
 @app.post("/favorites")
-def add_favorite(
+async def add_favorite(
     request: Request,
     data: dict = Body(...),
-    db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_optional_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal | None = Depends(get_optional_user)
 ):
     device_id = request.headers.get("x-device-id")
     fav = Favorite(
@@ -371,76 +564,379 @@ def add_favorite(
         device_id=device_id,
         user_id=current_user.id if current_user else None,
     )
-    db.add(fav); db.commit(); db.refresh(fav)
+    db.add(fav); await db.commit(); await db.refresh(fav)
     return {"status": "ok", "id": fav.id}
 
-@app.get("/favorites")
-def list_favorites(
+FAVORITES_PAGE_DEFAULT = 100
+FAVORITES_PAGE_MAX = 500
+
+class FavoriteOut(BaseModel):
+    id: int
+    lat: float
+    lon: float
+    title: str
+    terrain_type: str | None = None
+    risk_score: int | None = None
+    risk_description: str | None = None
+    explanation: str | None = None
+    nearest_shelter: str | None = None
+    simple_warnings: str | None = None
+    device_id: str | None = None
+    user_id: int | None = None
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+    version: int | None = None
+
+FAVORITE_COLUMNS = [getattr(Favorite, name) for name in FavoriteOut.model_fields]
+# SQLite には文字列で入っているので、カーソルの比較は変換せずにそのままの文字列で扱う
+#   （datetime でバインドすると "... 12:00:00.000000" になり、保存値 "... 12:00:00" と一致しない）
+_favorite_created_raw = type_coerce(Favorite.created_at, String)
+
+def _encode_cursor(created_raw: str | None, fav_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_raw, fav_id]).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[str | None, int]:
+    try:
+        created_raw, fav_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not (created_raw is None or isinstance(created_raw, str)) or not isinstance(fav_id, int):
+            raise ValueError
+        return created_raw, fav_id
+    except ValueError:
+        raise HTTPException(400, "cursor が不正です")
+
+def _favorite_json(row) -> dict:
+    item = dict(zip(FavoriteOut.model_fields, row))
+    for key in ("created_at", "updated_at"):
+        if item[key] is not None:
+            item[key] = item[key].isoformat()
+    return item
+
+@app.get("/favorites", response_model=list[FavoriteOut])
+async def list_favorites(
     request: Request,
-    db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_optional_user)
+    limit: int = Query(FAVORITES_PAGE_DEFAULT, ge=1, le=FAVORITES_PAGE_MAX),
+    cursor: str | None = None,
+    current_user: Principal | None = Depends(get_optional_user)
 ):
-    q = db.query(Favorite)
+    # 新しい順に limit 件ずつ。続きがあれば X-Next-Cursor ヘッダの値を ?cursor= に付けて次を取る
     if current_user:
-        q = q.filter(Favorite.user_id == current_user.id)
+        owner_key = f"user:{current_user.id}"
+        owner, deleted_owner = Favorite.user_id == current_user.id, DeletedFavorite.user_id == current_user.id
     else:
         device_id = request.headers.get("x-device-id")
         if device_id:
-            q = q.filter(Favorite.device_id == device_id)
+            owner_key = f"device:{device_id}"
+            owner, deleted_owner = Favorite.device_id == device_id, DeletedFavorite.device_id == device_id
         else:
             return []
-    return q.order_by(Favorite.created_at.desc()).all()
+
+    if_none_match = request.headers.get("if-none-match") or ""
+    etag, rows = await run_read(_read_favorites_page, owner, deleted_owner, owner_key, cursor, limit, if_none_match)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if rows is None:
+        return Response(status_code=304, headers=headers)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(rows[-1][-1], rows[-1][0])
+    body = json.dumps([_favorite_json(row[:-1]) for row in rows], ensure_ascii=False)
+    return Response(body, media_type="application/json", headers=headers)
+
+def _read_favorites_page(db: Session, owner, deleted_owner, owner_key: str, cursor: str | None, limit: int,
+                         if_none_match: str):
+    # 戻り値: (ETag, limit + 1 件までの行)。If-None-Match と一致すれば行は読まずに None
+    # 追加・更新・削除のたびにトリガが変更番号（favorites.version / 削除は favorites_deleted.version）を進めるので、
+    # 件数と両方の最大値が同じなら一覧も同じ（updated_at は秒単位で、同じ秒の2回の更新を区別できない）
+    count, max_version, max_deleted_version = db.execute(select(
+        func.count(), func.max(Favorite.version),
+        select(func.max(DeletedFavorite.version)).where(deleted_owner).scalar_subquery(),
+    ).where(owner)).one()
+    digest = hashlib.sha1(
+        f"{owner_key}|{count}|{max_version}|{max_deleted_version}|{cursor}|{limit}".encode()
+    ).hexdigest()
+    etag = f'W/"{digest[:20]}"'
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return etag, None
+
+    q = select(*FAVORITE_COLUMNS, _favorite_created_raw.label("created_raw")).where(owner)
+    if cursor:
+        # created_at 降順（NULL は最後）→ id 降順 のキーセット
+        created_raw, fav_id = _decode_cursor(cursor)
+        if created_raw is None:
+            q = q.where(_favorite_created_raw.is_(None), Favorite.id < fav_id)
+        else:
+            q = q.where(or_(
+                tuple_(_favorite_created_raw, Favorite.id) < tuple_(created_raw, fav_id),
+                _favorite_created_raw.is_(None),
+            ))
+    q = q.order_by(Favorite.created_at.desc(), Favorite.id.desc()).limit(limit + 1)
+    return etag, db.execute(q).all()
+
+# オフライン中に溜めた追加・削除をまとめて反映する
+FAVORITES_SYNC_MAX_OPS = int(os.getenv("FAVORITES_SYNC_MAX_OPS", "500"))
+FAVORITE_INPUT_FIELDS = (
+    "terrain_type", "risk_score", "risk_description", "explanation", "simple_warnings", "nearest_shelter",
+)
+
+def _parse_sync_creates(creates, device_id, user_id) -> list[dict]:
+    rows = []
+    for item in creates:
+        try:
+            row = {"lat": float(item["lat"]), "lon": float(item["lon"]), "title": str(item["title"])}
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(400, "creates の各要素には lat / lon / title が必要です")
+        row.update({key: item.get(key) for key in FAVORITE_INPUT_FIELDS})
+        row.update(device_id=device_id, user_id=user_id)
+        rows.append(row)
+    return rows
+
+@app.post("/favorites/sync")
+async def sync_favorites(
+    request: Request,
+    data: dict = Body(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal | None = Depends(get_optional_user)
+):
+    # {"since": 12, "creates": [{"client_id": "tmp-1", "lat": .., "lon": .., "title": ..}], "deletes": [3, 5]}
+    #   → 1トランザクション（= fsync 1回）で反映し、since より後の変更だけを返す
+    #   {"version": 20, "created": [{"client_id": "tmp-1", "id": 41}], "changes": [...], "deleted": [3, 5]}
+    #   次回は返ってきた version を since に入れて送る
+    device_id = request.headers.get("x-device-id")
+    if current_user:
+        owner = Favorite.user_id == current_user.id
+        deleted_owner = DeletedFavorite.user_id == current_user.id
+    elif device_id:
+        owner = Favorite.device_id == device_id
+        deleted_owner = DeletedFavorite.device_id == device_id
+    else:
+        raise HTTPException(400, "ログインするか X-Device-ID を指定してください")
+
+    creates = data.get("creates") or []
+    deletes = data.get("deletes") or []
+    if not isinstance(creates, list) or not isinstance(deletes, list):
+        raise HTTPException(400, "creates / deletes は配列で指定してください")
+    if len(creates) + len(deletes) > FAVORITES_SYNC_MAX_OPS:
+        raise HTTPException(413, f"creates と deletes は合わせて最大 {FAVORITES_SYNC_MAX_OPS} 件までです")
+    try:
+        since = int(data.get("since") or 0)
+        delete_ids = sorted({int(i) for i in deletes})
+    except (TypeError, ValueError):
+        raise HTTPException(400, "since / deletes は整数で指定してください")
+    rows = _parse_sync_creates(creates, device_id, current_user.id if current_user else None)
+
+    # ログイン済みなら、この端末で未ログイン時に作ったお気に入りも同じトランザクションで引き取る
+    if current_user and device_id:
+        await db.execute(
+            update(Favorite).where(Favorite.device_id == device_id, Favorite.user_id == None)
+            .values(user_id=current_user.id)
+        )
+
+    created = []
+    if rows:
+        result = await db.execute(insert(Favorite).returning(Favorite.id, sort_by_parameter_order=True), rows)
+        created = [
+            {"client_id": item.get("client_id"), "id": fav_id}
+            for item, fav_id in zip(creates, result.scalars())
+        ]
+    for start in range(0, len(delete_ids), SQLITE_IN_CHUNK):
+        chunk = delete_ids[start:start + SQLITE_IN_CHUNK]
+        await db.execute(
+            delete(Favorite).where(owner, Favorite.id.in_(chunk)).execution_options(synchronize_session=False)
+        )
+
+    # 書き込みと同じトランザクション内で読むので、返す version と変更一覧は食い違わない
+    version = await db.scalar(text("SELECT value FROM favorites_version"))
+    changes = (await db.execute(
+        select(*FAVORITE_COLUMNS).where(owner, Favorite.version > since).order_by(Favorite.version)
+    )).all()
+    deleted = (await db.scalars(
+        select(DeletedFavorite.id).where(deleted_owner, DeletedFavorite.version > since).order_by(DeletedFavorite.version)
+    )).all()
+    await db.commit()
+
+    return {
+        "status": "ok",
+        "version": version,
+        "created": created,
+        "changes": [_favorite_json(row) for row in changes],
+        "deleted": deleted,
+    }
 
 @app.delete("/favorites/{fav_id}")
-def delete_favorite(
+async def delete_favorite(
     fav_id: int,
     request: Request,
-    db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_optional_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal | None = Depends(get_optional_user)
 ):
-    q = db.query(Favorite).filter(Favorite.id == fav_id)
+    q = select(Favorite).where(Favorite.id == fav_id)
     if current_user:
-        q = q.filter(Favorite.user_id == current_user.id)
+        q = q.where(Favorite.user_id == current_user.id)
     else:
         device_id = request.headers.get("x-device-id")
-        q = q.filter(Favorite.device_id == device_id)
-    fav = q.first()
+        q = q.where(Favorite.device_id == device_id)
+    fav = await db.scalar(q.limit(1))
     if not fav:
         return {"status": "not_found"}
-    db.delete(fav); db.commit()
+    await db.delete(fav); await db.commit()
     return {"status": "deleted"}
 
+# -----------------------------------------------------------------------------
+# 地形分類 API（ローカルに取得済みの地理院 z14 タイルから引く）
+# -----------------------------------------------------------------------------
+@app.get("/terrain")
+async def get_terrain(lat: float = Query(...), lon: float = Query(...)):
+    if not (-85.0 < lat < 85.0 and -180.0 <= lon < 180.0):
+        raise HTTPException(400, "lat / lon の範囲が不正です")
+    return await lookup_terrain(lat, lon)
+
+async def lookup_terrain(lat: float, lon: float) -> dict:
+    if landform_store.tiles_cached(lat, lon):
+        return landform_store.lookup(lat, lon)
+    # 初めてのタイルはファイル読み込み + STRtree 構築が入るので、イベントループを止めないようスレッドで
+    return await run_in_threadpool(landform_store.lookup, lat, lon)
+
+# -----------------------------------------------------------------------------
+# 地図タイル中継（地理院のハザード / 土地条件ラスタ。ディスクキャッシュ付き）
+# -----------------------------------------------------------------------------
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+@app.get("/tiles/{layer}/{z}/{x}/{y}.png")
+async def get_tile(layer: str, z: int, x: int, y: int, request: Request):
+    if layer not in TILE_LAYERS:
+        raise HTTPException(404, "未対応のレイヤです")
+    if not (0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(404, "タイル座標が範囲外です")
+    try:
+        entry, outcome = await tile_proxy.get(layer, z, x, y)
+    except TileUpstreamError:
+        raise HTTPException(502, "タイルを取得できませんでした")
+
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": entry.cache_control or f"public, max-age={TILE_CLIENT_MAX_AGE_S}",
+        "X-Tile-Cache": outcome,
+    }
+    if entry.last_modified:
+        headers["Last-Modified"] = entry.last_modified
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    if entry.status == 404:
+        return Response(status_code=404, headers=headers)
+    return Response(entry.body, media_type=entry.content_type, headers=headers)
+
 # -----------------------------------------------------------------------------
 # 避難所 API
 # -----------------------------------------------------------------------------
 @app.get("/shelters/nearest")
-def shelters_nearest(lat: float, lon: float, limit: int = 3, db: Session = Depends(get_db)):
-    rows = db.query(Shelter).all()
-    if not rows:
-        return []
-    scored = []
-    for s in rows:
-        d = haversine_km(lat, lon, s.lat, s.lon)
-        scored.append({
-            "id": s.id, "name": s.name, "ward": s.ward, "address": s.address,
-            "type": s.type, "capacity": s.capacity, "lat": s.lat, "lon": s.lon,
-            "phone": s.phone, "opening_condition": s.opening_condition,
-            "distance_km": d
-        })
-    scored.sort(key=lambda x: x["distance_km"])
-    return scored[:max(1, min(limit, 20))]
+async def shelters_nearest(
+    lat: float,
+    lon: float,
+    limit: int = 3,
+    shelter_type: str | None = Query(None, alias="type"),
+    min_capacity: int | None = None,
+    ward: str | None = None,
+    mode: str = "straight",
+):
+    if mode not in ("straight", "walk"):
+        raise HTTPException(400, "mode は straight / walk のいずれかです")
+    used_mode, result = await find_shelters(lat, lon, max(1, min(limit, 20)), shelter_type, min_capacity, ward, mode)
+    # mode=walk でも徒歩の表が使えず直線距離で返した時は X-Shelter-Mode: straight（/risk/full の shelters.mode と同じ）
+    return Response(encode_payload(result), media_type="application/json", headers={"X-Shelter-Mode": used_mode})
+
+async def find_shelters(lat: float, lon: float, limit: int, shelter_type: str | None = None,
+                        min_capacity: int | None = None, ward: str | None = None,
+                        mode: str = "straight") -> tuple[str, list]:
+    # 戻り値: (実際に使った方式 "walk" | "straight", 避難所の一覧)
+    key = (snap_latlon(lat, lon, RESPONSE_CACHE_GRID_M), limit, shelter_type, min_capacity, ward, mode)
+    cached = shelter_cache.get(key)
+    if cached is not None:
+        return cached
+
+    await ensure_indexes()
+    result = None
+    if mode == "walk":
+        # 道路ノードごとに事前計算した「道のりの近い順 k 件」を引くだけ（scripts/build_walk_network.py）
+        if not walk_network_ready():
+            await run_in_threadpool(get_walk_network)
+        network = get_walk_network()
+        # 表を作った後に避難所が入れ替わっていたら、新しい避難所が載っていないので使わない
+        if network is not None and not network.stale(get_shelter_index()):
+            result = network.nearest(
+                lat, lon, min(limit, network.k), get_shelter_index(),
+                shelter_type=shelter_type, min_capacity=min_capacity, ward=ward,
+            )
+        if result is None:
+            # 徒歩ネットワークが無い・古い・道路から遠い → 直線距離で返す（順位の決め方は mode=straight と同じ）
+            mode = "straight"
+    if mode == "straight":
+        # 起動時に作ったインデックスから上位 limit 件だけを取り出す（距離は haversine、同じ距離は id 順）
+        result = get_shelter_index().nearest(
+            lat, lon, limit,
+            shelter_type=shelter_type, min_capacity=min_capacity, ward=ward,
+        )
+    shelter_cache.set(key, (mode, result))
+    return mode, result
+
+def warn_if_walk_network_stale():
+    # 読み込み済みの徒歩の表が今の避難所より古ければ知らせる（mode=walk は作り直すまで直線距離で返す）
+    network = get_walk_network() if walk_network_ready() else None
+    if network is not None and network.stale(get_shelter_index()):
+        logger.warning("徒歩ネットワークの表は今の避難所より古いので、mode=walk は直線距離で返します"
+                       "（scripts/build_walk_network.py で作り直してください）")
+
+# 地図の表示範囲にある避難所（低ズームではクラスタの重心・件数・収容人数の合計、高ズームでは個別）
+SHELTER_BBOX_MAX_ITEMS = int(os.getenv("SHELTER_BBOX_MAX_ITEMS", "1000"))
+
+def _parse_bbox(bbox: str) -> tuple[float, float, float, float]:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(400, "bbox は minLon,minLat,maxLon,maxLat で指定してください")
+    if not (min_lon <= max_lon and min_lat <= max_lat and -90 <= min_lat and max_lat <= 90):
+        raise HTTPException(400, "bbox の範囲が不正です")
+    return min_lon, min_lat, max_lon, max_lat
+
+@app.get("/shelters")
+async def shelters_in_bbox(bbox: str = Query(..., description="minLon,minLat,maxLon,maxLat"), zoom: float = Query(...)):
+    box = _parse_bbox(bbox)
+    await ensure_indexes()
+    return get_shelter_clusters().query(box, zoom, SHELTER_BBOX_MAX_ITEMS)
+
+# 区ごとの集計（overall_risk の分布・洪水/土砂/津波のある地点の割合・避難所数と収容人数）
+#   import スクリプト（または scripts/build_ward_stats.py）が作った ward_stats を返すだけ
+@app.get("/wards/{code}/stats")
+async def ward_stats(code: str):
+    if not (len(code) == 5 and code.isdigit()):
+        raise HTTPException(400, "区コードは5桁の数字（N03_007）で指定してください")
+    stats = await run_read(_read_ward_stats, code)
+    if stats is None:
+        raise HTTPException(404, "この区の集計はありません")
+    return stats
+
+def _read_ward_stats(db: Session, code: str) -> dict | None:
+    row = db.execute(select(WardStats).where(WardStats.code == code)).scalar_one_or_none()
+    if row is None:
+        return None
+    counts = db.execute(
+        select(WardRiskCount.overall_risk, WardRiskCount.points)
+        .where(WardRiskCount.code == code).order_by(WardRiskCount.overall_risk)
+    ).all()
+    return ward_stats_json(row, [tuple(c) for c in counts])
 
 # -----------------------------------------------------------------------------
 # 共通エラーハンドラ
 # -----------------------------------------------------------------------------
 from fastapi.responses import JSONResponse
-import traceback
 
 @app.exception_handler(Exception)
 async def all_exception_handler(request: Request, exc: Exception):
-    print("\n=== Internal Server Error Traceback ===")
-    traceback.print_exc()
-    print("========================================\n")
+    logger.exception("Internal Server Error: %s %s", request.method, request.url.path)
     return JSONResponse(status_code=500, content={"status": "error", "detail": str(exc)})
 
 
@@ -448,6 +944,39 @@ async def all_exception_handler(request: Request, exc: Exception):
 def _debug_auth_scheme():
     return {"schemes": pwd_context.schemes()}
 
+@app.get("/_debug/auth_pool")
+def _debug_auth_pool():
+    return password_pool.stats()
+
+@app.get("/_debug/cache")
+def _debug_cache():
+    return {
+        "grid_m": RESPONSE_CACHE_GRID_M,
+        "risk": risk_cache.stats(),
+        "shelters": shelter_cache.stats(),
+        "principals": principal_cache.stats(),
+        "landform_tiles": landform_store.stats(),
+        "risk_payloads": risk_payloads.stats(),
+        "risk_full_inflight": risk_full_flight.stats(),
+    }
+
+@app.get("/_debug/tiles")
+def _debug_tiles():
+    return {**tile_proxy.stats(), "risk_tiles": risk_tiles.stats()}
+
+@app.get("/_debug/walk_network")
+def _debug_walk_network():
+    network = get_walk_network()
+    if network is None:
+        return {"enabled": False}
+    # stale: 表を作った後に避難所が入れ替わった（scripts/build_walk_network.py で作り直す）
+    return {"enabled": True, **network.meta, "snap_nodes": len(network.snap_nodes),
+            "stale": network.stale(get_shelter_index())}
+
+@app.get("/_debug/datasets")
+def _debug_datasets():
+    return {"versions": dataset_versions, "check_interval_s": DATASET_CHECK_INTERVAL_S, **dataset_reloads}
+
 @app.get("/_debug/cors")
 def _debug_cors():
     return {"allow_origins": ALLOW_ORIGINS}
@@ -456,3 +985,29 @@ def _debug_cors():
 def health():
     return {"ok": True}
 
+# -----------------------------------------------------------------------------
+# GET /metrics（Prometheus のテキスト形式。値はこのワーカーの分）
+# -----------------------------------------------------------------------------
+def _response_cache_metrics():
+    caches = {"risk": risk_cache.stats(), "shelters": shelter_cache.stats(), "principals": principal_cache.stats()}
+    return [
+        ("response_cache_hits_total", "counter", "キャッシュのヒット数",
+         [({"cache": name}, c["hits"]) for name, c in caches.items()]),
+        ("response_cache_misses_total", "counter", "キャッシュのミス数",
+         [({"cache": name}, c["misses"]) for name, c in caches.items()]),
+        ("response_cache_entries", "gauge", "キャッシュの件数",
+         [({"cache": name}, c["size"]) for name, c in caches.items()]),
+    ]
+
+metrics.register_collector(_response_cache_metrics)
+metrics.register_collector(lambda: [
+    ("dataset_version", "gauge", "このワーカーが読み込んでいるデータの版（dataset_versions）",
+     [({"dataset": name}, version) for name, version in sorted(dataset_versions.items())]),
+    ("dataset_reloads_total", "counter", "データの読み直し回数",
+     [({"result": "ok"}, dataset_reloads["reloads"]), ({"result": "error"}, dataset_reloads["failures"])]),
+])
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
@@ -0,0 +1,120 @@
+# cache.py
+# プロセス内キャッシュ（LRU + TTL、件数上限つき）、同じ処理の相乗り（SingleFlight）と座標の量子化
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+
+M_PER_DEG_LAT = 111_320.0
+
+
+def snap_latlon(lat: float, lon: float, grid_m: float) -> tuple[int, int]:
+    # 緯度経度を約 grid_m [m] 四方のセル番号に丸める（経度方向は緯度に応じて幅を補正）
+    i = round(lat * M_PER_DEG_LAT / grid_m)
+    m_per_deg_lon = M_PER_DEG_LAT * math.cos(math.radians(i * grid_m / M_PER_DEG_LAT))
+    j = round(lon * m_per_deg_lon / grid_m)
+    return i, j
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float | None):
+        self.maxsize = maxsize
+        self.ttl = ttl  # None なら期限なし（件数上限だけの LRU）
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0      # 上限超過で追い出した件数
+        self.expirations = 0    # TTL 切れで捨てた件数
+        self.invalidations = 0  # clear() の回数
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = math.inf if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        # 有効なエントリがあるか（ヒット数・LRU 順は変えない）
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[0] > time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class SingleFlight:
+    # 同じキーの処理が実行中なら新しく始めず、その結果を待つ（連打・重複クリックで同じ計算を何度もしない）
+    #   result = await flight.do(key, lambda: coroutine(...))
+    # 結果は保持しない（終わったらキーを外す）。保持したい場合は TTLCache と組み合わせる
+    def __init__(self):
+        self._inflight: dict = {}  # key -> asyncio.Task
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, start):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        # 最初に頼んだクライアントが切断しても、相乗りしている他のリクエストのために処理は続ける
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # 待ち手が全員切断していても「例外が回収されない」警告を出さない
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._inflight), "started": self.started, "coalesced": self.coalesced}
@@ -1,37 +1,86 @@
-# database.py
-# import os
-# from sqlalchemy import create_engine
-# from sqlalchemy.orm import sessionmaker, declarative_base
-# 
-# 
-# DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:////data/app.db")
-# connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-# engine = create_engine(DATABASE_URL, future=True, echo=False, connect_args=connect_args)
-# SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
-# Base = declarative_base()
-
-
 # backend/database.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+# DATABASE_URL から書き込み用 / 読み取り専用の 2 つのエンジンを作る
+#   書き込み: 接続 1 本だけ（SQLite の書き込みロックを取り合わない）
+#   読み取り: query_only の接続プール（WAL なので書き込み中でも読める）
+# API の書き込みは aiosqlite の非同期エンジン。読み取り（API の短いクエリ・インデックスの構築）と
+# import スクリプト・起動時の DDL は同期エンジンを使う
+import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, declarative_base
+
+load_dotenv(dotenv_path=Path(__file__).parent / ".env")  # backend/.env を読む（スクリプトからも有効）
+
 Base = declarative_base()
 
-# ここにあなたの実在DBパスを入れる（ダブルクォートはPythonの文字列用で、URL内には入れない）
-DB_PATH = Path(r"C:\python_first_project\my-python\map-app\project4.1.1\backend\data\app.db")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/app.db")
 
-# Windowsでも安全にURL化（/ 区切りに変換）
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH.as_posix()}"
+# SQLite のチューニング（環境ごとに上書き可）
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))   # 接続ごと
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", "8"))
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    pool_pre_ping=True,
-    future=True,
+_url = make_url(DATABASE_URL)
+IS_SQLITE = _url.get_backend_name() == "sqlite"
+# 非同期ドライバ付きの URL（sqlite:// → sqlite+aiosqlite://）。他 DB は ASYNC_DATABASE_URL で指定
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    _url.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False) if IS_SQLITE else DATABASE_URL
 )
+DB_PATH = Path(_url.database) if IS_SQLITE and _url.database not in (None, "", ":memory:") else None
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if DB_PATH is not None:
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-print(f"[DB] URL = {SQLALCHEMY_DATABASE_URL}")
-print(f"[DB] File exists? {DB_PATH.exists()} | Path = {DB_PATH}")
+
+def _apply_sqlite_pragmas(dbapi_conn, query_only: bool):
+    cur = dbapi_conn.cursor()
+    if not query_only:
+        cur.execute("PRAGMA journal_mode=WAL")  # ファイルに記録されるので書き込み側で1回設定すれば良い
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    if query_only:
+        cur.execute("PRAGMA query_only=ON")
+    cur.close()
+
+
+if IS_SQLITE:
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=1,
+        max_overflow=0,
+        pool_pre_ping=True,
+        future=True,
+    )
+    read_engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=DB_READ_POOL_SIZE,
+        max_overflow=DB_READ_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        future=True,
+    )
+
+    # aiosqlite は DB 操作のたびに接続スレッドとの往復が1回増えるので、ローカルファイルでは pool_pre_ping は付けない
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=1, max_overflow=0)
+
+    for _write_engine in (engine, async_engine.sync_engine):
+        event.listen(_write_engine, "connect", lambda conn, _rec: _apply_sqlite_pragmas(conn, query_only=False))
+    event.listen(read_engine, "connect", lambda conn, _rec: _apply_sqlite_pragmas(conn, query_only=True))
+else:
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
+    read_engine = engine
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+# 非同期セッションは commit 後に属性を読み直さない（await なしの遅延ロードを避ける）
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
@@ -0,0 +1,36 @@
+# dataset_versions.py
+# データの版（dataset_versions テーブル）
+#   ・import / build スクリプトは取り込みを最後まで終えてから bump_dataset_version() で版を上げる
+#     （途中の状態では上げないので、ワーカーが取り込み途中のテーブルを読み込むことはない）
+#   ・API の各ワーカーは DATASET_CHECK_INTERVAL_S ごとにこの数行の表だけを読み、版が変わったデータの
+#     インデックス・キャッシュをバックグラウンドで作り直してから差し替える（app_API.watch_dataset_versions）
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import DatasetVersion
+
+TERRAIN_RISK = "terrain_risk"   # import_csv_to_db.py
+SHELTERS = "shelters"           # import_shelters_from_geojson.py
+RISK_RASTER = "risk_raster"     # build_risk_raster.py（RISK_RASTER_DIR のファイル）
+WALK_NETWORK = "walk_network"   # build_walk_network.py（WALK_NETWORK_DIR のファイル）
+
+DATASET_VERSIONS_QUERY = select(DatasetVersion.name, DatasetVersion.version)
+
+
+def bump_dataset_version(engine, *names: str) -> dict[str, int]:
+    # 戻り値: 上げた後の全データの版
+    DatasetVersion.__table__.create(bind=engine, checkfirst=True)
+    stmt = sqlite_insert(DatasetVersion.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_={"version": DatasetVersion.version + 1, "updated_at": func.now()},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, [{"name": name, "version": 1} for name in names])
+        return dict(conn.execute(DATASET_VERSIONS_QUERY).all())
+
+
+def print_bumped(versions: dict[str, int], *names: str):
+    # import スクリプト用
+    bumped = ", ".join(f"{name} v{versions[name]}" for name in names)
+    print(f"   データの版: {bumped}（API のワーカーは DATASET_CHECK_INTERVAL_S 秒以内に読み直します）")
@@ -0,0 +1,54 @@
+# geojson_stream.py
+# 巨大な GeoJSON を json.load せずに feature 単位で読み出す（メモリ使用量は feature 1件分 + 読込バッファ）
+import json
+import re
+
+_FEATURES_RE = re.compile(r'"features"\s*:\s*\[')
+_SKIP = " \t\r\n,"
+
+
+def iter_features(path, read_size: int = 1 << 16):
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        # "features": [ の直後まで読み進める
+        buf = ""
+        while True:
+            chunk = f.read(read_size)
+            if not chunk:
+                return
+            buf += chunk
+            m = _FEATURES_RE.search(buf)
+            if m:
+                buf = buf[m.end():]
+                break
+            buf = buf[-64:]  # キーがチャンク境界で切れた場合に備えて末尾だけ残す
+
+        pos = 0
+        while True:
+            # 区切り（空白・カンマ）を飛ばす
+            while pos < len(buf) and buf[pos] in _SKIP:
+                pos += 1
+            if pos >= len(buf):
+                chunk = f.read(read_size)
+                if not chunk:
+                    return
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            if buf[pos] == "]":
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # feature がバッファ境界をまたいでいる → 追加で読んでやり直し
+                # 読み足す量は少なくとも今の未解析分と同じだけ（巨大なポリゴンでも解析し直しは合計で2倍程度に収まる）
+                chunk = f.read(max(read_size, len(buf) - pos))
+                if not chunk:
+                    raise
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+
+            yield obj
+            pos = end
+            if pos > read_size:
+                buf, pos = buf[pos:], 0
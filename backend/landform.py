@@ -0,0 +1,315 @@
+# landform.py
+# 国土地理院「地形分類」ベクトルタイル（z14 GeoJSON）をローカルのタイル置き場から引いて地点の地形を判定する
+#   置き場: {LANDFORM_TILE_DIR}/{layer}/14/{x}/{y}.geojson（scripts/seed_landform_tiles.py で事前に取得）
+#   読み込んだタイルは feature ごとの shapely ジオメトリ + STRtree にして LRU で持つ
+#   （同じ地域のクリックが続くので、2回目以降は STRtree の検索だけで返せる）
+import json
+import math
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+from shapely import STRtree
+from shapely.geometry import Point, shape
+
+from cache import TTLCache
+
+LANDFORM_TILE_DIR = Path(os.getenv("LANDFORM_TILE_DIR", "./data/landform_tiles"))
+LANDFORM_TILE_CACHE_SIZE = int(os.getenv("LANDFORM_TILE_CACHE_SIZE", "256"))  # 1 レイヤの 1 タイルで 1 件
+LANDFORM_ZOOM = 14
+# Point の feature はこの距離 [度] 以内なら一致扱い（約 100m。frontend の判定と同じ）
+LANDFORM_POINT_TOLERANCE_DEG = 0.001
+
+# 後ろのレイヤほど優先（frontend は自然→人工の順に見て、後から当たったものを採用していた）
+LANDFORM_LAYERS = (
+    ("natural", "experimental_landformclassification1"),
+    ("artificial", "experimental_landformclassification2"),
+)
+
+# properties のどのキーに分類コードが入っているかはレイヤ・版によって揺れるので、順に探す
+CODE_KEYS = (
+    "LandformClassification", "landform_classification",
+    "code", "type", "class", "classification",
+    "landform", "地形分類", "分類コード", "CODE", "TYPE", "CLASS",
+)
+
+LANDFORM_NAMES = {
+    # === ベクトルタイル「地形分類」 ===
+
+    # 山地・丘陵地
+    "10101": "山地斜面",
+    "11201": "火砕丘",
+    "11202": "溶岩円頂丘",
+    "11203": "火口",
+    "11204": "溶岩流地形",
+    "1010101": "山地",
+
+    # 崖・段丘崖
+    "10202": "崖/壁岩",
+    "10204": "禿しゃ地・露岩",
+    "2010201": "崖（段丘崖）",
+
+    # 地すべり地形
+    "10205": "地すべり（滑落崖）／地すべり（崩壊部）",
+    "10206": "地すべり（移動体）／地すべり（堆積部）",
+
+    # 台地・段丘
+    "10301": "高位面",
+    "10302": "上位面",
+    "10303": "中位面",
+    "10304": "下位面",
+    "10305": "完新世段丘／低位面",
+    "10306": "台地･段丘",
+    "10307": "対比困難な段丘",
+    "10308": "洪積台地",
+    "10310": "岩石台地",
+    "10312": "溶岩台地",
+    "10314": "更新世段丘",
+    "10508": "台地･段丘状の地形",
+    "2010101": "段丘面",
+
+    # 山麓堆積地形
+    "10401": "麓屑面",
+    "10402": "崖錐",
+    "10403": "土石流堆",
+    "10404": "土石流段丘",
+    "10406": "山麓堆積地形",
+    "10407": "崖錐・麓屑面・土石流堆",
+    "3010101": "山麓堆積地形",
+
+    # 扇状地
+    "10501": "扇状地",
+    "10502": "緩扇状地",
+    "3020101": "扇状地",
+
+    # 自然堤防
+    "10503": "自然堤防",
+    "3040101": "微高地（自然堤防）",
+
+    # 天井川等
+    "10506": "天井川・天井川沿いの微高地／天井川沿微高地",
+    "10507": "旧天井川の微高地",
+    "10801": "天井川の部分",
+
+    # 砂州・砂丘
+    "10504": "砂丘",
+    "10505": "砂（礫）堆・州",
+    "10512": "砂州・砂堆・砂丘",
+    "3050101": "砂州・砂丘",
+
+    # 凹地・浅い谷
+    "10601": "凹地・浅い谷",
+    "2010301": "浅い谷",
+
+    # 氾濫平野・海岸平野
+    "10701": "谷底平野・氾濫平野",
+    "10702": "海岸平野・三角州",
+    "10705": "湖岸平野・三角州",
+    "3030101": "氾濫平野",
+
+    # 後背低地・湿地
+    "10703": "後背低地",
+    "10804": "湿地／湿地・水草地",
+    "3030201": "後背湿地",
+
+    # 旧河道
+    "10704": "旧河道",
+    "3040201": "旧河道（明瞭）",
+    "3040202": "旧河道（不明瞭）",
+    "3040301": "落堀",
+
+    # 河川敷・浜
+    "10802": "高水敷",
+    "10803": "低水敷・浜",
+    "10807": "低水敷・浜・潮汐平野",
+    "10808": "高水敷・低水敷・浜",
+
+    # 水部
+    "10805": "落堀",
+    "10806": "潮汐平野",
+    "10901": "水部",
+    "10903": "河川・水涯線及び水面",
+    "5010201": "現河道・水面",
+
+    # 旧水部
+    "10904": "旧水部",
+    "5010301": "旧水部",
+
+    # 切土地
+    "11001": "切土地／平坦化地",
+    "11003": "切土斜面",
+    "11009": "凹陥地",
+    "11011": "切土地",
+    "4010301": "切土地",
+
+    "11002": "農耕平坦化地",
+
+    "11008": "干拓地",
+    "4010101": "干拓地",
+
+    "11004": "盛土斜面",
+    "11005": "高い盛土地",
+    "11006": "盛土地",
+    "11007": "埋土地",
+    "11014": "盛土地・埋立地",
+    "4010201": "盛土地・埋立地",
+
+    "11010": "改変工事中",
+}
+
+
+def landform_name(code) -> str:
+    # frontend の getLandformName と同じ表記にそろえる
+    code = str(code).strip()
+    if code in LANDFORM_NAMES:
+        return LANDFORM_NAMES[code]
+    if not re.match(r"[+-]?\d", code):  # parseInt できない文字列
+        return f"地形分類（{code}）"
+    return f"未分類地形（コード: {code}）"
+
+
+def lonlat_to_tile(lon: float, lat: float, zoom: int = LANDFORM_ZOOM) -> tuple[int, int]:
+    # Web メルカトルの XYZ タイル番号（frontend の計算式と同じ）
+    n = 2 ** zoom
+    x = math.floor((lon + 180.0) / 360.0 * n)
+    lat_r = math.radians(lat)
+    y = math.floor((1.0 - math.log(math.tan(lat_r) + 1.0 / math.cos(lat_r)) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def tiles_in_bbox(bbox, zoom: int):
+    # bbox = (minLon, minLat, maxLon, maxLat) にかかる (x, y) を列挙する
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = lonlat_to_tile(min_lon, max_lat, zoom)  # 北西
+    x1, y1 = lonlat_to_tile(max_lon, min_lat, zoom)  # 南東
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+def tile_path(layer: str, x: int, y: int, zoom: int = LANDFORM_ZOOM) -> Path:
+    return LANDFORM_TILE_DIR / layer / str(zoom) / str(x) / f"{y}.geojson"
+
+
+def _feature_code(props: dict):
+    for key in CODE_KEYS:
+        value = props.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+class LandformTile:
+    # 1 レイヤ・1 タイル分。geoms[i] と codes[i] が対応する
+    def __init__(self, geoms: list, codes: list):
+        self.codes = codes
+        self.is_point = np.array([g.geom_type in ("Point", "MultiPoint") for g in geoms], dtype=bool)
+        self.tree = STRtree(geoms) if geoms else None
+
+    @classmethod
+    def from_file(cls, path: Path) -> "LandformTile":
+        if not path.exists():
+            return EMPTY_TILE
+        with open(path, "rb") as f:
+            data = json.load(f)
+        geoms, codes = [], []
+        for ft in data.get("features") or []:
+            geom = ft.get("geometry")
+            if not geom or not geom.get("coordinates"):
+                continue
+            try:
+                g = shape(geom)
+            except (ValueError, TypeError, AttributeError):
+                continue  # 壊れたジオメトリは読み飛ばす
+            if g.is_empty:
+                continue
+            geoms.append(g)
+            codes.append(_feature_code(ft.get("properties") or {}))
+        return cls(geoms, codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def containing(self, pt: Point) -> int | None:
+        # 点を含む（Point feature なら許容距離内の）feature のうち、タイル内で最後のもの
+        if self.tree is None:
+            return None
+        hits = self.tree.query(pt, predicate="dwithin", distance=LANDFORM_POINT_TOLERANCE_DEG)
+        best = None
+        for i in hits.tolist():
+            if not self.is_point[i] and not self.tree.geometries[i].intersects(pt):
+                continue
+            if best is None or i > best:
+                best = i
+        return best
+
+    def nearest(self, pt: Point) -> tuple[int | None, float]:
+        if self.tree is None:
+            return None, math.inf
+        idx, dist = self.tree.query_nearest(pt, return_distance=True)
+        if len(idx) == 0:
+            return None, math.inf
+        return int(idx[0]), float(dist[0])
+
+
+EMPTY_TILE = LandformTile([], [])  # 未取得 / 該当データなしのタイル（これもキャッシュして再読込を防ぐ）
+
+
+class LandformStore:
+    def __init__(self, cache_size: int):
+        self._tiles = TTLCache(cache_size, None)  # 期限なし（LRU として使う）
+        self.tile_loads = 0
+
+    def tiles_cached(self, lat: float, lon: float) -> bool:
+        x, y = lonlat_to_tile(lon, lat)
+        return all((layer, x, y) in self._tiles for _, layer in LANDFORM_LAYERS)
+
+    def tile(self, layer: str, x: int, y: int) -> LandformTile:
+        key = (layer, x, y)
+        tile = self._tiles.get(key)
+        if tile is None:
+            # 同じタイルを同時に読むことがあっても結果は同じなので、ロックは取らない
+            tile = LandformTile.from_file(tile_path(layer, x, y))
+            self.tile_loads += 1
+            self._tiles.set(key, tile)
+        return tile
+
+    def lookup(self, lat: float, lon: float) -> dict:
+        x, y = lonlat_to_tile(lon, lat)
+        pt = Point(lon, lat)
+        tiles = [(kind, self.tile(layer, x, y)) for kind, layer in LANDFORM_LAYERS]
+
+        match, kind, tile, idx = None, None, None, None
+        for k, t in reversed(tiles):
+            i = t.containing(pt)
+            if i is not None:
+                match, kind, tile, idx = "inside", k, t, i
+                break
+        if match is None:
+            # どれにも含まれない（タイル境界の隙間など）ときは、同じタイル内で一番近い feature を使う
+            best = math.inf
+            for k, t in tiles:
+                i, dist = t.nearest(pt)
+                if i is not None and dist < best:
+                    match, kind, tile, idx, best = "nearest", k, t, i, dist
+
+        base = {"tile": {"z": LANDFORM_ZOOM, "x": x, "y": y}}
+        if match is None:
+            return {"status": "no_data", "code": None, "name": "地形分類データなし", "layer": None, "match": None, **base}
+        code = tile.codes[idx]
+        if code is None:
+            name = f"地形データあり（{'自然地形' if kind == 'natural' else '人工地形'}）"
+        else:
+            code = str(code).strip()
+            name = landform_name(code)
+        return {"status": "ok", "code": code, "name": name, "layer": kind, "match": match, **base}
+
+    def clear(self):
+        self._tiles.clear()
+
+    def stats(self) -> dict:
+        return {"tile_dir": str(LANDFORM_TILE_DIR), "tile_loads": self.tile_loads, **self._tiles.stats()}
+
+
+landform_store = LandformStore(LANDFORM_TILE_CACHE_SIZE)
@@ -0,0 +1,245 @@
+# metrics.py
+# GET /metrics（Prometheus のテキスト形式）用の計測
+#   ・ルートごと: リクエスト数（ステータス別）・所要時間のヒストグラム・処理中の数
+#   ・SQL: エンジン / 種類ごとの文の数と所要時間、リクエストごとの文の数と合計時間、遅いクエリのログ
+# prometheus_client は使わず、必要な分だけ（Counter / Gauge / Histogram とテキスト出力）をここに持つ。
+# 値はプロセスごと（uvicorn --workers N では scrape したワーカーの分だけが返る。process_start_time_seconds の pid で区別できる）
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))  # これ以上かかった SQL をログに出す（0 で出さない）
+SLOW_QUERY_LOG_CHARS = int(os.getenv("SLOW_QUERY_LOG_CHARS", "500"))  # ログに載せる SQL の長さ（パラメータは載せない）
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# 文の種類のラベル（これ以外は OTHER。ラベルの種類を増やさない）
+STATEMENT_KINDS = frozenset(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "PRAGMA", "REPLACE"))
+
+slow_query_logger = logging.getLogger("app.slow_query")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series: dict[tuple, object] = {}
+        self._lock = threading.Lock()  # SQL のイベントはスレッドプールからも来る
+        REGISTRY.append(self)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in series]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+    def set(self, labels: tuple, value: float):
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = REQUEST_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(float(b) for b in buckets)
+
+    def observe(self, labels: tuple, value: float):
+        i = bisect_left(self.buckets, value)  # le は「以下」なので境界ちょうどは内側
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = sorted((k, (list(counts), total)) for k, (counts, total) in self._series.items())
+        lines = self.header()
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+_collectors = []
+
+
+def register_collector(collect):
+    # 他のモジュールが持っている集計（キャッシュのヒット数など）を scrape の時に読む
+    #   collect() -> [(name, "counter" | "gauge", help, [({label: value}, 数値), ...]), ...]
+    _collectors.append(collect)
+
+
+_started_at = time.time()
+register_collector(lambda: [(
+    "process_start_time_seconds", "gauge", "このワーカーの起動時刻（UNIX 時刻）", [({"pid": os.getpid()}, _started_at)],
+)])
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------------------------------------------------------
+# HTTP
+# -----------------------------------------------------------------------------
+http_requests = Counter("http_requests_total", "処理したリクエスト数", ("method", "route", "status"))
+http_duration = Histogram(
+    "http_request_duration_seconds", "リクエストの処理時間（応答を送り終えるまで）", ("method", "route"), REQUEST_BUCKETS
+)
+http_in_flight = Gauge("http_requests_in_flight", "処理中のリクエスト数", ("method", "route"))
+http_db_statements = Histogram(
+    "http_request_db_statements", "1リクエストで実行した SQL 文の数", ("method", "route"), STATEMENT_COUNT_BUCKETS
+)
+http_db_seconds = Histogram(
+    "http_request_db_seconds", "1リクエストで SQL にかかった合計時間", ("method", "route"), REQUEST_BUCKETS
+)
+
+
+class _RequestStats:
+    __slots__ = ("route", "statements", "seconds")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# 実行中のリクエストの SQL 集計。スレッドプール（run_in_threadpool）や aiosqlite の greenlet にも
+# コンテキストごと引き継がれるので、どこで実行された SQL でも同じオブジェクトに足される
+_request_stats: ContextVar[_RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class InstrumentedRoute(APIRoute):
+    # app.router.route_class に設定する。ラベルは実際のパスではなくルートのテンプレート（/wards/{code}/stats）
+    async def handle(self, scope, receive, send):
+        if not METRICS_ENABLED or scope["type"] != "http":
+            return await super().handle(scope, receive, send)
+        labels = (scope["method"], self.path)
+        status = 500  # 応答を始める前に例外で抜けたら 500 として数える
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = _RequestStats(self.path)
+        token = _request_stats.set(stats)
+        http_in_flight.inc(labels)
+        started = time.perf_counter()
+        try:
+            await super().handle(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec(labels)
+            _request_stats.reset(token)
+            http_requests.inc(labels + (str(status),))
+            http_duration.observe(labels, elapsed)
+            http_db_statements.observe(labels, stats.statements)
+            http_db_seconds.observe(labels, stats.seconds)
+
+
+# -----------------------------------------------------------------------------
+# SQL（SQLAlchemy のエンジンイベント）
+# -----------------------------------------------------------------------------
+db_statements = Counter("db_statements_total", "実行した SQL 文の数", ("engine", "kind"))
+db_duration = Histogram("db_statement_duration_seconds", "SQL 文の実行時間", ("engine", "kind"), QUERY_BUCKETS)
+db_slow = Counter("db_slow_statements_total", "SLOW_QUERY_MS 以上かかった SQL 文の数", ("engine", "kind"))
+
+
+def _statement_kind(statement: str) -> str:
+    head = statement.lstrip()[:8].split(None, 1)
+    kind = head[0].upper() if head else ""
+    return kind if kind in STATEMENT_KINDS else "OTHER"
+
+
+def instrument_engine(engine, name: str):
+    # 同期エンジン（非同期エンジンは .sync_engine）に計測を付ける。name は engine ラベル
+    if not METRICS_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("metrics_started", time.perf_counter())
+        labels = (name, _statement_kind(statement))
+        db_statements.inc(labels)
+        db_duration.observe(labels, elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += elapsed
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            db_slow.inc(labels)
+            slow_query_logger.warning(
+                "%.1f ms [%s] route=%s%s: %s", elapsed * 1000, name, stats.route if stats else "-",
+                " (executemany)" if executemany else "", " ".join(statement.split())[:SLOW_QUERY_LOG_CHARS],
+            )
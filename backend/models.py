@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean, func
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean, Index, LargeBinary, func
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -34,6 +34,25 @@ class TerrainRisk(Base):
     elev_score = Column(Float, nullable=True)
     slope_score = Column(Float, nullable=True)
     river_score = Column(Float, nullable=True)
+    # /risk の応答（risk_payloads.id）。import スクリプトが取り込み後に振る
+    payload_id = Column(Integer, nullable=True)
+    # 区コード（N03_007）。ward_stats.build_ward_stats が空間結合で振る（NULL = 未判定, "" = どの区にも入らない）
+    ward_code = Column(String, nullable=True)
+
+    __table_args__ = (
+        # 同一地点の重複登録を防ぐ（import_csv_to_db.py は INSERT OR IGNORE で使う）
+        Index("ux_terrain_risk_lat_lon", "lat", "lon", unique=True),
+        Index("ix_terrain_risk_ward_code", "ward_code"),
+    )
+
+
+# /risk の応答 JSON（UTF-8）。同じ内容の地点は1件を共有する（risk_payloads.build_risk_payloads が作る）
+class RiskPayload(Base):
+    __tablename__ = "risk_payloads"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)  # 作った時の RISK_PAYLOAD_VERSION（文面を変えたら作り直す）
+    body = Column(LargeBinary, nullable=False)
 
 
 # Favorite
@@ -57,9 +76,34 @@ class Favorite(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=True)  # 変更番号（schema.ensure_favorites_sync のトリガが振る）
 
     user = relationship("User", back_populates="favorites")
 
+    __table_args__ = (
+        # GET /favorites のキーセットページング（created_at 降順 → id 降順）用
+        Index("ix_favorites_user_created", "user_id", "created_at"),
+        Index("ix_favorites_device_created", "device_id", "created_at"),
+        # POST /favorites/sync の「version 以降の変更」用
+        Index("ix_favorites_user_version", "user_id", "version"),
+        Index("ix_favorites_device_version", "device_id", "version"),
+    )
+
+
+# 削除されたお気に入りの墓標（POST /favorites/sync でクライアントに削除を伝える。トリガが書く）
+class DeletedFavorite(Base):
+    __tablename__ = "favorites_deleted"
+
+    id = Column(Integer, primary_key=True)  # 削除された favorites.id
+    user_id = Column(Integer, nullable=True)
+    device_id = Column(String, nullable=True)
+    version = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_favorites_deleted_user_version", "user_id", "version"),
+        Index("ix_favorites_deleted_device_version", "device_id", "version"),
+    )
+
 
 class Shelter(Base):
     __tablename__ = "shelters"
@@ -74,5 +118,46 @@ class Shelter(Base):
     phone = Column(String)
     opening_condition = Column(String)                     # 開設条件
     source = Column(String)                                # データ出典
+    ward_code = Column(String)                             # 区コード（N03 との空間結合。ward_stats.build_ward_stats が振る）
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # import_shelters_from_geojson.py の upsert（ON CONFLICT）のキー
+        Index("ux_shelters_name_lat_lon", "name", "lat", "lon", unique=True),
+    )
+
+
+# 区ごとの集計（ward_stats.build_ward_stats が作る。GET /wards/{code}/stats）
+class WardStats(Base):
+    __tablename__ = "ward_stats"
+
+    code = Column(String, primary_key=True)                # N03_007
+    name = Column(String)                                  # 政令市の区は「大阪市北区」
+    boundary_version = Column(String, nullable=False)      # 区界ファイルの版（変わったら全件作り直す）
+    terrain_points = Column(Integer, nullable=False, default=0)
+    overall_risk_mean = Column(Float)
+    flood_points = Column(Integer, nullable=False, default=0)      # flood_risk > 0 の地点数
+    landslide_points = Column(Integer, nullable=False, default=0)
+    tsunami_points = Column(Integer, nullable=False, default=0)
+    shelter_count = Column(Integer, nullable=False, default=0)
+    shelter_capacity = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+
+# 区ごとの overall_risk の分布（値ごとの地点数）
+class WardRiskCount(Base):
+    __tablename__ = "ward_risk_counts"
+
+    code = Column(String, primary_key=True)
+    overall_risk = Column(Integer, primary_key=True)
+    points = Column(Integer, nullable=False)
+
+
+# データの版（import / build スクリプトが取り込みの最後に上げる。API のワーカーはこれを見て読み直す）
+class DatasetVersion(Base):
+    __tablename__ = "dataset_versions"
+
+    name = Column(String, primary_key=True)               # terrain_risk / shelters / risk_raster / walk_network
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), nullable=False)
@@ -0,0 +1,164 @@
+# password_pool.py
+# パスワードのハッシュ化・検証を専用のプロセスプールで実行する
+#   ・pbkdf2 は 1回数十ms CPU を使うので、リクエスト用スレッドやイベントループから切り離す
+#   ・同時に抱える件数（実行中 + 待ち）に上限を設け、超えたら PasswordPoolBusy で即座に断る
+#     → ログイン集中時も /risk や /shelters 側のスレッドを食い潰さない
+#   ・メモリは概算で「ワーカー数 × 約 23 MB」（spawn した Python + passlib の RSS。Linux / Python 3.11 で計測）
+#     pbkdf2 が使うメモリは rounds によらず一定で、rounds が変えるのは1回あたりの CPU 時間だけ
+#     （rounds=29,000 / 600,000 / 3,000,000 で RSS は変わらなかった）。待ち行列が持つのは平文とハッシュの文字列だけ
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from passlib.context import CryptContext
+from passlib.hash import pbkdf2_sha256
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16"))
+# pbkdf2_sha256 の rounds（0 なら passlib の既定値）。既存ハッシュは自分の rounds で検証される
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "0"))
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+# -----------------------------------------------------------------------------
+# ワーカープロセス側で実行される関数（pickle できるようモジュール直下に置く）
+# -----------------------------------------------------------------------------
+_pwd_context = None
+
+
+def _context() -> CryptContext:
+    global _pwd_context
+    if _pwd_context is None:
+        _pwd_context = CryptContext(
+            schemes=["pbkdf2_sha256", "bcrypt_sha256", "bcrypt"],  # 旧 bcrypt ハッシュも検証できるように
+            deprecated="auto",
+            bcrypt__truncate_error=False,
+        )
+    return _pwd_context
+
+
+def _hash(plain: str, rounds: int) -> str:
+    hasher = pbkdf2_sha256.using(rounds=rounds) if rounds else pbkdf2_sha256
+    return hasher.hash(plain)
+
+
+def _verify(plain: str, hashed: str) -> bool:
+    return _context().verify(plain, hashed)
+
+
+def _timed(fn, *args):
+    # 待ち時間・実行時間の計測用にワーカー内の開始/終了時刻も返す
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time()
+
+
+# -----------------------------------------------------------------------------
+# プール本体（API プロセス側）
+# -----------------------------------------------------------------------------
+class PasswordPool:
+    def __init__(self, workers: int, max_pending: int, rounds: int = 0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_wait_s = 0.0
+        self.run_s = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # import 時に子プロセスを作らないよう初回利用時に起動する
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    def submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordPoolBusy()
+        submitted_at = time.time()
+        with self._lock:
+            self.submitted += 1
+            self.pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        try:
+            inner = self._get_executor().submit(_timed, fn, *args)
+        except Exception:
+            self._finish()
+            raise
+
+        outer: Future = Future()
+
+        def done(f: Future):
+            try:
+                result, started, finished = f.result()
+            except BaseException as e:
+                self._finish(failed=True)
+                outer.set_exception(e)
+                return
+            self._finish(queue_wait=started - submitted_at, run=finished - started)
+            outer.set_result(result)
+
+        inner.add_done_callback(done)
+        return outer
+
+    def _finish(self, failed=False, queue_wait=0.0, run=0.0):
+        with self._lock:
+            self.pending -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+                self.queue_wait_s += max(queue_wait, 0.0)
+                self.run_s += run
+        self._slots.release()
+
+    def hash(self, plain: str) -> Future:
+        return self.submit(_hash, plain, self.rounds)
+
+    def verify(self, plain: str, hashed: str) -> Future:
+        return self.submit(_verify, plain, hashed)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "rounds": self.rounds or pbkdf2_sha256.default_rounds,
+                "pending": self.pending,
+                "queued": max(self.pending - self.workers, 0),
+                "max_pending_seen": self.max_pending_seen,
+                "submitted": self.submitted,
+                "completed": done,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_queue_wait_ms": (self.queue_wait_s / done * 1000) if done else None,
+                "avg_run_ms": (self.run_s / done * 1000) if done else None,
+            }
+
+
+password_pool = PasswordPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_ROUNDS)
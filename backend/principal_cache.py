@@ -0,0 +1,127 @@
+# principal_cache.py
+# JWT の sub（ユーザー ID）→ ログイン中ユーザーの軽量レコード を TTL 付きで覚えておく
+#   ・同じユーザーが続けて叩くお気に入り API などで users への SELECT を省く
+#   ・このプロセスのセッションで User を更新 / 削除したら、コミット時に該当エントリを捨てる
+#     （別ワーカーや import スクリプトからの変更は PRINCIPAL_CACHE_TTL_S 以内に反映される）
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from cache import TTLCache
+from models import User
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL_S = float(os.getenv("PRINCIPAL_CACHE_TTL_S", "60"))
+
+_DIRTY_KEY = "principal_cache_dirty"   # session.info: コミット時に捨てるユーザー ID
+_CLEAR_KEY = "principal_cache_clear"   # session.info: update(User) などの一括変更があった
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    # エンドポイントが参照するのはこの4項目だけ（ORM オブジェクトはセッションに縛られるので持たない）
+    id: int
+    email: str | None
+    nickname: str | None
+    device_id: str | None
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(user.id, user.email, user.nickname, user.device_id)
+
+
+class PrincipalCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._generation = 0  # 無効化のたびに進める（読み込み中に更新が挟まった結果を入れないため）
+        self.invalidated = 0
+        self.db_lookups = 0
+        self.db_time_s = 0.0
+
+    async def resolve(self, user_id: int, load) -> Principal | None:
+        # キャッシュに無ければ load(user_id)（User | None を返す coroutine）で DB から引く
+        principal = self._cache.get(user_id)
+        if principal is not None:
+            return principal
+        generation = self._generation
+        t0 = time.perf_counter()
+        user = await load(user_id)
+        elapsed = time.perf_counter() - t0
+        principal = Principal.from_user(user) if user is not None else None
+        with self._lock:
+            self.db_lookups += 1
+            self.db_time_s += elapsed
+            if principal is not None and generation == self._generation:
+                self._cache.set(user_id, principal)
+        return principal
+
+    def put(self, principal: Principal):
+        # ログイン直後など、手元に最新の User があるときに先に入れておく
+        with self._lock:
+            self._cache.set(principal.id, principal)
+
+    def invalidate(self, user_ids=None):
+        # user_ids=None なら全件
+        with self._lock:
+            self._generation += 1
+            if user_ids is None:
+                self.invalidated += len(self._cache)
+                self._cache.clear()
+                return
+            for user_id in user_ids:
+                if self._cache.pop(user_id) is not None:
+                    self.invalidated += 1
+
+    def stats(self) -> dict:
+        stats = self._cache.stats()
+        with self._lock:
+            avg = (self.db_time_s / self.db_lookups) if self.db_lookups else None
+            stats.update({
+                "db_lookups": self.db_lookups,
+                "avg_db_lookup_ms": avg * 1000 if avg is not None else None,
+                "saved_db_time_ms": stats["hits"] * avg * 1000 if avg is not None else None,
+                "invalidated_users": self.invalidated,
+            })
+        return stats
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_S)
+
+
+# -----------------------------------------------------------------------------
+# User の変更をコミット時に反映する（flush 時点ではまだ他の接続から古い行が見えるため）
+# AsyncSession も内部では同期 Session を使うので、ここに付けたイベントがそのまま効く
+# -----------------------------------------------------------------------------
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _mark_user_dirty(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_DIRTY_KEY, set()).add(target.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_bulk_user_change(state):
+    # update(User) / delete(User) は行ごとのイベントが出ないので、コミット時に全件捨てる
+    if (state.is_update or state.is_delete) and state.bind_mapper is User.__mapper__:
+        state.session.info[_CLEAR_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    dirty = session.info.pop(_DIRTY_KEY, None)
+    if session.info.pop(_CLEAR_KEY, False):
+        principal_cache.invalidate()
+    elif dirty:
+        principal_cache.invalidate(dirty)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_DIRTY_KEY, None)
+    session.info.pop(_CLEAR_KEY, None)
@@ -0,0 +1,268 @@
+# risk_payloads.py
+# /risk の応答（説明文を含む JSON のバイト列）を terrain_risk の行ごとに事前に作っておく
+#   ・import スクリプトが取り込みの最後に build_risk_payloads() を呼ぶ。内容が同じ応答は risk_payloads に
+#     1件だけ置き、terrain_risk.payload_id から参照する（地点数に比べて応答の種類はずっと少ない）
+#   ・API は起動時に (id, payload_id) の配列と応答本体だけをメモリに読む。/risk は最寄り点の id から
+#     バイト列をそのまま返すので、リクエスト時に DB にも説明文の生成にも触らない
+#   ・payload_id が未設定の行（この仕組みより前に取り込んだ DB など）は起動時にメモリ上で作る
+import json
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from database import ReadSessionLocal
+from spatial_index import fetch_array
+
+logger = logging.getLogger("app.risk_payloads")
+
+# 説明文の文面や応答の形を変えたら上げる（古い版の risk_payloads は使わず、起動時に作り直す）
+RISK_PAYLOAD_VERSION = 1
+
+RISK_NO_MATCH = {"status": "no_match", "overall_risk": None, "risk_description": "", "explanation": "一致する地点が見つかりませんでした。"}
+
+# 応答を作るのに使う terrain_risk の列
+PAYLOAD_SOURCE_SQL = "SELECT id, overall_risk, risk_description, elev_score, slope_score, river_score FROM terrain_risk"
+
+
+def generate_risk_explanation(elev_score, slope_score, river_score, risk_description):
+    if risk_description is None or (isinstance(risk_description, float) and math.isnan(risk_description)):
+        risk_description = ""
+    else:
+        risk_description = str(risk_description)
+
+    explanation = ""
+    if elev_score and slope_score:
+        if elev_score >= 25 and slope_score <= 10:
+            explanation += " 標高が低く、海や河川に近い地域で洪水リスクが高い傾向にあります。"
+        elif elev_score >= 18 and slope_score <= 15:
+            explanation += " 標高がやや低く、浸水被害の可能性があります。"
+        elif slope_score >= 20:
+            explanation += " 傾斜が急で、土砂災害の危険があります。"
+        elif slope_score >= 12:
+            explanation += " やや傾斜地にあり、雨量が多いときは土砂崩れに注意が必要です。"
+        elif elev_score <= 13 and slope_score <= 10:
+            explanation += " 高台に位置し、比較的安定した地形です。災害リスクは低めです。"
+        else:
+            explanation += " 特定の災害リスクは中程度です。"
+    else:
+        explanation += " 地形スコア情報が未登録のため、簡易的な評価です。"
+
+    if "洪水" in risk_description:
+        explanation += " 洪水ハザードマップ上では浸水可能性が示されています。"
+    if "土砂" in risk_description or "崩壊" in risk_description:
+        explanation += " 土砂崩れ・斜面崩壊の危険も考えられます。"
+    if "津波" in risk_description:
+        explanation += " 津波の可能性があり、注意が必要です。"
+
+    return explanation
+
+
+def build_risk_payload(overall_risk, risk_description, elev_score, slope_score, river_score) -> dict:
+    explanation = generate_risk_explanation(
+        elev_score=elev_score or 0,
+        slope_score=slope_score or 0,
+        river_score=river_score or 0,
+        risk_description=risk_description or ""
+    )
+    return {
+        "status": "ok",
+        "overall_risk": overall_risk,
+        "risk_description": risk_description,
+        "explanation": explanation
+    }
+
+
+def encode_payload(payload: dict) -> bytes:
+    # FastAPI の JSONResponse と同じ書式（そのまま Response の本体にできる）
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+RISK_NO_MATCH_BODY = encode_payload(RISK_NO_MATCH)
+
+
+class PayloadEncoder:
+    # PAYLOAD_SOURCE_SQL の1行（id を除く）→ 応答のバイト列
+    # 応答の種類は少ないので、同じ内容の JSON は1回だけ作って同じ bytes を返す
+    def __init__(self):
+        self._memo: dict[tuple, bytes] = {}
+
+    def __call__(self, overall_risk, risk_description, elev_score, slope_score, river_score) -> bytes:
+        payload = build_risk_payload(overall_risk, risk_description, elev_score, slope_score, river_score)
+        key = (payload["overall_risk"], payload["risk_description"], payload["explanation"])
+        body = self._memo.get(key)
+        if body is None:
+            body = self._memo[key] = encode_payload(payload)
+        return body
+
+
+# -----------------------------------------------------------------------------
+# 取り込み時: terrain_risk.payload_id を埋める（import_csv_to_db.py / scripts/build_risk_payloads.py）
+# -----------------------------------------------------------------------------
+def build_risk_payloads(conn, rebuild: bool = False) -> dict:
+    # conn: 同期エンジンの Connection（engine.begin() の中で呼ぶ）
+    #   rebuild=False: payload_id が未設定か、古い版の応答を指している行だけ作る（--append の追加分など）
+    t0 = time.perf_counter()
+    if rebuild:
+        conn.exec_driver_sql("UPDATE terrain_risk SET payload_id = NULL")
+        conn.exec_driver_sql("DELETE FROM risk_payloads")
+    else:
+        conn.execute(text("""
+            UPDATE terrain_risk SET payload_id = NULL
+            WHERE payload_id IN (SELECT id FROM risk_payloads WHERE version != :v)
+        """), {"v": RISK_PAYLOAD_VERSION})
+
+    existing = {
+        bytes(body): pid for pid, body in conn.execute(
+            text("SELECT id, body FROM risk_payloads WHERE version = :v"), {"v": RISK_PAYLOAD_VERSION}
+        )
+    }
+    encode = PayloadEncoder()
+    assignments = []
+    created = 0
+    for row in conn.exec_driver_sql(PAYLOAD_SOURCE_SQL + " WHERE payload_id IS NULL").all():
+        body = encode(*row[1:])
+        pid = existing.get(body)
+        if pid is None:
+            pid = conn.execute(
+                text("INSERT INTO risk_payloads (version, body) VALUES (:v, :body)"),
+                {"v": RISK_PAYLOAD_VERSION, "body": body},
+            ).lastrowid
+            existing[body] = pid
+            created += 1
+        assignments.append({"pid": pid, "id": row[0]})
+    if assignments:
+        conn.execute(text("UPDATE terrain_risk SET payload_id = :pid WHERE id = :id"), assignments)
+
+    # どの行からも参照されなくなった応答（再インポートで消えた地点の分など）を消す
+    pruned = conn.exec_driver_sql("""
+        DELETE FROM risk_payloads
+        WHERE id NOT IN (SELECT payload_id FROM terrain_risk WHERE payload_id IS NOT NULL)
+    """).rowcount
+    return {
+        "rows": len(assignments),
+        "created": created,
+        "pruned": max(pruned, 0),
+        "payloads": conn.exec_driver_sql("SELECT COUNT(*) FROM risk_payloads").scalar(),
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+
+
+# -----------------------------------------------------------------------------
+# API 側: id → 応答のバイト列
+# -----------------------------------------------------------------------------
+class RiskPayloadStore:
+    def __init__(self, ids: np.ndarray, slots: np.ndarray, bodies: list[bytes], computed: int = 0):
+        self.ids = ids          # terrain_risk.id 昇順
+        self.slots = slots      # ids と同じ並びで bodies の位置（int32）
+        self.bodies = bodies    # 応答のバイト列（重複なし）
+        self.computed = computed  # 起動時にメモリ上で作った行数（0 でなければ build_risk_payloads の実行を勧める）
+
+    @classmethod
+    def from_db(cls) -> "RiskPayloadStore":
+        with ReadSessionLocal() as db:
+            # 行と応答を同じトランザクションで読む（途中で入れ替わっても食い違わない）
+            arr = fetch_array(db, (
+                "SELECT id, COALESCE(payload_id, -1) FROM terrain_risk "
+                "WHERE lon IS NOT NULL AND lat IS NOT NULL ORDER BY id"
+            ), 2, dtype=np.int64)
+            stored = db.execute(
+                text("SELECT id, body FROM risk_payloads WHERE version = :v ORDER BY id"), {"v": RISK_PAYLOAD_VERSION}
+            ).all()
+            ids = np.ascontiguousarray(arr[:, 0])
+            pids = arr[:, 1]
+
+            bodies = [bytes(body) for _, body in stored]
+            stored_pids = np.fromiter((pid for pid, _ in stored), dtype=np.int64, count=len(stored))
+            pos = np.minimum(np.searchsorted(stored_pids, pids), max(len(stored_pids) - 1, 0))
+            known = (stored_pids[pos] == pids) if len(stored_pids) else np.zeros(len(pids), dtype=bool)
+            slots = np.where(known, pos, -1).astype(np.int32)
+
+            missing = np.flatnonzero(~known)
+            if len(missing):
+                # 未設定・古い版の行はここで作る（全件読み直すが、build_risk_payloads 済みの DB では通らない）
+                slot_of = {body: i for i, body in enumerate(bodies)}
+                encode = PayloadEncoder()
+                need = set(ids[missing].tolist())
+                found_ids, found_slots = [], []
+                for row in db.execute(text(PAYLOAD_SOURCE_SQL)):
+                    if row[0] not in need:
+                        continue
+                    body = encode(*row[1:])
+                    slot = slot_of.get(body)
+                    if slot is None:
+                        slot = slot_of[body] = len(bodies)
+                        bodies.append(body)
+                    found_ids.append(row[0])
+                    found_slots.append(slot)
+                slots[np.searchsorted(ids, found_ids)] = found_slots
+        return cls(ids, slots, bodies, computed=len(missing))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def body(self, terrain_id: int) -> bytes | None:
+        i = int(np.searchsorted(self.ids, terrain_id))
+        if i >= len(self.ids) or self.ids[i] != terrain_id:
+            return None
+        return self.bodies[self.slots[i]]
+
+    def bodies_for(self, terrain_ids: np.ndarray) -> list[bytes]:
+        # 一括版（一致なし id=-1 や見つからない id は RISK_NO_MATCH_BODY）
+        terrain_ids = np.asarray(terrain_ids, dtype=np.int64)
+        if not len(self.ids):
+            return [RISK_NO_MATCH_BODY] * len(terrain_ids)
+        pos = np.minimum(np.searchsorted(self.ids, terrain_ids), len(self.ids) - 1)
+        hit = (terrain_ids >= 0) & (self.ids[pos] == terrain_ids)
+        bodies = self.bodies
+        return [bodies[s] if h else RISK_NO_MATCH_BODY for s, h in zip(self.slots[pos].tolist(), hit.tolist())]
+
+
+class RiskPayloadService:
+    def __init__(self):
+        self._store: RiskPayloadStore | None = None
+        self._lock = threading.Lock()
+
+    def store(self) -> RiskPayloadStore:
+        store = self._store
+        if store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = self.build()
+                store = self._store
+        return store
+
+    def build(self) -> RiskPayloadStore:
+        # 新しい store を作るだけ（差し替えは swap。作っている間も今の store で応答できる）
+        store = RiskPayloadStore.from_db()
+        if store.computed:
+            logger.info("%s 行の応答をメモリ上で作りました"
+                        "（scripts/build_risk_payloads.py を実行すると読み込みが速くなります）", f"{store.computed:,}")
+        return store
+
+    def swap(self, store: RiskPayloadStore):
+        with self._lock:
+            self._store = store
+
+    def ready(self) -> bool:
+        return self._store is not None
+
+    def reset(self):
+        with self._lock:
+            self._store = None
+
+    def stats(self) -> dict:
+        store = self._store
+        return {
+            "version": RISK_PAYLOAD_VERSION,
+            "rows": len(store) if store else None,
+            "payloads": len(store.bodies) if store else None,
+            "bytes": sum(map(len, store.bodies)) if store else None,
+            "computed_at_startup": store.computed if store else None,
+        }
+
+
+risk_payloads = RiskPayloadService()
@@ -0,0 +1,244 @@
+# risk_tiles.py
+# terrain_risk のスコア（総合・洪水・土砂・津波）を XYZ の PNG タイルに描く（GET /risk/tiles/{metric}/{z}/{x}/{y}.png）
+#   ・タイルの 256x256 画素の中心をまとめて EPSG:6674 に投影し、/risk と同じ「最寄り点（MAX_DISTANCE_M 以内）」の
+#     スコアを引く（RiskRaster があれば O(1) 参照、無ければ KD-tree）
+#   ・スコア 0〜100 は色の段階に丸めて RGBA の表引きで着色する（画素ごとの Python ループは無し）
+#   ・描いたタイルはデータ版ごとのディレクトリに保存する。terrain_risk を入れ替える・近傍検索のラスタを作り直す
+#     （または KD-tree との間で切り替わる）と版が変わり、古い版は使われなくなる
+import hashlib
+import io
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from pyproj import Transformer
+from sqlalchemy import text
+
+from database import ReadSessionLocal
+from spatial_index import MAX_DISTANCE_M, fetch_array, get_risk_locator, risk_locator_version
+
+RISK_TILE_DIR = Path(os.getenv("RISK_TILE_DIR", "./data/risk_tiles"))
+RISK_TILE_MIN_ZOOM = int(os.getenv("RISK_TILE_MIN_ZOOM", "10"))
+RISK_TILE_MAX_ZOOM = int(os.getenv("RISK_TILE_MAX_ZOOM", "18"))
+RISK_TILE_MAX_AGE_S = int(os.getenv("RISK_TILE_MAX_AGE_S", "3600"))
+TILE_SIZE = 256
+
+# URL の metric → terrain_risk の列
+RISK_TILE_METRICS = {
+    "overall": "overall_risk",
+    "flood": "flood_risk",
+    "landslide": "landslide_risk",
+    "tsunami": "tsunami_risk",
+}
+
+# 色の段階（frontend の 6infoUI.js と同じ区切り: 70 以上=高, 40 以上=中）。下限スコア → RGBA
+RISK_COLOR_STEPS = (
+    (0, (46, 160, 67, 0)),       # 20 未満は描かない（地図を隠さない）
+    (20, (46, 160, 67, 110)),    # 低
+    (40, (245, 191, 39, 140)),   # 中
+    (55, (240, 128, 30, 160)),
+    (70, (220, 40, 40, 170)),    # 高
+    (85, (150, 0, 40, 190)),
+)
+
+# terrain_risk の版（件数・最大 ID・値の合計から作る。import スクリプトで入れ替えると変わる）
+TERRAIN_VERSION_SQL = text("""
+    SELECT COUNT(*), MAX(id), TOTAL(overall_risk), TOTAL(flood_risk) + TOTAL(landslide_risk) + TOTAL(tsunami_risk),
+           TOTAL(lat), TOTAL(lon)
+    FROM terrain_risk
+""")
+
+_to_6674 = Transformer.from_crs("EPSG:4326", "EPSG:6674", always_xy=True)
+
+
+def _build_lut() -> np.ndarray:
+    # スコア 0..100 → RGBA の表
+    lut = np.zeros((101, 4), dtype=np.uint8)
+    for lower, rgba in RISK_COLOR_STEPS:
+        lut[lower:] = rgba
+    return lut
+
+
+RISK_LUT = _build_lut()
+
+
+def _encode_png(rgba: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, format="PNG", compress_level=6)
+    return buf.getvalue()
+
+
+EMPTY_TILE_PNG = _encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def tile_pixel_lonlat(z: int, x: int, y: int) -> tuple[np.ndarray, np.ndarray]:
+    # タイル内 256x256 画素の中心の経度・緯度（行 = 北から南）
+    n = TILE_SIZE * 2 ** z
+    px = (x * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / n
+    py = (y * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / n
+    lon = px * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * py))))
+    return np.broadcast_to(lon, (TILE_SIZE, TILE_SIZE)), np.broadcast_to(lat[:, None], (TILE_SIZE, TILE_SIZE))
+
+
+def tile_bounds_lonlat(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n)))))
+    south = float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n)))))
+    return west, south, east, north
+
+
+class RiskTileRenderer:
+    def __init__(self, version: str, ids: np.ndarray, values: dict[str, np.ndarray], extent, locator):
+        self.version = version
+        self.ids = ids              # terrain_risk.id 昇順
+        self.values = values        # metric -> uint8 配列（ids と同じ並び、0..100 に丸め済み）
+        self.extent = extent        # データ範囲（EPSG:6674、MAX_DISTANCE_M だけ広げた minx, miny, maxx, maxy）
+        self.locator = locator      # 近傍検索（RiskRaster / RiskIndex）。描画中に差し替わっても版と食い違わない
+
+    @classmethod
+    def from_db(cls, locator=None) -> "RiskTileRenderer":
+        # locator: 使う近傍検索（省略時は今の get_risk_locator()。データの入れ替え時は差し替え後のものを渡す）
+        if locator is None:
+            locator = get_risk_locator()
+        cols = ", ".join(f"COALESCE({col}, 0)" for col in RISK_TILE_METRICS.values())
+        with ReadSessionLocal() as db:
+            # 版と値を同じトランザクションで読む（途中で入れ替わっても食い違わない）
+            version_row = db.execute(TERRAIN_VERSION_SQL).one()
+            arr = fetch_array(db, (
+                f"SELECT id, lon, lat, {cols} FROM terrain_risk "
+                "WHERE lon IS NOT NULL AND lat IS NOT NULL ORDER BY id"
+            ), 3 + len(RISK_TILE_METRICS))
+        version = hashlib.sha1(repr((tuple(version_row), risk_locator_version(locator))).encode()).hexdigest()[:12]
+        ids = arr[:, 0].astype(np.int64)
+        values = {
+            metric: np.clip(np.rint(arr[:, 3 + i]), 0, 100).astype(np.uint8)
+            for i, metric in enumerate(RISK_TILE_METRICS)
+        }
+        if len(arr):
+            extent = (arr[:, 1].min() - MAX_DISTANCE_M, arr[:, 2].min() - MAX_DISTANCE_M,
+                      arr[:, 1].max() + MAX_DISTANCE_M, arr[:, 2].max() + MAX_DISTANCE_M)
+        else:
+            extent = None
+        return cls(version, ids, values, extent, locator)
+
+    def _touches_data(self, z: int, x: int, y: int) -> bool:
+        # タイルの四隅（＋辺の中点）を投影した範囲がデータ範囲にかかるか。かからなければ透明タイルで済ませる
+        if self.extent is None:
+            return False
+        west, south, east, north = tile_bounds_lonlat(z, x, y)
+        lons = np.array([west, east, west, east, (west + east) / 2, (west + east) / 2, west, east])
+        lats = np.array([south, south, north, north, south, north, (south + north) / 2, (south + north) / 2])
+        xs, ys = _to_6674.transform(lons, lats)
+        minx, miny, maxx, maxy = self.extent
+        return not (xs.max() < minx or xs.min() > maxx or ys.max() < miny or ys.min() > maxy)
+
+    def render(self, metric: str, z: int, x: int, y: int) -> bytes:
+        if not self._touches_data(z, x, y):
+            return EMPTY_TILE_PNG
+        lon, lat = tile_pixel_lonlat(z, x, y)
+        xs, ys = _to_6674.transform(lon.ravel(), lat.ravel())
+        found_ids, _ = self.locator.nearest_many(xs, ys, MAX_DISTANCE_M)
+        hit = found_ids >= 0
+        if not hit.any():
+            return EMPTY_TILE_PNG
+        # 近傍検索の id → 値の並びの位置（インデックスだけ先に作り直された場合に備えて一致を確かめる）
+        pos = np.minimum(np.searchsorted(self.ids, found_ids), len(self.ids) - 1)
+        hit &= self.ids[pos] == found_ids
+        score = np.zeros(xs.shape, dtype=np.uint8)
+        score[hit] = self.values[metric][pos[hit]]
+        rgba = RISK_LUT[score]
+        rgba[~hit] = 0
+        return _encode_png(rgba.reshape(TILE_SIZE, TILE_SIZE, 4))
+
+
+# -----------------------------------------------------------------------------
+# ディスクキャッシュ（{RISK_TILE_DIR}/{版}/{metric}/{z}/{x}/{y}.png）
+# -----------------------------------------------------------------------------
+def tile_path(version: str, metric: str, z: int, x: int, y: int) -> Path:
+    return RISK_TILE_DIR / version / metric / str(z) / str(x) / f"{y}.png"
+
+
+def read_cached(version: str, metric: str, z: int, x: int, y: int) -> bytes | None:
+    try:
+        return tile_path(version, metric, z, x, y).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def write_cached(version: str, metric: str, z: int, x: int, y: int, png: bytes):
+    path = tile_path(version, metric, z, x, y)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(png)
+    os.replace(tmp, path)
+
+
+def prune_old_versions(keep: str) -> list[str]:
+    # 現在の版以外のディレクトリを消す（再インポート後の掃除）
+    removed = []
+    if RISK_TILE_DIR.exists():
+        for child in RISK_TILE_DIR.iterdir():
+            if child.is_dir() and child.name != keep:
+                shutil.rmtree(child, ignore_errors=True)
+                removed.append(child.name)
+    return removed
+
+
+class RiskTileService:
+    def __init__(self):
+        self._renderer: RiskTileRenderer | None = None
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.disk_hits = 0
+
+    def renderer(self) -> RiskTileRenderer:
+        renderer = self._renderer
+        if renderer is None:
+            with self._lock:
+                if self._renderer is None:
+                    self._renderer = RiskTileRenderer.from_db()
+                renderer = self._renderer
+        return renderer
+
+    def ready(self) -> bool:
+        return self._renderer is not None
+
+    def reset(self):
+        with self._lock:
+            self._renderer = None
+
+    def swap(self, renderer: RiskTileRenderer | None):
+        # None なら次に使う時に作る
+        with self._lock:
+            self._renderer = renderer
+
+    def get(self, metric: str, z: int, x: int, y: int) -> tuple[bytes, str]:
+        # 戻り値: (PNG, 版)。同期処理なので async 側からはスレッドで呼ぶ
+        renderer = self.renderer()
+        png = read_cached(renderer.version, metric, z, x, y)
+        if png is not None:
+            self.disk_hits += 1
+            return png, renderer.version
+        png = renderer.render(metric, z, x, y)
+        write_cached(renderer.version, metric, z, x, y, png)
+        self.rendered += 1
+        return png, renderer.version
+
+    def stats(self) -> dict:
+        renderer = self._renderer
+        return {
+            "dir": str(RISK_TILE_DIR),
+            "version": renderer.version if renderer else None,
+            "points": len(renderer.ids) if renderer else None,
+            "rendered": self.rendered,
+            "disk_hits": self.disk_hits,
+        }
+
+
+risk_tiles = RiskTileService()
@@ -0,0 +1,211 @@
+# schema.py
+# SQLite スキーマ整備（既存 DB への列追加・インデックス・R*Tree 空間インデックス）
+# app_API の起動時と import スクリプトから呼ばれる
+import logging
+
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger("app.schema")
+
+# ensure_sqlite_schema の中身を変えたら上げる。DB の PRAGMA user_version が同じなら何もしない
+# （ワーカーが起動するたびに件数の確認や書き込みロックの取り合いをしない）
+SCHEMA_VERSION = 2
+
+
+class SchemaVersionError(RuntimeError):
+    # DB の user_version がこのコードの SCHEMA_VERSION より新しい（新しい版で移行済みの DB を古い版で開いた）
+    pass
+
+
+# -----------------------------------------------------------------------------
+# テーブル / 列 / インデックス（※1回だけ定義・呼び出し）
+# -----------------------------------------------------------------------------
+def ensure_sqlite_schema(engine):
+    with engine.connect() as conn:
+        current = conn.exec_driver_sql("PRAGMA user_version").scalar()
+    if current == SCHEMA_VERSION:
+        return
+    if current > SCHEMA_VERSION:
+        # ここで進めると user_version を古い番号に書き戻し、新しい版が付けたトリガや列と食い違ったまま動く
+        raise SchemaVersionError(
+            f"DB のスキーマ (user_version={current}) はこのコード (SCHEMA_VERSION={SCHEMA_VERSION}) より新しいので"
+            "開きません。アプリを新しい版にしてください"
+        )
+    with engine.begin() as conn:
+        # users テーブル新規 or 既存拡張
+        conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            device_id TEXT UNIQUE,
+            email TEXT UNIQUE,
+            password_hash TEXT,
+            nickname TEXT,
+            created_at TEXT DEFAULT (datetime('now')),
+            last_seen  TEXT DEFAULT (datetime('now'))
+        )""")
+
+        cols = conn.exec_driver_sql("PRAGMA table_info(users)").fetchall()
+        ucols = {c[1] for c in cols}
+        if "email" not in ucols:
+            conn.exec_driver_sql("ALTER TABLE users ADD COLUMN email TEXT")
+        if "password_hash" not in ucols:
+            conn.exec_driver_sql("ALTER TABLE users ADD COLUMN password_hash TEXT")
+
+        cols = conn.exec_driver_sql("PRAGMA table_info(favorites)").fetchall()
+        fcols = {c[1] for c in cols}
+        if "device_id" not in fcols:
+            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN device_id TEXT")
+        if "user_id" not in fcols:
+            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN user_id INTEGER")
+        if "simple_warnings" not in fcols:
+            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN simple_warnings TEXT")
+        if "created_at" not in fcols:
+            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN created_at TEXT")
+        if "updated_at" not in fcols:
+            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN updated_at TEXT")
+        if "version" not in fcols:
+            conn.exec_driver_sql("ALTER TABLE favorites ADD COLUMN version INTEGER")
+
+        ensure_terrain_risk_columns(conn)
+        ensure_shelter_columns(conn)
+
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_users_email ON users (email)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_favorites_user_id ON favorites (user_id)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_favorites_device_id ON favorites (device_id)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_favorites_user_created ON favorites (user_id, created_at)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_favorites_device_created ON favorites (device_id, created_at)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_favorites_user_version ON favorites (user_id, version)")
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_favorites_device_version ON favorites (device_id, version)")
+        conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ux_shelters_name_lat_lon ON shelters (name, lat, lon)")
+
+        ensure_favorites_sync(conn)
+        ensure_spatial_tables(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def ensure_terrain_risk_columns(conn):
+    # 後から足した列（import スクリプトの --append でも既存テーブルに対して呼ぶ）
+    cols = {c[1] for c in conn.exec_driver_sql("PRAGMA table_info(terrain_risk)").fetchall()}
+    if cols and "payload_id" not in cols:
+        conn.exec_driver_sql("ALTER TABLE terrain_risk ADD COLUMN payload_id INTEGER")
+    if cols and "ward_code" not in cols:
+        conn.exec_driver_sql("ALTER TABLE terrain_risk ADD COLUMN ward_code TEXT")
+    if cols:
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_terrain_risk_ward_code ON terrain_risk (ward_code)")
+
+
+def ensure_shelter_columns(conn):
+    cols = {c[1] for c in conn.exec_driver_sql("PRAGMA table_info(shelters)").fetchall()}
+    if cols and "ward_code" not in cols:
+        conn.exec_driver_sql("ALTER TABLE shelters ADD COLUMN ward_code TEXT")
+
+
+# -----------------------------------------------------------------------------
+# お気に入り同期（POST /favorites/sync）の変更番号
+#   favorites の追加・更新・削除のたびに favorites_version.value を1つ進め、
+#   その値を favorites.version に書く（削除は favorites_deleted に墓標として残す）
+#   → API のどの経路（/favorites, /favorites/sync, claim_device など）で変えても追える
+# -----------------------------------------------------------------------------
+def ensure_favorites_sync(conn):
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS favorites_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )""")
+    conn.exec_driver_sql("INSERT OR IGNORE INTO favorites_version (id, value) VALUES (1, 0)")
+
+    # トリガ導入前の行にもまとめて1つ番号を振る
+    backfilled = conn.exec_driver_sql(
+        "UPDATE favorites SET version = (SELECT value + 1 FROM favorites_version) WHERE version IS NULL"
+    ).rowcount
+    if backfilled:
+        conn.exec_driver_sql("UPDATE favorites_version SET value = value + 1")
+
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS favorites_sync_ai AFTER INSERT ON favorites
+        BEGIN
+            UPDATE favorites_version SET value = value + 1;
+            UPDATE favorites SET version = (SELECT value FROM favorites_version) WHERE id = NEW.id;
+            DELETE FROM favorites_deleted WHERE id = NEW.id;
+        END""")
+    # version 自体の書き換え（上のトリガ）では発火させない
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS favorites_sync_au AFTER UPDATE ON favorites
+        WHEN NEW.version IS OLD.version
+        BEGIN
+            UPDATE favorites_version SET value = value + 1;
+            UPDATE favorites SET version = (SELECT value FROM favorites_version) WHERE id = NEW.id;
+        END""")
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS favorites_sync_ad AFTER DELETE ON favorites
+        BEGIN
+            UPDATE favorites_version SET value = value + 1;
+            INSERT OR REPLACE INTO favorites_deleted (id, user_id, device_id, version)
+            VALUES (OLD.id, OLD.user_id, OLD.device_id, (SELECT value FROM favorites_version));
+        END""")
+
+
+# -----------------------------------------------------------------------------
+# R*Tree 空間インデックス（terrain_risk / shelters の座標をトリガで同期）
+#   terrain_risk: lon/lat 列 = EPSG:6674 の x/y [m]
+#   shelters    : lon/lat 列 = 経度/緯度 [度]
+# R*Tree は 32bit float で外側に丸めて持つので「候補の絞り込み」に使い、最終判定は元テーブルの値で行う
+# 矩形・半径での検索は spatial_sql.py（import スクリプトや手元の集計向け。API は spatial_index.py のインメモリ索引）
+# -----------------------------------------------------------------------------
+RTREE_SOURCES = {
+    "terrain_risk_rtree": "terrain_risk",
+    "shelters_rtree": "shelters",
+}
+
+
+def _create_rtree(conn, rtree: str, table: str):
+    conn.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, min_x, max_x, min_y, max_y)"
+    )
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_ai AFTER INSERT ON {table}
+        WHEN NEW.lon IS NOT NULL AND NEW.lat IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO {rtree} VALUES (NEW.id, NEW.lon, NEW.lon, NEW.lat, NEW.lat);
+        END""")
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_au AFTER UPDATE OF id, lat, lon ON {table}
+        BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.id;
+            INSERT INTO {rtree}
+            SELECT NEW.id, NEW.lon, NEW.lon, NEW.lat, NEW.lat
+            WHERE NEW.lon IS NOT NULL AND NEW.lat IS NOT NULL;
+        END""")
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_ad AFTER DELETE ON {table}
+        BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.id;
+        END""")
+
+
+def rebuild_rtree(conn, rtree: str):
+    # 元テーブルから作り直す（テーブルを drop/create して id が振り直された後など）
+    table = RTREE_SOURCES[rtree]
+    conn.exec_driver_sql(f"DELETE FROM {rtree}")
+    conn.exec_driver_sql(f"""
+        INSERT INTO {rtree}
+        SELECT id, lon, lon, lat, lat FROM {table}
+        WHERE lon IS NOT NULL AND lat IS NOT NULL""")
+
+
+def ensure_spatial_tables(conn, only=None):
+    try:
+        for rtree, table in RTREE_SOURCES.items():
+            if only is not None and rtree not in only:
+                continue
+            _create_rtree(conn, rtree, table)
+            # トリガ導入前のデータがあれば取り込む（件数が一致していれば何もしない）
+            mirrored = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {rtree}").scalar()
+            source = conn.exec_driver_sql(
+                f"SELECT COUNT(*) FROM {table} WHERE lon IS NOT NULL AND lat IS NOT NULL"
+            ).scalar()
+            if mirrored != source:
+                rebuild_rtree(conn, rtree)
+    except OperationalError as e:
+        # rtree モジュール無しでビルドされた SQLite では空間インデックスを使わない
+        logger.warning("R*Tree を作成できませんでした: %s", e)
@@ -0,0 +1,177 @@
+# bench_data.py
+# ベンチマーク用の合成データ（大阪府規模）を SQLite に作る（scripts/bench_suite.py から使う。単独でも実行可）
+#   python scripts/bench_data.py /tmp/bench/app.db --profile medium
+#   python scripts/bench_data.py /tmp/bench/app.db --terrain 1000000 --shelters 50000 --users 20000 --favorites 20
+#
+#   ・terrain_risk: EPSG:6674 の格子（間隔の 1/4 までゆらす）。スコアは場所によって緩やかに変わる値にして、
+#     実データと同じく /risk の応答の種類が地点数よりずっと少なくなるようにする
+#   ・shelters: 範囲内に一様。種別・収容人数・区コードはランダム
+#   ・users / favorites: 利用者ごとに device_id（bench-device-{n}）と favorites 件のお気に入り（作成日時をばらす）
+# 同じ引数・seed なら同じ DB ができる
+import argparse
+import math
+import time
+from pathlib import Path
+
+import numpy as np
+from pyproj import Transformer
+from sqlalchemy import create_engine
+
+# データを置く範囲（大阪市を中心に府の平野部。minLon, minLat, maxLon, maxLat）
+DATA_BBOX = (135.35, 34.50, 135.65, 34.85)
+
+# 規模のプリセット（terrain_risk 行数・避難所数・利用者数・利用者ごとのお気に入り数）
+PROFILES = {
+    "small": {"terrain": 10_000, "shelters": 100, "users": 100, "favorites": 10},
+    "medium": {"terrain": 200_000, "shelters": 3_000, "users": 2_000, "favorites": 20},
+    "large": {"terrain": 1_000_000, "shelters": 50_000, "users": 20_000, "favorites": 20},
+}
+
+SHELTER_TYPES = ("指定避難所", "一時避難所", "広域避難場所", "福祉避難所")
+DESCRIPTIONS = ("", "洪水", "洪水,津波", "土砂", "洪水,土砂")
+BATCH = 50_000
+
+_to_6674 = Transformer.from_crs("EPSG:4326", "EPSG:6674", always_xy=True)
+
+
+def _terrain_rows(n: int, rng: np.random.Generator):
+    corners_x, corners_y = _to_6674.transform(
+        [DATA_BBOX[0], DATA_BBOX[2], DATA_BBOX[0], DATA_BBOX[2]], [DATA_BBOX[1], DATA_BBOX[1], DATA_BBOX[3], DATA_BBOX[3]]
+    )
+    x0, x1, y0, y1 = min(corners_x), max(corners_x), min(corners_y), max(corners_y)
+    spacing = math.sqrt((x1 - x0) * (y1 - y0) / n)
+    nx, ny = math.ceil((x1 - x0) / spacing), math.ceil((y1 - y0) / spacing)
+    cells = np.sort(rng.choice(nx * ny, size=n, replace=False))
+    xs = x0 + (cells % nx + 0.5) * spacing + rng.uniform(-spacing / 4, spacing / 4, n)
+    ys = y0 + (cells // nx + 0.5) * spacing + rng.uniform(-spacing / 4, spacing / 4, n)
+
+    # 数 km 単位でうねる場（海側ほど標高スコアが高い = 低地、東側ほど傾斜）
+    u = (xs - x0) / (x1 - x0)
+    v = (ys - y0) / (y1 - y0)
+    elev = np.clip(30 - 25 * u + 5 * np.sin(9 * v) + rng.normal(0, 2, n), 0, 40).round(1)
+    slope = np.clip(30 * u ** 3 + 4 * np.cos(7 * v) + rng.normal(0, 2, n), 0, 40).round(1)
+    river = np.clip(5 + 5 * np.sin(13 * u + 11 * v), 0, 10).round(1)
+    flood = (np.clip(elev * 2.5, 0, 100) // 5 * 5).astype(int)
+    landslide = (np.clip(slope * 2.5, 0, 100) // 5 * 5).astype(int)
+    tsunami = np.where(u < 0.2, flood, 0)
+    overall = np.maximum.reduce([flood, landslide, tsunami])
+    desc = np.select(
+        [(flood >= 50) & (tsunami > 0), (flood >= 50) & (landslide >= 50), flood >= 50, landslide >= 50],
+        [2, 4, 1, 3], default=0,
+    )
+    for i in range(n):
+        yield (float(ys[i]), float(xs[i]), int(flood[i]), int(landslide[i]), int(tsunami[i]), int(overall[i]),
+               DESCRIPTIONS[desc[i]], float(elev[i]), float(slope[i]), float(river[i]))
+
+
+def _shelter_rows(n: int, rng: np.random.Generator):
+    lons = rng.uniform(DATA_BBOX[0], DATA_BBOX[2], n)
+    lats = rng.uniform(DATA_BBOX[1], DATA_BBOX[3], n)
+    types = rng.integers(0, len(SHELTER_TYPES), n)
+    capacity = rng.integers(0, 40, n) * 50
+    wards = rng.integers(100, 160, n)
+    for i in range(n):
+        yield (f"避難所{i}", f"27{wards[i]}", f"大阪府 {i}", SHELTER_TYPES[types[i]],
+               int(capacity[i]) or None, float(lats[i]), float(lons[i]), "bench")
+
+
+def _favorite_rows(users: int, per_user: int, rng: np.random.Generator):
+    n = users * per_user
+    lons = rng.uniform(DATA_BBOX[0], DATA_BBOX[2], n)
+    lats = rng.uniform(DATA_BBOX[1], DATA_BBOX[3], n)
+    ages = rng.integers(0, 365 * 24 * 3600, n)  # 作成日時: 直近1年にばらす
+    base = time.mktime(time.strptime("2025-01-01", "%Y-%m-%d"))
+    for i in range(n):
+        user = i // per_user + 1
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(base + int(ages[i])))
+        yield (float(lats[i]), float(lons[i]), f"地点{i}", f"bench-device-{user}", user, created, created)
+
+
+def _insert(engine, sql: str, rows, label: str):
+    # 大量に入れるので ORM / Core を通さず DBAPI の executemany で
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        batch, total = [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH:
+                cursor.executemany(sql, batch)
+                total += len(batch)
+                batch.clear()
+        if batch:
+            cursor.executemany(sql, batch)
+            total += len(batch)
+        raw.commit()
+    finally:
+        raw.close()
+    print(f"  {label}: {total:,} 行")
+
+
+def build_dataset(path, terrain: int, shelters: int, users: int, favorites: int, seed: int = 0) -> dict:
+    # models などは import 時に DATABASE_URL を読むので、ここで import する
+    # （bench_suite.py は環境変数をベンチ用 DB に向けてからアプリを読み込む）
+    from models import Base
+    from risk_payloads import build_risk_payloads
+    from schema import ensure_sqlite_schema
+
+    path = Path(path)
+    if path.exists():
+        raise SystemExit(f"{path} は既にあります（ベンチ用 DB は新しいファイルに作る）")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        Base.metadata.create_all(bind=engine)
+        _insert(engine, (
+            "INSERT INTO terrain_risk (lat, lon, flood_risk, landslide_risk, tsunami_risk, overall_risk, "
+            "risk_description, elev_score, slope_score, river_score) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        ), _terrain_rows(terrain, rng), "terrain_risk")
+        _insert(engine, (
+            "INSERT INTO shelters (name, ward, address, type, capacity, lat, lon, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        ), _shelter_rows(shelters, rng), "shelters")
+        _insert(engine, "INSERT INTO users (id, device_id, email, nickname) VALUES (?, ?, ?, ?)", (
+            (i, f"bench-device-{i}", f"bench{i}@example.com", f"bench{i}") for i in range(1, users + 1)
+        ), "users")
+        _insert(engine, (
+            "INSERT INTO favorites (lat, lon, title, device_id, user_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        ), _favorite_rows(users, favorites, rng), "favorites")
+
+        # R*Tree・お気に入り同期のトリガと変更番号（入れ終わってからまとめて作る）と /risk の応答
+        ensure_sqlite_schema(engine)
+        with engine.begin() as conn:
+            payloads = build_risk_payloads(conn)
+    finally:
+        engine.dispose()
+    seconds = round(time.perf_counter() - t0, 2)
+    print(f"✅ {path}: /risk 応答 {payloads['payloads']:,} 種類, {seconds} 秒")
+    return {"terrain": terrain, "shelters": shelters, "users": users, "favorites": favorites, "seed": seed,
+            "build_s": seconds}
+
+
+def add_size_arguments(ap: argparse.ArgumentParser):
+    ap.add_argument("--profile", choices=sorted(PROFILES), default="small")
+    ap.add_argument("--terrain", type=int, help="terrain_risk の行数（10k〜1M。プリセットを上書き）")
+    ap.add_argument("--shelters", type=int, help="避難所の数（100〜50k）")
+    ap.add_argument("--users", type=int, help="お気に入りを持つ利用者の数")
+    ap.add_argument("--favorites", type=int, help="利用者ごとのお気に入り数")
+    ap.add_argument("--seed", type=int, default=0)
+
+
+def sizes_from_args(args) -> dict:
+    sizes = dict(PROFILES[args.profile])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    return sizes
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("path", help="作成する SQLite ファイル")
+    add_size_arguments(ap)
+    args = ap.parse_args()
+    build_dataset(args.path, seed=args.seed, **sizes_from_args(args))
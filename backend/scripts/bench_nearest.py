@@ -0,0 +1,103 @@
+# bench_nearest.py
+# nearest_point の旧実装（全件スキャン）と KD-tree インデックスの比較ベンチマーク
+#   python scripts/bench_nearest.py --rows 50000 --queries 200
+import argparse
+import time
+
+import numpy as np
+from pyproj import Transformer
+from shapely.geometry import Point
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, TerrainRisk
+from spatial_index import MAX_DISTANCE_M, RiskIndex
+
+# 大阪市付近（EPSG:6674 [m]）
+X_RANGE = (-60000.0, -30000.0)
+Y_RANGE = (-165000.0, -125000.0)
+
+transformer = Transformer.from_crs("EPSG:4326", "EPSG:6674", always_xy=True)
+inverse = Transformer.from_crs("EPSG:6674", "EPSG:4326", always_xy=True)
+
+
+def legacy_nearest_point(lat, lon, db):
+    # 旧 app_API.nearest_point をそのまま再現
+    all_data = db.query(TerrainRisk).all()
+    x, y = transformer.transform(lon, lat)
+    pt = Point(x, y)
+    min_dist = float("inf")
+    nearest = None
+    for row in all_data:
+        row_point = Point(row.lon, row.lat)
+        dist = row_point.distance(pt)
+        if dist < min_dist:
+            min_dist = dist
+            nearest = row
+    return nearest, min_dist
+
+
+def build_db(rows: int, seed: int):
+    engine = create_engine("sqlite://", future=True)
+    Base.metadata.create_all(bind=engine)
+    rng = np.random.default_rng(seed)
+    xs = rng.uniform(*X_RANGE, rows)
+    ys = rng.uniform(*Y_RANGE, rows)
+    risk = rng.integers(0, 10, rows)
+    with engine.begin() as conn:
+        conn.execute(TerrainRisk.__table__.insert(), [
+            {"lon": float(x), "lat": float(y), "overall_risk": int(r)}
+            for x, y, r in zip(xs, ys, risk)
+        ])
+    return engine
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    engine = build_db(args.rows, args.seed)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    rng = np.random.default_rng(args.seed + 1)
+    qx = rng.uniform(*X_RANGE, args.queries)
+    qy = rng.uniform(*Y_RANGE, args.queries)
+    qlon, qlat = inverse.transform(qx, qy)
+
+    with SessionLocal() as db:
+        t0 = time.perf_counter()
+        index = RiskIndex.from_session(db)
+        build_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        legacy = [legacy_nearest_point(la, lo, db) for la, lo in zip(qlat, qlon)]
+        legacy_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        indexed = []
+        for la, lo in zip(qlat, qlon):
+            x, y = transformer.transform(lo, la)
+            nid, dist = index.nearest(x, y, MAX_DISTANCE_M)
+            indexed.append((db.get(TerrainRisk, nid) if nid is not None else None, dist))
+        index_s = time.perf_counter() - t0
+
+    mismatches = 0
+    for (lrow, ldist), (irow, idist) in zip(legacy, indexed):
+        lrow = lrow if ldist <= MAX_DISTANCE_M else None
+        if (lrow.id if lrow else None) != (irow.id if irow else None):
+            mismatches += 1
+
+    n = args.queries
+    print(f"rows={args.rows} queries={n}")
+    print(f"index build      : {build_s * 1000:9.1f} ms")
+    print(f"legacy scan      : {legacy_s / n * 1000:9.3f} ms/query")
+    print(f"kd-tree + get()  : {index_s / n * 1000:9.3f} ms/query")
+    print(f"speedup          : {legacy_s / index_s:9.1f} x")
+    print(f"mismatches       : {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# bench_startup.py
+# API ワーカーのコールドスタート（起動 → /health 応答 → 最初の /risk 応答）の時間と常駐メモリ（RSS）を測る
+#   python scripts/bench_startup.py [--runs 5] [--port 8123]
+#   DATABASE_URL などは今の環境変数がそのまま uvicorn に渡る（本番相当のデータで測ること）
+#
+#   --importtime   python -X importtime の結果から import に時間がかかっているモジュール上位を表示
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def rss_mb(pid: int) -> float | None:
+    # Linux の /proc から（他 OS では測れない）
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def get(url: str, timeout: float = 1.0) -> bytes:
+    with urllib.request.urlopen(url, timeout=timeout) as res:
+        return res.read()
+
+
+def one_run(port: int, timeout: float) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app_API:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn が終了しました (exit={proc.returncode})")
+            if time.perf_counter() - t0 > timeout:
+                raise RuntimeError("起動がタイムアウトしました")
+            try:
+                get(base + "/health", timeout=0.5)
+                break
+            except OSError:
+                time.sleep(0.02)
+        ready = time.perf_counter() - t0
+        rss_ready = rss_mb(proc.pid)
+
+        t1 = time.perf_counter()
+        get(base + "/risk?lat=34.6937&lon=135.5023", timeout=timeout)
+        first_risk = time.perf_counter() - t1
+        return {
+            "ready_s": round(ready, 3),
+            "first_risk_ms": round(first_risk * 1000, 1),
+            "rss_ready_mb": round(rss_ready, 1) if rss_ready is not None else None,
+            "rss_after_risk_mb": round(rss_mb(proc.pid) or 0, 1) or None,
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def importtime_top(n: int) -> list[tuple[str, float]]:
+    # app_API 自身と、app_API が直接 import しているモジュールの累積 import 時間 [ms]（配下を含む）
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app_API"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    ).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2  # 先頭の空白 1 つ + 階層ごとに 2 つ
+        if depth <= 1:
+            rows.append((name.strip(), int(cumulative_us) / 1000))
+    return sorted(rows, key=lambda r: -r[1])[:n]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--port", type=int, default=8123)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--importtime", action="store_true")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = ap.parse_args()
+
+    os.environ.setdefault("SECRET_KEY", "bench-startup-dummy-secret")
+    runs = [one_run(args.port, args.timeout) for _ in range(args.runs)]
+    summary = {
+        key: statistics.median(r[key] for r in runs if r[key] is not None)
+        for key in ("ready_s", "first_risk_ms", "rss_ready_mb", "rss_after_risk_mb")
+    }
+    result = {"runs": runs, "median": summary}
+    if args.importtime:
+        result["importtime_ms"] = importtime_top(15)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        for r in runs:
+            print(f"  ready={r['ready_s']:.3f}s  first /risk={r['first_risk_ms']}ms  "
+                  f"rss={r['rss_ready_mb']}MB -> {r['rss_after_risk_mb']}MB")
+        print(f"median: ready={summary['ready_s']:.3f}s  first /risk={summary['first_risk_ms']}ms  "
+              f"rss={summary['rss_ready_mb']}MB -> {summary['rss_after_risk_mb']}MB")
+        for name, ms in result.get("importtime_ms", []):
+            print(f"  import {name:<40} {ms:8.1f} ms")
@@ -0,0 +1,398 @@
+# bench_suite.py
+# API の主要経路のベンチマーク（合成データ → 関数単位のマイクロベンチ → アプリ内の負荷試験 → JSON）
+#   python scripts/bench_suite.py --profile medium --out bench/result.json
+#   python scripts/bench_suite.py --profile medium --out bench/new.json --baseline bench/baseline.json [--threshold 0.15]
+#   python scripts/bench_suite.py --compare bench/baseline.json bench/new.json   # 保存済みの結果どうしを比べるだけ
+#
+#   ・データは一時ディレクトリの SQLite に scripts/bench_data.py で作る（--db で作成済みのベンチ用 DB を使い回す。
+#     無ければそこに作る）。規模は --profile small|medium|large か --terrain / --shelters / --users / --favorites
+#   ・マイクロベンチ: 最寄り地点（KD-tree / ラスタ）・/risk の応答参照・最寄り避難所・避難所クラスタ・お気に入り一覧の SQL
+#   ・負荷試験: httpx の ASGITransport でアプリを同じプロセス内で呼び、concurrency 本のクライアントで回す
+#     （ネットワークと uvicorn のワーカー構成を除いたアプリ自体の処理能力。本番構成は scripts/loadtest.py）
+#   ・--baseline を渡すと指標ごとに比べ、threshold（割合）を超えて悪化した指標があれば終了コード 1
+#     （同じマシン・同じ規模・十分な --duration で取った結果どうしを比べる。共有の CI 機では --threshold を広めに）
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from bench_data import add_size_arguments, build_dataset, sizes_from_args
+from loadtest import LAT_RANGE, LON_RANGE, Recorder, parse_mix
+
+RESULT_FORMAT = 1
+
+# 比べる指標（結果 JSON 内のパス, 大きい方が良いなら True）。micro.* / load.by_kind.* は実行時に展開する
+COMPARED_METRICS = (
+    ("startup_s", False),
+    ("load.rps", True),
+    ("load.total.p50_ms", False),
+    ("load.total.p95_ms", False),
+)
+MICRO_METRICS = (("p50_us", False), ("p95_us", False))
+KIND_METRICS = (("p50_ms", False), ("p95_ms", False))
+# これより小さい差は揺らぎとして無視する（単位ごと。数 µs の関数で 15% は誤差に埋もれる）
+NOISE_FLOOR = {"_us": 2.0, "_ms": 0.2, "_s": 0.05, "rps": 0.0}
+
+
+# -----------------------------------------------------------------------------
+# マイクロベンチ
+# -----------------------------------------------------------------------------
+def time_calls(fn, args: list[tuple], warmup: int) -> dict:
+    for a in args[:warmup]:
+        fn(*a)
+    ns = np.empty(len(args))
+    for i, a in enumerate(args):
+        t0 = time.perf_counter_ns()
+        fn(*a)
+        ns[i] = time.perf_counter_ns() - t0
+    us = ns / 1000
+    return {
+        "n": len(args),
+        "ops_per_s": round(1e6 / float(us.mean()), 1),
+        "p50_us": round(float(np.percentile(us, 50)), 2),
+        "p95_us": round(float(np.percentile(us, 95)), 2),
+        "p99_us": round(float(np.percentile(us, 99)), 2),
+    }
+
+
+def viewport_bbox(lat: float, lon: float, zoom: int, width_px: int = 1280, height_px: int = 800):
+    # 地図画面1枚ぶんの範囲（Web メルカトル、緯度方向は cos で近似）
+    deg_per_px = 360.0 / (256 * 2 ** zoom)
+    half_w = width_px / 2 * deg_per_px
+    half_h = height_px / 2 * deg_per_px * np.cos(np.radians(lat))
+    return lon - half_w, lat - half_h, lon + half_w, lat + half_h
+
+
+def run_micro(n: int, users: int, seed: int) -> dict:
+    import app_API
+    from database import ReadSessionLocal
+    from models import Favorite
+    from risk_payloads import risk_payloads
+    from spatial_index import MAX_DISTANCE_M, get_risk_locator, get_shelter_clusters, get_shelter_index
+    from sqlalchemy import select
+
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(*LAT_RANGE, n)
+    lons = rng.uniform(*LON_RANGE, n)
+    xs, ys = app_API.transformer.transform(lons, lats)
+    points = list(zip(lats.tolist(), lons.tolist()))
+    projected = list(zip(xs.tolist(), ys.tolist()))
+    warmup = max(n // 10, 1)
+
+    locator = get_risk_locator()
+    store = risk_payloads.store()
+    shelters = get_shelter_index()
+    clusters = get_shelter_clusters()
+    found_ids = [i for i in locator.nearest_many(xs, ys, MAX_DISTANCE_M)[0].tolist() if i >= 0] or [1]
+
+    def risk_lookup(lat, lon):
+        # /risk の処理からキャッシュと HTTP を除いたもの（投影 → 最寄り点 → 応答本体）
+        x, y = app_API.transformer.transform(lon, lat)
+        nearest_id, _ = locator.nearest(x, y, MAX_DISTANCE_M)
+        return store.body(nearest_id) if nearest_id is not None else None
+
+    batch = 1000
+    batches = [(np.roll(xs, -i)[:batch], np.roll(ys, -i)[:batch]) for i in range(0, 50 * 97, 97)]
+
+    def favorites_page(device_id):
+        # GET /favorites の1ページ目と同じ形の SQL（device_id で絞り created_at 降順）
+        with ReadSessionLocal() as db:
+            q = (select(*app_API.FAVORITE_COLUMNS).where(Favorite.device_id == device_id)
+                 .order_by(Favorite.created_at.desc(), Favorite.id.desc()).limit(app_API.FAVORITES_PAGE_DEFAULT + 1))
+            return db.execute(q).all()
+
+    devices = [(f"bench-device-{int(u)}",) for u in rng.integers(1, max(users, 1) + 1, min(n, 2000))]
+    return {
+        "locator": type(locator).__name__,
+        "risk_locator.nearest": time_calls(lambda x, y: locator.nearest(x, y, MAX_DISTANCE_M), projected, warmup),
+        f"risk_locator.nearest_many[{batch}]": time_calls(
+            lambda bx, by: locator.nearest_many(bx, by, MAX_DISTANCE_M), batches, 2),
+        "risk_payloads.body": time_calls(store.body, [(found_ids[i % len(found_ids)],) for i in range(n)], warmup),
+        "risk_lookup": time_calls(risk_lookup, points, warmup),
+        "shelters.nearest[3]": time_calls(lambda lat, lon: shelters.nearest(lat, lon, 3), points, warmup),
+        "shelters.nearest[3,type]": time_calls(
+            lambda lat, lon: shelters.nearest(lat, lon, 3, shelter_type="指定避難所"), points, warmup),
+        "shelter_clusters.query[z12]": time_calls(
+            lambda lat, lon: clusters.query(viewport_bbox(lat, lon, 12), 12, app_API.SHELTER_BBOX_MAX_ITEMS),
+            points[:min(n, 500)], 10),
+        "shelter_clusters.query[z16]": time_calls(
+            lambda lat, lon: clusters.query(viewport_bbox(lat, lon, 16), 16, app_API.SHELTER_BBOX_MAX_ITEMS),
+            points[:min(n, 500)], 10),
+        "favorites.page_sql": time_calls(favorites_page, devices, min(len(devices) // 10, 50)),
+    }
+
+
+# -----------------------------------------------------------------------------
+# アプリ内の負荷試験
+# -----------------------------------------------------------------------------
+def make_request(kind: str, users: int, tokens: dict[int, str]) -> tuple[str, str, dict]:
+    # 戻り値: (method, path, httpx へ渡す引数)
+    lat = random.uniform(*LAT_RANGE)
+    lon = random.uniform(*LON_RANGE)
+    user = random.randint(1, max(users, 1))
+    device = {"X-Device-ID": f"bench-device-{user}"}
+    if kind == "risk":
+        return "GET", "/risk", {"params": {"lat": lat, "lon": lon}}
+    if kind == "risk_full":
+        return "GET", "/risk/full", {"params": {"lat": lat, "lon": lon}}
+    if kind == "shelters":
+        return "GET", "/shelters/nearest", {"params": {"lat": lat, "lon": lon, "limit": 3}}
+    if kind == "shelters_bbox":
+        zoom = random.choice((12, 14, 16))
+        bbox = ",".join(f"{v:.6f}" for v in viewport_bbox(lat, lon, zoom))
+        return "GET", "/shelters", {"params": {"bbox": bbox, "zoom": zoom}}
+    if kind == "favorites":
+        return "GET", "/favorites", {"headers": device}
+    if kind == "favorites_user":
+        # ログイン済み利用者（user_id で絞る経路）。トークンは起動時に作っておく
+        token = tokens[user % len(tokens) + 1] if tokens else ""
+        return "GET", "/favorites", {"headers": {"Authorization": f"Bearer {token}"}}
+    if kind == "favorites_sync":
+        body = {"since": 0, "creates": [{"client_id": "bench", "lat": lat, "lon": lon, "title": "bench"}]}
+        return "POST", "/favorites/sync", {"headers": device, "json": body}
+    raise ValueError(f"unknown request kind: {kind}")
+
+
+async def run_load(mix, concurrency: int, duration: float, warmup: float, users: int, timeout: float) -> dict:
+    import httpx
+
+    import app_API
+
+    kinds = [name for name, _ in mix]
+    weights = [w for _, w in mix]
+    for kind in kinds:
+        make_request(kind, users, {1: ""})  # 未知の種類はここで止める
+    tokens = {i: app_API.create_access_token({"sub": str(i)}) for i in range(1, min(users, 100) + 1)}
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app_API.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+        started = time.perf_counter()
+        measure_from = started + warmup
+        deadline = measure_from + duration
+
+        async def worker():
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    return
+                kind = random.choices(kinds, weights)[0]
+                method, path, kwargs = make_request(kind, users, tokens)
+                t0 = time.perf_counter()
+                try:
+                    ok = (await client.request(method, path, **kwargs)).status_code < 400
+                except (httpx.HTTPError, asyncio.TimeoutError):
+                    ok = False
+                if now >= measure_from:
+                    recorder.add(kind, time.perf_counter() - t0, ok)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return recorder.summary(duration)
+
+
+async def _call_handlers(handlers):
+    for handler in handlers:
+        result = handler()
+        if asyncio.iscoroutine(result):
+            await result
+
+
+async def run_app(args, users: int) -> tuple[float, dict, dict]:
+    # 起動時の処理（インデックス構築など）→ マイクロベンチ → 負荷試験 → 終了時の処理を1つのイベントループで
+    import app_API
+
+    t0 = time.perf_counter()
+    await _call_handlers(app_API.app.router.on_startup)
+    startup_s = round(time.perf_counter() - t0, 3)
+    try:
+        micro = run_micro(args.micro_n, users, args.seed)
+        load = await run_load(parse_mix(args.mix), args.concurrency, args.duration, args.warmup, users, args.timeout)
+    finally:
+        await _call_handlers(app_API.app.router.on_shutdown)
+    return startup_s, micro, load
+
+
+# -----------------------------------------------------------------------------
+# 結果の比較
+# -----------------------------------------------------------------------------
+def _get(result: dict, path: str):
+    value = result
+    for key in path.split("|"):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _metrics(result: dict) -> list[tuple[str, bool]]:
+    metrics = [(path.replace(".", "|"), higher) for path, higher in COMPARED_METRICS]
+    for name, stats in (result.get("micro") or {}).items():
+        if isinstance(stats, dict):
+            metrics += [(f"micro|{name}|{m}", higher) for m, higher in MICRO_METRICS]
+    for kind in ((result.get("load") or {}).get("by_kind") or {}):
+        metrics += [(f"load|by_kind|{kind}|{m}", higher) for m, higher in KIND_METRICS]
+    metrics.append(("load|errors", False))
+    return metrics
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> tuple[list[dict], list[str]]:
+    # 戻り値: (指標ごとの比較, 注意書き)
+    notes = []
+    if baseline.get("dataset", {}).get("sizes") != current.get("dataset", {}).get("sizes"):
+        notes.append(f"データ規模が違います: baseline={baseline.get('dataset', {}).get('sizes')} "
+                     f"current={current.get('dataset', {}).get('sizes')}")
+    if baseline.get("meta", {}).get("cpu_count") != current.get("meta", {}).get("cpu_count"):
+        notes.append("CPU 数が違うマシンの結果です")
+    rows = []
+    for path, higher_is_better in _metrics(current):
+        base, new = _get(baseline, path), _get(current, path)
+        if not isinstance(base, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        name = path.replace("|", ".")
+        if path == "load|errors":
+            regressed = new > base
+        else:
+            floor = next((v for suffix, v in NOISE_FLOOR.items() if path.endswith(suffix)), 0.0)
+            worse = (base - new) if higher_is_better else (new - base)
+            regressed = worse > max(abs(base) * threshold, floor)
+        change = (new - base) / base if base else None
+        rows.append({"metric": name, "baseline": base, "current": new,
+                     "change": round(change, 4) if change is not None else None, "regressed": regressed})
+    return rows, notes
+
+
+def print_comparison(rows: list[dict], notes: list[str], threshold: float):
+    for note in notes:
+        print(f"⚠️  {note}")
+    for r in rows:
+        change = f"{r['change'] * 100:+7.1f}%" if r["change"] is not None else "      -"
+        mark = "  ← 悪化" if r["regressed"] else ""
+        print(f"  {r['metric']:<48} {r['baseline']:>12} → {r['current']:>12}  {change}{mark}")
+    regressed = [r for r in rows if r["regressed"]]
+    if regressed:
+        print(f"❌ {len(regressed)} 指標が {threshold * 100:.0f}% を超えて悪化しました")
+    else:
+        print(f"✅ 悪化なし（threshold {threshold * 100:.0f}%）")
+
+
+# -----------------------------------------------------------------------------
+# 実行
+# -----------------------------------------------------------------------------
+def dataset_sizes(db_path: Path) -> dict:
+    with sqlite3.connect(db_path) as conn:
+        count = lambda table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        users = count("users")
+        return {"terrain": count("terrain_risk"), "shelters": count("shelters"), "users": users,
+                "favorites": round(count("favorites") / users) if users else 0}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: dict):
+    print(f"startup: {result['startup_s']} s  (locator={result['micro']['locator']})")
+    for name, s in result["micro"].items():
+        if isinstance(s, dict):
+            print(f"  {name:<32} {s['ops_per_s']:>12,.1f} ops/s  p50={s['p50_us']:>9}µs  "
+                  f"p95={s['p95_us']:>9}µs  p99={s['p99_us']:>9}µs")
+    load = result["load"]
+    total = load["total"]
+    print(f"load: rps={load['rps']:,.1f}  errors={load['errors']}  "
+          f"p50={total.get('p50_ms')}ms p95={total.get('p95_ms')}ms p99={total.get('p99_ms')}ms")
+    for kind, s in load["by_kind"].items():
+        print(f"  {kind:<16} n={s['count']:>7,}  p50={s['p50_ms']:>8}ms  p95={s['p95_ms']:>8}ms  "
+              f"p99={s['p99_ms']:>8}ms  errors={s['errors']}")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    add_size_arguments(ap)
+    ap.add_argument("--db", help="ベンチ用 DB（あれば使い回す。無ければここに作る）。省略時は一時ディレクトリ")
+    ap.add_argument("--micro-n", type=int, default=5000, help="マイクロベンチの呼び出し回数")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=15.0, help="負荷試験で計測する秒数")
+    ap.add_argument("--warmup", type=float, default=2.0, help="負荷試験の計測前に捨てる秒数")
+    ap.add_argument("--mix", default="risk=6,shelters=3,favorites=1",
+                    help="risk / risk_full / shelters / shelters_bbox / favorites / favorites_user / favorites_sync")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--out", help="結果の JSON を書き出すファイル")
+    ap.add_argument("--baseline", help="比べる基準の結果 JSON")
+    ap.add_argument("--threshold", type=float, default=0.15, help="悪化とみなす割合（0.15 = 15%）")
+    ap.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="実行せずに結果 JSON どうしを比べる")
+    args = ap.parse_args()
+
+    if args.compare:
+        baseline, current = (json.loads(Path(p).read_text(encoding="utf-8")) for p in args.compare)
+        rows, notes = compare(baseline, current, args.threshold)
+        print_comparison(rows, notes, args.threshold)
+        return 1 if any(r["regressed"] for r in rows) else 0
+
+    tmp = None
+    if args.db:
+        db_path = Path(args.db).resolve()
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="bench-")
+        db_path = Path(tmp.name) / "app.db"
+    try:
+        # アプリの各モジュールは import 時に環境変数を読むので、データ作成・アプリの読み込みより前にベンチ用 DB に向ける
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+        os.environ.setdefault("SECRET_KEY", "bench-suite-dummy-secret-0123456789abcdef")
+        os.environ.setdefault("TILE_CACHE_DIR", str(db_path.parent / "tile_cache"))
+        os.environ.setdefault("RISK_TILE_DIR", str(db_path.parent / "risk_tiles"))
+        dataset = {"path": str(db_path), "build_s": None}
+        if not db_path.exists():
+            dataset.update(build_dataset(db_path, seed=args.seed, **sizes_from_args(args)))
+        dataset["sizes"] = dataset_sizes(db_path)
+
+        random.seed(args.seed)
+        startup_s, micro, load = asyncio.run(run_app(args, dataset["sizes"]["users"]))
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    result = {
+        "format": RESULT_FORMAT,
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "argv": sys.argv[1:],
+            "load": {"mix": args.mix, "concurrency": args.concurrency, "duration_s": args.duration},
+        },
+        "dataset": dataset,
+        "startup_s": startup_s,
+        "micro": micro,
+        "load": load,
+    }
+    print_result(result)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"結果: {args.out}")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        rows, notes = compare(baseline, result, args.threshold)
+        print_comparison(rows, notes, args.threshold)
+        return 1 if any(r["regressed"] for r in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+# build_risk_payloads.py
+# /risk の応答（risk_payloads / terrain_risk.payload_id）を作る
+#   python scripts/build_risk_payloads.py [--rebuild]
+# import_csv_to_db.py は取り込みの最後に同じ処理を行うので、通常は実行不要。
+# この仕組みより前に取り込んだ DB や、説明文の文面を変えて RISK_PAYLOAD_VERSION を上げた後に使う
+# （未設定の行があっても API は動くが、起動のたびにメモリ上で作るぶん遅くなる）。
+import argparse
+
+from database import engine
+from models import RiskPayload
+from risk_payloads import RISK_PAYLOAD_VERSION, build_risk_payloads
+from schema import ensure_terrain_risk_columns
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rebuild", action="store_true", help="作成済みの応答も捨てて全行作り直す")
+    args = ap.parse_args()
+
+    RiskPayload.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        ensure_terrain_risk_columns(conn)
+        result = build_risk_payloads(conn, rebuild=args.rebuild)
+    print(f"✅ /risk 応答 (v{RISK_PAYLOAD_VERSION}): {result['rows']:,} 行に割当, 種類 {result['payloads']:,}"
+          f"（新規 {result['created']:,} / 削除 {result['pruned']:,}）{result['seconds']} 秒")
@@ -0,0 +1,122 @@
+# build_risk_raster.py
+# terrain_risk を EPSG:6674 の固定グリッドにラスタ化し、/risk 用のメモリマップファイルを作る
+#   python scripts/build_risk_raster.py --out ./data/risk_raster --cell 20
+# 出力後、API 側で RISK_RASTER_DIR=./data/risk_raster を設定すると /risk がラスタ参照になる。
+# terrain_risk を再インポートしたら作り直すこと（作り直すまで API はラスタを使わず KD-tree で応答する）。
+import argparse
+import json
+import math
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from database import SessionLocal, engine
+from dataset_versions import RISK_RASTER, bump_dataset_version, print_bumped
+from spatial_index import MAX_DISTANCE_M, RiskIndex, RiskRaster, terrain_fingerprint
+
+ROWS_PER_STRIP = 256
+
+
+def _save_atomic(path: Path, arr: np.ndarray):
+    # 稼働中ワーカーが旧ファイルを mmap していても壊さないよう、別名で書いて置き換える
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def build(out_dir: Path, cell_size: float, max_distance: float):
+    with SessionLocal() as db:
+        index = RiskIndex.from_session(db)
+        fingerprint = terrain_fingerprint(db)  # 同じトランザクションで（API はこれが今の表と一致する時だけ使う）
+    if len(index) == 0:
+        raise SystemExit("terrain_risk が空です")
+
+    # セル内の点はセル中心から最大 半対角（h）ずれる。セル中心から最寄り点までを D1、2番目までを D2 とすると
+    #   ・D1 - h > max_distance        → セル内のどこからでも一致なし（NO_MATCH）
+    #   ・D2 - D1 > 2h                 → セル内のどこからでも最寄り点は同じ（その点のインデックス）
+    #   ・それ以外                      → セル中心から min(D1 + 2h, max_distance + h) 以内の点を候補として持つ
+    #     （問い合わせ地点の本当の最寄り点はこの範囲に必ず入る。参照時に実距離で比べる）
+    half_diag = cell_size * math.sqrt(2) / 2
+    search_radius = max_distance + 3 * half_diag
+
+    minx, miny = index.xy.min(axis=0) - max_distance
+    maxx, maxy = index.xy.max(axis=0) + max_distance
+    x0 = math.floor(minx / cell_size) * cell_size
+    y0 = math.floor(miny / cell_size) * cell_size
+    ncols = int(math.ceil((maxx - x0) / cell_size))
+    nrows = int(math.ceil((maxy - y0) / cell_size))
+    print(f"grid: {nrows} x {ncols} cells ({nrows * ncols * 4 / 1e6:.1f} MB), cell={cell_size} m")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cells_path = out_dir / "cells.npy"
+    tmp_cells = out_dir / "cells.npy.tmp"
+    cells = np.lib.format.open_memmap(tmp_cells, mode="w+", dtype=np.int32, shape=(nrows, ncols))
+    cand_counts: list[np.ndarray] = []
+    cand_idx: list[np.ndarray] = []
+    n_ambiguous = 0
+
+    t0 = time.perf_counter()
+    cx = x0 + (np.arange(ncols) + 0.5) * cell_size
+    for r0 in range(0, nrows, ROWS_PER_STRIP):
+        r1 = min(r0 + ROWS_PER_STRIP, nrows)
+        cy = y0 + (np.arange(r0, r1) + 0.5) * cell_size
+        gx, gy = np.meshgrid(cx, cy)
+        centers = np.column_stack([gx.ravel(), gy.ravel()])
+        dist, k = index.tree.query(centers, k=2, distance_upper_bound=search_radius)
+        d1, d2 = dist[:, 0], dist[:, 1]
+        with np.errstate(invalid="ignore"):  # 2点とも見つからないセルは inf - inf
+            unique = d2 - d1 > 2 * half_diag
+        out = np.where(unique, k[:, 0], 0).astype(np.int64)
+        out[d1 - half_diag > max_distance] = RiskRaster.NO_MATCH
+        ambiguous = np.flatnonzero((d1 - half_diag <= max_distance) & ~unique)
+        if len(ambiguous):
+            if n_ambiguous + len(ambiguous) + 2 > 2 ** 31:
+                raise SystemExit("候補リストを持つセルが多すぎます（--cell を小さくしてください）")
+            radius = np.minimum(d1[ambiguous] + 2 * half_diag, max_distance + half_diag)
+            lists = index.tree.query_ball_point(centers[ambiguous], radius)
+            cand_counts.append(np.fromiter((len(c) for c in lists), dtype=np.int64, count=len(lists)))
+            cand_idx.append(np.fromiter((i for c in lists for i in c), dtype=np.int32))
+            out[ambiguous] = -2 - (n_ambiguous + np.arange(len(ambiguous)))
+            n_ambiguous += len(ambiguous)
+        cells[r0:r1] = out.reshape(r1 - r0, ncols)
+    cells.flush()
+    del cells
+
+    counts = np.concatenate(cand_counts) if cand_counts else np.zeros(0, dtype=np.int64)
+    indptr = np.zeros(n_ambiguous + 1, dtype=np.int32 if counts.sum() < 2 ** 31 else np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    idx = np.concatenate(cand_idx) if cand_idx else np.zeros(0, dtype=np.int32)
+    _save_atomic(out_dir / "cand_indptr.npy", indptr)
+    _save_atomic(out_dir / "cand_idx.npy", idx)
+    os.replace(tmp_cells, cells_path)
+    print(f"  候補リストを持つセル: {n_ambiguous:,} / {nrows * ncols:,}（平均 {len(idx) / max(n_ambiguous, 1):.1f} 点）")
+
+    _save_atomic(out_dir / "ids.npy", index.ids.astype(np.int64))
+    _save_atomic(out_dir / "xy.npy", index.xy.astype(np.float64))
+    meta = {
+        "format": RiskRaster.FORMAT, "crs": "EPSG:6674", "x0": x0, "y0": y0, "cell_size": cell_size,
+        "nrows": nrows, "ncols": ncols, "max_distance": max_distance, "points": len(index),
+        "terrain_fingerprint": fingerprint,
+    }
+    tmp_meta = out_dir / "meta.json.tmp"
+    tmp_meta.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    os.replace(tmp_meta, out_dir / "meta.json")
+
+    print(f"✅ {len(index)} 点をラスタ化しました ({time.perf_counter() - t0:.1f} s) → {out_dir}")
+    print_bumped(bump_dataset_version(engine, RISK_RASTER), RISK_RASTER)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default="./data/risk_raster")
+    ap.add_argument("--cell", type=float, default=20.0, help="セルサイズ [m]")
+    ap.add_argument("--max-distance", type=float, default=MAX_DISTANCE_M)
+    args = ap.parse_args()
+    build(Path(args.out), args.cell, args.max_distance)
+
+
+if __name__ == "__main__":
+    main()
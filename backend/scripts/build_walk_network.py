@@ -0,0 +1,198 @@
+# build_walk_network.py
+# 道路ネットワーク（GeoJSON の LineString）から徒歩距離の「最寄り避難所表」を作る（/shelters/nearest?mode=walk 用）
+#   python scripts/build_walk_network.py --roads ./data/osaka_roads.geojson --out ./data/walk_network [--k 8]
+# 出力後、API 側で WALK_NETWORK_DIR=./data/walk_network を設定すると mode=walk が使えるようになる。
+#   ・道路の線の頂点をノード、隣り合う頂点を辺（長さ = 大円距離 [m]）として CSR 形式のグラフにする
+#     （線どうしは同じ座標の頂点を共有していれば交差点としてつながる。国土地理院の道路中心線や OSM の書き出しなど）
+#   ・全避難所を始点にした多始点 Dijkstra で、各ノードから近い順に k 件の避難所と道のりを求めて保存する
+#   ・API は問い合わせ地点を最寄りノードに寄せて表を引くだけ（リクエストごとの経路探索はしない）
+# 避難所を再インポートしたら作り直すこと（表には shelters.id が入っている）。
+import argparse
+import heapq
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from database import SessionLocal, engine
+from dataset_versions import WALK_NETWORK, bump_dataset_version, print_bumped
+from geojson_stream import iter_features
+from spatial_index import EARTH_RADIUS_KM, WALK_SNAP_MAX_M, ShelterIndex, unit_vectors
+
+# 歩けない道路（OSM の highway / 地理院の道路中心線の rdCtg）
+NOT_WALKABLE = {
+    "highway": {"motorway", "motorway_link", "trunk", "trunk_link", "construction", "proposed"},
+    "rdCtg": {"高速自動車国道等"},
+}
+COORD_DECIMALS = 7  # 頂点の同一判定（約 1cm）
+
+
+def _save_atomic(path: Path, arr: np.ndarray):
+    # 稼働中ワーカーが旧ファイルを mmap していても壊さないよう、別名で書いて置き換える
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def _walkable(props: dict) -> bool:
+    if props.get("foot") == "no" or props.get("access") == "no":
+        return False
+    return not any(props.get(key) in values for key, values in NOT_WALKABLE.items())
+
+
+def _lines(geometry):
+    if not geometry:
+        return
+    if geometry["type"] == "LineString":
+        yield geometry["coordinates"]
+    elif geometry["type"] == "MultiLineString":
+        yield from geometry["coordinates"]
+
+
+def load_roads(path) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # 戻り値: (ノードの lon/lat (N, 2), 辺の始点, 辺の終点)  辺は片方向に1本ずつ
+    node_of: dict[tuple, int] = {}
+    lonlat: list[tuple] = []
+    us: list[int] = []
+    vs: list[int] = []
+    skipped = 0
+    for feature in iter_features(path):
+        if not _walkable(feature.get("properties") or {}):
+            skipped += 1
+            continue
+        for coords in _lines(feature.get("geometry")):
+            prev = None
+            for c in coords:
+                key = (round(c[0], COORD_DECIMALS), round(c[1], COORD_DECIMALS))
+                node = node_of.get(key)
+                if node is None:
+                    node = node_of[key] = len(lonlat)
+                    lonlat.append(key)
+                if prev is not None and prev != node:
+                    us.append(prev)
+                    vs.append(node)
+                prev = node
+    print(f"  道路: {len(lonlat):,} ノード / {len(us):,} 辺（歩行不可として除外 {skipped:,} 本）")
+    return (np.array(lonlat, dtype=np.float64).reshape(-1, 2),
+            np.array(us, dtype=np.int64), np.array(vs, dtype=np.int64))
+
+
+def build_csr(n: int, us: np.ndarray, vs: np.ndarray, lonlat: np.ndarray):
+    # 無向グラフとして両方向の辺を持つ CSR（indptr, indices, weights[m]）
+    src = np.concatenate([us, vs])
+    dst = np.concatenate([vs, us])
+    lon, lat = lonlat[:, 0], lonlat[:, 1]
+    dlat = np.radians(lat[dst] - lat[src])
+    dlon = np.radians(lon[dst] - lon[src])
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat[src])) * np.cos(np.radians(lat[dst])) * np.sin(dlon / 2) ** 2
+    weights = 2 * EARTH_RADIUS_KM * 1000 * np.arcsin(np.sqrt(a))
+
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order].astype(np.int32), weights[order].astype(np.float32)
+
+
+def snap_shelters(shelters: ShelterIndex, lonlat: np.ndarray, max_snap_m: float):
+    # 避難所 → 最寄りノード（max_snap_m より遠い避難所は道路網に乗らないので始点にしない）
+    tree = cKDTree(unit_vectors(lonlat[:, 1], lonlat[:, 0]))
+    chord, node = tree.query(unit_vectors(shelters.cols["lat"], shelters.cols["lon"]))
+    snap_m = 2 * EARTH_RADIUS_KM * 1000 * np.arcsin(np.minimum(chord / 2, 1.0))
+    ok = snap_m <= max_snap_m
+    return shelters.cols["id"][ok], node[ok], snap_m[ok], int((~ok).sum())
+
+
+def nearest_k_shelters(indptr, indices, weights, sources, k: int):
+    # 多始点 Dijkstra（ラベルを k 個まで持つ版）
+    #   各ノードについて「異なる避難所」を近い順に k 件確定させる。(ノード, 避難所) の組は初めて
+    #   取り出された時が最短なので、ノードごとに先着 k 件の避難所を採ればよい
+    #   sources: [(初期距離 = 避難所から最寄りノードまで [m], ノード, shelters.id), ...]
+    n = len(indptr) - 1
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    weights = weights.tolist()
+    found = [[] for _ in range(n)]  # ノードごとの [(shelters.id, 道のり[m]), ...]（近い順）
+    heap = [(float(d), int(node), int(sid)) for d, node, sid in sources]
+    heapq.heapify(heap)
+    pops = 0
+    while heap:
+        d, u, sid = heapq.heappop(heap)
+        pops += 1
+        labels = found[u]
+        if len(labels) >= k or any(s == sid for s, _ in labels):
+            continue
+        labels.append((sid, d))
+        for j in range(indptr[u], indptr[u + 1]):
+            v = indices[j]
+            nv = found[v]
+            if len(nv) < k and not any(s == sid for s, _ in nv):
+                heapq.heappush(heap, (d + weights[j], v, sid))
+
+    ids = np.full((n, k), -1, dtype=np.int32)
+    dist = np.full((n, k), np.inf, dtype=np.float32)
+    for u, labels in enumerate(found):
+        for c, (sid, d) in enumerate(labels):
+            ids[u, c] = sid
+            dist[u, c] = d
+    return ids, dist, pops
+
+
+def build(roads: Path, out_dir: Path, k: int, max_snap_m: float):
+    t0 = time.perf_counter()
+    lonlat, us, vs = load_roads(roads)
+    if len(us) == 0:
+        raise SystemExit("道路の線が見つかりません（LineString / MultiLineString の GeoJSON を指定してください）")
+    indptr, indices, weights = build_csr(len(lonlat), us, vs, lonlat)
+    print(f"  CSR: {len(indices):,} 辺（両方向） {time.perf_counter() - t0:.1f}s")
+
+    with SessionLocal() as db:
+        shelters = ShelterIndex.from_session(db)
+    if len(shelters) == 0:
+        raise SystemExit("shelters が空です")
+    shelter_ids, shelter_nodes, snap_m, far = snap_shelters(shelters, lonlat, max_snap_m)
+    print(f"  避難所: {len(shelter_ids):,} 件を始点に（道路から {max_snap_m:.0f} m 超で除外 {far:,} 件）")
+
+    t1 = time.perf_counter()
+    ids, dist, pops = nearest_k_shelters(indptr, indices, weights, zip(snap_m, shelter_nodes, shelter_ids), k)
+    reached = int((ids[:, 0] >= 0).sum())
+    print(f"  Dijkstra: k={k}, {pops:,} pops, {reached:,}/{len(lonlat):,} ノードに到達 {time.perf_counter() - t1:.1f}s")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, arr in (("nodes", lonlat), ("csr_indptr", indptr), ("csr_indices", indices), ("csr_weights", weights),
+                      ("nearest_ids", ids), ("nearest_m", dist)):
+        _save_atomic(out_dir / f"{name}.npy", arr)
+    meta = {
+        "k": k,
+        "nodes": len(lonlat),
+        "edges": len(indices),
+        "reached_nodes": reached,
+        "max_snap_m": max_snap_m,
+        "shelters": len(shelter_ids),
+        # API 側で避難所の入れ替えを検知するための指紋（spatial_index.WalkNetwork.stale）
+        "shelter_fingerprint": [len(shelters), int(shelters.cols["id"].max())],
+        "roads": str(roads),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    # meta.json は最後に置き換える（API はこれを見て読み込む）
+    tmp = out_dir / "meta.json.tmp"
+    tmp.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, out_dir / "meta.json")
+    size_mb = sum((out_dir / f"{n}.npy").stat().st_size for n in ("nodes", "nearest_ids", "nearest_m")) / 1024 / 1024
+    print(f"✅ {out_dir} に出力しました（API が読む表 {size_mb:.1f} MB）{time.perf_counter() - t0:.1f}s")
+    print_bumped(bump_dataset_version(engine, WALK_NETWORK), WALK_NETWORK)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--roads", required=True, help="道路の GeoJSON（LineString / MultiLineString, WGS84）")
+    ap.add_argument("--out", default="./data/walk_network")
+    ap.add_argument("--k", type=int, default=8, help="ノードごとに持つ避難所の件数（mode=walk の limit 上限）")
+    ap.add_argument("--snap", type=float, default=WALK_SNAP_MAX_M, help="避難所を道路に寄せる最大距離 [m]")
+    args = ap.parse_args()
+    if not 1 <= args.k <= 50:
+        raise SystemExit("--k は 1〜50")
+    build(Path(args.roads), Path(args.out), args.k, args.snap)
@@ -0,0 +1,23 @@
+# build_ward_stats.py
+# 区ごとの集計（ward_stats / ward_risk_counts と terrain_risk・shelters の ward_code）を作る（GET /wards/{code}/stats 用）
+#   python scripts/build_ward_stats.py [--wards ./data/N03-19_27_190101.geojson] [--rebuild]
+# import_csv_to_db.py / import_shelters_from_geojson.py は取り込みの最後に同じ処理を行うので、通常は実行不要。
+# 区界ファイルを後から置いた時や、取り込み時に WARD_GEOJSON_PATH が見つからなかった時に使う。
+import argparse
+
+from database import engine
+from ward_stats import WARD_GEOJSON_PATH, build_ward_stats, ensure_ward_tables
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--wards", default=WARD_GEOJSON_PATH, help="N03 行政区域の GeoJSON")
+    ap.add_argument("--rebuild", action="store_true", help="判定済みの区コードも捨てて全行振り直す")
+    args = ap.parse_args()
+
+    ensure_ward_tables(engine)
+    with engine.begin() as conn:
+        result = build_ward_stats(conn, args.wards, rebuild=args.rebuild)
+    print(f"✅ 区ごとの集計 ({result['boundary_version']}): {result['wards']} 区, "
+          f"区コード判定 地点 {result['terrain_assigned']:,} / 避難所 {result['shelters_assigned']:,}, "
+          f"再集計 {result['recomputed_wards']} 区（区外 地点 {result['terrain_outside']:,} / "
+          f"避難所 {result['shelters_outside']:,}）{result['seconds']} 秒")
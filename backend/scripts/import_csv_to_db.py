@@ -1,55 +1,110 @@
 # import_csv_to_db.py
-
+# terrain_risk だけを入れ替える一括インポート（users / favorites / shelters には触らない）
+#   python scripts/import_csv_to_db.py [/data/inosaka_overall_risk.csv] [--chunksize 50000] [--batch 5000] [--append]
+import argparse
+import time
 
 import pandas as pd
-from sqlalchemy import create_engine
-from models import TerrainRisk, Base
-from database import engine, SessionLocal
-
-Base.metadata.drop_all(bind=engine)   # 既存のテーブル削除
-Base.metadata.create_all(bind=engine) # 再作成
-db = SessionLocal()
-
-# ======== CSV 読み込み ========
-csv_path = "/data/inosaka_overall_risk.csv"
-df = pd.read_csv(csv_path)
-
-
-
-# ======== データ登録 ========
-for _, row in df.iterrows():
-    try:
-        # 緯度経度が欠損していないかチェック
-        if pd.isna(row["lat"]) or pd.isna(row["lon"]):
-            continue
-
-        # CSVの値をDBフィールドに対応づける
-        if db.query(TerrainRisk).filter_by(lat=row["lat"], lon=row["lon"]).first():
-            continue
-
-        risk = TerrainRisk(
-            lat=float(row['lat']),
-            lon=float(row['lon']),
-            flood_risk = int(row.get("flood_score", 0) or 0),
-            landslide_risk = int(row.get("landslide_score", 0) or 0),
-            tsunami_risk = int(row.get("tsunami_score", 0) or 0),
-            overall_risk = int(row.get("overall_risk", 0) or 0),
-            risk_description = str(row.get("リスク一覧", "")) if pd.notna(row.get("リスク一覧")) else "",
-            elev_score = float(row.get("elev_score", 0) or 0),
-            slope_score = float(row.get("slope_score", 0) or 0),
-            river_score = float(row.get("river_score", 0) or 0),
-        )
-        db.add(risk)
-    except Exception as e:
-        print("⚠️ エラー行:", row)
-        print("原因:", e)
-
-db.commit()
-db.close()
-
-print("✅ CSVデータをDBに登録しました。")
-
-
-
-
-
+from models import RiskPayload, TerrainRisk
+from database import engine
+from dataset_versions import TERRAIN_RISK, bump_dataset_version, print_bumped
+from risk_payloads import build_risk_payloads
+from schema import ensure_spatial_tables, ensure_terrain_risk_columns
+from ward_stats import build_ward_stats_if_available, print_ward_stats_result
+
+DEFAULT_CSV_PATH = "/data/inosaka_overall_risk.csv"
+
+# CSV 列 → DB 列
+INT_COLUMNS = {
+    "flood_score": "flood_risk",
+    "landslide_score": "landslide_risk",
+    "tsunami_score": "tsunami_risk",
+    "overall_risk": "overall_risk",
+}
+FLOAT_COLUMNS = {
+    "elev_score": "elev_score",
+    "slope_score": "slope_score",
+    "river_score": "river_score",
+}
+DESCRIPTION_COLUMN = "リスク一覧"
+
+
+def convert_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    # 列単位でまとめて型変換（欠損・数値以外は 0 / "" に寄せる）
+    out = pd.DataFrame({
+        "lat": pd.to_numeric(chunk["lat"], errors="coerce"),
+        "lon": pd.to_numeric(chunk["lon"], errors="coerce"),
+    })
+    for src, dst in INT_COLUMNS.items():
+        col = chunk[src] if src in chunk else 0
+        out[dst] = pd.to_numeric(col, errors="coerce").fillna(0).astype("int64")
+    for src, dst in FLOAT_COLUMNS.items():
+        col = chunk[src] if src in chunk else 0.0
+        out[dst] = pd.to_numeric(col, errors="coerce").fillna(0.0).astype("float64")
+    if DESCRIPTION_COLUMN in chunk:
+        out["risk_description"] = chunk[DESCRIPTION_COLUMN].where(chunk[DESCRIPTION_COLUMN].notna(), "").astype(str)
+    else:
+        out["risk_description"] = ""
+
+    # 緯度経度の欠損は除外、チャンク内の重複は先勝ち
+    out = out.dropna(subset=["lat", "lon"])
+    return out.drop_duplicates(subset=["lat", "lon"], keep="first")
+
+
+def main(csv_path: str, chunksize: int, batch: int, append: bool):
+    table = TerrainRisk.__table__
+    RiskPayload.__table__.create(bind=engine, checkfirst=True)
+    if not append:
+        table.drop(bind=engine, checkfirst=True)  # R*Tree 同期トリガも一緒に消える
+        table.create(bind=engine)  # ux_terrain_risk_lat_lon も作られる
+        with engine.begin() as conn:
+            # 取り込み中は行ごとのトリガを走らせず、最後に R*Tree をまとめて作り直す
+            conn.exec_driver_sql("DROP TABLE IF EXISTS terrain_risk_rtree")
+    else:
+        table.create(bind=engine, checkfirst=True)
+        with engine.begin() as conn:
+            ensure_terrain_risk_columns(conn)
+            ensure_spatial_tables(conn, only={"terrain_risk_rtree"})  # 追加分はトリガで同期
+
+    # チャンク間の重複は (lat, lon) のユニークインデックスで弾く
+    stmt = table.insert().prefix_with("OR IGNORE")
+
+    t0 = time.perf_counter()
+    read = inserted = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        read += len(chunk)
+        records = convert_chunk(chunk).to_dict("records")
+        for start in range(0, len(records), batch):
+            with engine.begin() as conn:  # 1トランザクション = batch 行
+                result = conn.execute(stmt, records[start:start + batch])
+                inserted += max(result.rowcount, 0)
+        elapsed = time.perf_counter() - t0
+        print(f"  {read:>10,} 行読込 / {inserted:>10,} 行登録  ({read / elapsed:,.0f} rows/s)")
+
+    with engine.begin() as conn:
+        ensure_spatial_tables(conn, only={"terrain_risk_rtree"})
+    # /risk の応答を地点ごとに作っておく（API は起動時にこれを読むだけ）
+    with engine.begin() as conn:
+        payloads = build_risk_payloads(conn)
+    print(f"   /risk 応答: {payloads['rows']:,} 行に割当, 種類 {payloads['payloads']:,}"
+          f"（新規 {payloads['created']:,} / 削除 {payloads['pruned']:,}）{payloads['seconds']} 秒")
+    # 区ごとの集計（入れ替えた地点は全件、--append なら追加分だけ区を判定する）
+    print_ward_stats_result(build_ward_stats_if_available(engine))
+    # 全部入れ終えてから版を上げる（API のワーカーはこれを見てインデックスを作り直す）
+    print_bumped(bump_dataset_version(engine, TERRAIN_RISK), TERRAIN_RISK)
+
+    elapsed = time.perf_counter() - t0
+    print(f"✅ CSVデータをDBに登録しました: {inserted:,} 行（スキップ {read - inserted:,} 行）"
+          f" {elapsed:.1f} 秒, {read / elapsed if elapsed else 0:,.0f} rows/s")
+    print("   ※ 事前計算ラスタを使っている場合は scripts/build_risk_raster.py で作り直してください"
+          "（作り直すまで API は古いラスタを使わず KD-tree で応答します）")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("csv_path", nargs="?", default=DEFAULT_CSV_PATH)
+    ap.add_argument("--chunksize", type=int, default=50_000, help="CSV を読み込む行数単位")
+    ap.add_argument("--batch", type=int, default=5_000, help="1トランザクションで挿入する行数")
+    ap.add_argument("--append", action="store_true", help="既存の terrain_risk を消さずに追加する")
+    args = ap.parse_args()
+    main(args.csv_path, args.chunksize, args.batch, args.append)
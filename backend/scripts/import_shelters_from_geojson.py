@@ -1,64 +1,135 @@
 # import_shelters_from_geojson.py
-import json
-from sqlalchemy.orm import Session
-from database import SessionLocal, engine
+# GSI の避難所 GeoJSON を feature 単位で読み、大阪府内だけを (name, lat, lon) で upsert する
+#   python scripts/import_shelters_from_geojson.py ./data/shelter_osaka.geojson [--batch 1000] [--no-filter]
+import argparse
+import time
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import engine
+from dataset_versions import SHELTERS, bump_dataset_version, print_bumped
 from models import Base, Shelter
+from geojson_stream import iter_features
+from schema import ensure_shelter_columns, ensure_spatial_tables
+from ward_stats import build_ward_stats_if_available, print_ward_stats_result
+
+# 大阪府の概略範囲（frontend の OSAKA_BOUNDS と同じ）minLon, minLat, maxLon, maxLat
+OSAKA_BBOX = (135.25, 34.35, 135.85, 34.95)
+OSAKA_WARD_PREFIX = "27"  # 全国地方公共団体コード（大阪府）
+
+UPSERT_COLUMNS = ("ward", "address", "type", "capacity", "phone", "opening_condition", "source")
+
+
+def feature_to_record(ft: dict) -> dict | None:
+    props = (ft.get("properties") or {})
+    geom  = (ft.get("geometry") or {})
+    coords = (geom.get("coordinates") or [])
+    if len(coords) < 2:
+        return None
+
+    lon, lat = coords[0], coords[1]
+
+    # GSI のプロパティ名に合わせたマッピング
+    name     = props.get("P20_002") or props.get("名称") or "名称不明"
+    ward     = props.get("P20_001") or props.get("区") or ""
+    address  = props.get("P20_003") or props.get("住所") or ""
+    typ      = props.get("P20_004")    or props.get("種別") or ""
+    capacity = props.get("P20_005") or props.get("収容人数")
+    try:
+        capacity = int(capacity) if capacity not in (None, "", "NaN") else None
+    except (TypeError, ValueError):
+        capacity = None
+    phone    = props.get("電話") or props.get("phone") or ""
+    cond     = props.get("開設条件") or props.get("opening_condition") or ""
+
+    return dict(
+        name=name, ward=str(ward), address=address, type=typ, capacity=capacity,
+        lat=lat, lon=lon, phone=phone, opening_condition=cond, source="geojson"
+    )
+
+
+def make_filter(bbox, ward_prefix):
+    # DB に触る前に大阪府外の feature を落とす
+    #   区コードがあればそれだけで判定する（bbox は尼崎・伊丹（28）や生駒（29）にもかかるため）
+    #   区コードが無い feature だけ bbox で判定する
+    min_lon, min_lat, max_lon, max_lat = bbox
 
-def main(path: str):
-    # テーブルがなければ作成
+    def keep(rec: dict) -> bool:
+        if ward_prefix and rec["ward"]:
+            return rec["ward"].startswith(ward_prefix)
+        return min_lon <= rec["lon"] <= max_lon and min_lat <= rec["lat"] <= max_lat
+
+    return keep
+
+
+def upsert_statement():
+    stmt = sqlite_insert(Shelter.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["name", "lat", "lon"],
+        set_={**{c: stmt.excluded[c] for c in UPSERT_COLUMNS}, "updated_at": func.now()},
+    )
+
+
+def main(path: str, batch: int = 1000, bbox=OSAKA_BBOX, ward_prefix=OSAKA_WARD_PREFIX, use_filter=True):
+    # テーブルがなければ作成（既存 DB には一意インデックスだけ後付け）
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_shelters_name_lat_lon ON shelters (name, lat, lon)"
+        )
+        ensure_spatial_tables(conn, only={"shelters_rtree"})  # R*Tree はトリガで upsert に追従する
+        ensure_shelter_columns(conn)
+        before = conn.execute(text("SELECT COUNT(*) FROM shelters")).scalar_one()
+
+    keep = make_filter(bbox, ward_prefix) if use_filter else (lambda rec: True)
+    stmt = upsert_statement()
+
+    t0 = time.perf_counter()
+    read = kept = 0
+    pending = []
+
+    def flush():
+        with engine.begin() as conn:  # 1トランザクション = batch 件
+            conn.execute(stmt, pending)
+        pending.clear()
+
+    for ft in iter_features(path):
+        read += 1
+        rec = feature_to_record(ft)
+        if rec is None or not keep(rec):
+            continue
+        pending.append(rec)
+        kept += 1
+        if len(pending) >= batch:
+            flush()
+            elapsed = time.perf_counter() - t0
+            print(f"  {read:>9,} features 読込 / {kept:>8,} 件 upsert  ({read / elapsed:,.0f} features/s)")
+    if pending:
+        flush()
+
+    with engine.connect() as conn:
+        after = conn.execute(text("SELECT COUNT(*) FROM shelters")).scalar_one()
+    elapsed = time.perf_counter() - t0
+    inserted = after - before
+    print(f"Inserted: {inserted}, Updated: {kept - inserted}, Filtered out: {read - kept} "
+          f"({elapsed:.1f} s, {read / elapsed if elapsed else 0:,.0f} features/s)")
+    # 区ごとの避難所数・収容人数（区コードは新しく入った避難所だけ判定する）
+    print_ward_stats_result(build_ward_stats_if_available(engine))
+    # 全部入れ終えてから版を上げる（API のワーカーはこれを見てインデックスを作り直す）
+    print_bumped(bump_dataset_version(engine, SHELTERS), SHELTERS)
 
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    feats = data.get("features", [])
-
-    inserted = 0
-    skipped = 0
-    with SessionLocal() as db:
-        for ft in feats:
-            props = (ft.get("properties") or {})
-            geom  = (ft.get("geometry") or {})
-            coords = (geom.get("coordinates") or [])
-            if len(coords) < 2:
-                continue
-
-            lon, lat = coords[0], coords[1]
-
-            # GSI のプロパティ名に合わせたマッピング
-            name     = props.get("P20_002") or props.get("名称") or "名称不明"
-            ward     = props.get("P20_001") or props.get("区") or ""
-            address  = props.get("P20_003") or props.get("住所") or ""
-            typ      = props.get("P20_004")    or props.get("種別") or ""
-            capacity = props.get("P20_005") or props.get("収容人数")
-            try:
-                capacity = int(capacity) if capacity not in (None, "", "NaN") else None
-            except:
-                capacity = None
-            phone    = props.get("電話") or props.get("phone") or ""
-            cond     = props.get("開設条件") or props.get("opening_condition") or ""
-
-            # すでに同じ (name, lat, lon) があればスキップ
-            exists = db.query(Shelter).filter(
-                Shelter.name == name,
-                Shelter.lat  == lat,
-                Shelter.lon  == lon
-            ).first()
-            if exists:
-                skipped += 1
-                continue
-
-            db.add(Shelter(
-                name=name, ward=ward, address=address, type=typ, capacity=capacity,
-                lat=lat, lon=lon, phone=phone, opening_condition=cond, source="geojson"
-            ))
-            inserted += 1
-
-        db.commit()
-
-    print(f"Inserted: {inserted}, Skipped (duplicate): {skipped}")
 
 if __name__ == "__main__":
-    import sys
+    ap = argparse.ArgumentParser()
     # 既定パスはあなたの現在の GeoJSON 位置
-    path = sys.argv[1] if len(sys.argv) > 1 else "./data/shelter_osaka.geojson"
-    main(path)
+    ap.add_argument("path", nargs="?", default="./data/shelter_osaka.geojson")
+    ap.add_argument("--batch", type=int, default=1000, help="1トランザクションで upsert する件数")
+    ap.add_argument("--bbox", default=",".join(map(str, OSAKA_BBOX)), help="minLon,minLat,maxLon,maxLat")
+    ap.add_argument("--ward-prefix", default=OSAKA_WARD_PREFIX, help="残す区コードの先頭（空で無効）")
+    ap.add_argument("--no-filter", action="store_true", help="範囲フィルタを使わず全件取り込む")
+    args = ap.parse_args()
+    main(
+        args.path, batch=args.batch,
+        bbox=tuple(float(v) for v in args.bbox.split(",")),
+        ward_prefix=args.ward_prefix, use_filter=not args.no_filter,
+    )
@@ -0,0 +1,232 @@
+# loadtest.py
+# 起動済みの API に同時接続で負荷をかけ、スループットとレイテンシ分布を測る
+#   uvicorn app_API:app --port 8000 &
+#   python scripts/loadtest.py --url http://127.0.0.1:8000 --concurrency 64 --duration 20
+#
+#   --mix risk=6,shelters=3,favorites=1   エンドポイントごとの比率
+#   --rate 400                              目標 rps（指定すると開ループ。p99 を揃えて比較するとき用）
+#
+# クライアント側が先に CPU を使い切らないよう、keep-alive の HTTP/1.1 を asyncio で直接話す
+# （JSON 応答だけを読む簡易実装。Content-Length と chunked に対応）
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+# 大阪市中心部の範囲（ここから一様に地点を選ぶ。キャッシュに当たりすぎないよう細かくばらす）
+LAT_RANGE = (34.60, 34.75)
+LON_RANGE = (135.40, 135.60)
+
+
+def parse_mix(text: str) -> list[tuple[str, int]]:
+    mix = []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix.append((name.strip(), int(weight or 1)))
+    return mix
+
+
+def make_request(kind: str, host: str, device_id: str) -> bytes:
+    lat = random.uniform(*LAT_RANGE)
+    lon = random.uniform(*LON_RANGE)
+    body = b""
+    headers = {"Host": host, "X-Device-ID": device_id}
+    if kind == "risk":
+        method, path = "GET", "/risk?" + urlencode({"lat": lat, "lon": lon})
+    elif kind == "shelters":
+        method, path = "GET", "/shelters/nearest?" + urlencode({"lat": lat, "lon": lon, "limit": 3})
+    elif kind == "favorites":
+        method, path = "GET", "/favorites"
+    elif kind == "favorites_add":
+        method, path = "POST", "/favorites"
+        body = json.dumps({"lat": lat, "lon": lon, "title": "loadtest"}).encode()
+        headers["Content-Type"] = "application/json"
+    else:
+        raise ValueError(f"unknown request kind: {kind}")
+    headers["Content-Length"] = str(len(body))
+    head = f"{method} {path} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    return head.encode() + body
+
+
+class Connection:
+    # 1 本の keep-alive 接続。切れたら次のリクエストで張り直す
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, raw: bytes) -> int:
+        reused = self.writer is not None
+        if not reused:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            self.writer.write(raw)
+            try:
+                head = await self.reader.readuntil(b"\r\n\r\n")
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                # サーバ側の keep-alive タイムアウトで閉じられていた接続なら張り直して1回だけ再送
+                if not reused or getattr(e, "partial", b""):
+                    raise
+                self.close()
+                return await self.request(raw)
+            status_line, *header_lines = head.decode("latin-1").split("\r\n")
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if headers.get("transfer-encoding") == "chunked":
+                while True:
+                    size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                    await self.reader.readexactly(size + 2)
+                    if size == 0:
+                        break
+            else:
+                await self.reader.readexactly(int(headers.get("content-length", "0")))
+            if headers.get("connection") == "close":
+                self.close()
+            return int(status_line.split(" ", 2)[1])
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            self.close()
+            raise
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, kind: str, seconds: float, ok: bool):
+        self.latencies.setdefault(kind, []).append(seconds)
+        if not ok:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        def stats(values):
+            ms = np.asarray(values) * 1000
+            return {
+                "count": int(ms.size),
+                "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                "p95_ms": round(float(np.percentile(ms, 95)), 2),
+                "p99_ms": round(float(np.percentile(ms, 99)), 2),
+                "max_ms": round(float(ms.max()), 2),
+            }
+
+        everything = [v for values in self.latencies.values() for v in values]
+        total = stats(everything) if everything else {"count": 0}
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "rps": round(len(everything) / elapsed, 1) if elapsed else 0.0,
+            "errors": sum(self.errors.values()),
+            "total": total,
+            "by_kind": {k: {**stats(v), "errors": self.errors.get(k, 0)} for k, v in sorted(self.latencies.items())},
+        }
+
+
+async def run(url: str, concurrency: int, duration: float, warmup: float, mix, rate: float | None, timeout: float):
+    kinds = [name for name, _ in mix]
+    weights = [w for _, w in mix]
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    recorder = Recorder()
+    idle = [Connection(host, port) for _ in range(concurrency)]
+
+    async def one(device_id: str, record: bool):
+        kind = random.choices(kinds, weights)[0]
+        raw = make_request(kind, parts.netloc, device_id)
+        conn = idle.pop()
+        t0 = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(conn.request(raw), timeout)
+            ok = status < 400
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            conn.close()
+            ok = False
+        finally:
+            idle.append(conn)
+        if record:
+            recorder.add(kind, time.perf_counter() - t0, ok)
+
+    try:
+        started = time.perf_counter()
+        measure_from = started + warmup
+        deadline = measure_from + duration
+
+        if rate:
+            # 開ループ: 応答を待たずに一定間隔で投げる（同時実行は concurrency で頭打ち）
+            slots = asyncio.Semaphore(concurrency)
+            tasks = set()
+
+            async def guarded(device_id, record):
+                async with slots:
+                    await one(device_id, record)
+
+            i = 0
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                task = asyncio.create_task(guarded(f"loadtest-{i % concurrency}", now >= measure_from))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                i += 1
+                await asyncio.sleep(max(started + i / rate - time.perf_counter(), 0))
+            await asyncio.gather(*tasks)
+        else:
+            # 閉ループ: concurrency 本のクライアントが応答を受けたら即次を投げる
+            async def worker(n: int):
+                device_id = f"loadtest-{n}"
+                while True:
+                    now = time.perf_counter()
+                    if now >= deadline:
+                        return
+                    await one(device_id, now >= measure_from)
+
+            await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    finally:
+        for conn in idle:
+            conn.close()
+
+    return recorder.summary(duration)
+
+
+def print_summary(summary: dict):
+    total = summary["total"]
+    print(f"rps={summary['rps']:,.1f}  errors={summary['errors']}  "
+          f"p50={total.get('p50_ms')}ms p95={total.get('p95_ms')}ms p99={total.get('p99_ms')}ms")
+    for kind, s in summary["by_kind"].items():
+        print(f"  {kind:<14} n={s['count']:>7,}  p50={s['p50_ms']:>8}ms  p95={s['p95_ms']:>8}ms  "
+              f"p99={s['p99_ms']:>8}ms  errors={s['errors']}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--concurrency", type=int, default=64, help="同時接続数")
+    ap.add_argument("--duration", type=float, default=20.0, help="計測する秒数")
+    ap.add_argument("--warmup", type=float, default=3.0, help="計測前に捨てる秒数")
+    ap.add_argument("--mix", default="risk=6,shelters=3,favorites=1")
+    ap.add_argument("--rate", type=float, default=None, help="目標 rps（開ループ）")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = ap.parse_args()
+
+    random.seed(args.seed)
+    result = asyncio.run(run(
+        args.url, args.concurrency, args.duration, args.warmup,
+        parse_mix(args.mix), args.rate, args.timeout,
+    ))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_summary(result)
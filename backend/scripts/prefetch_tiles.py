@@ -0,0 +1,75 @@
+# prefetch_tiles.py
+# /tiles のディスクキャッシュを事前に温める（大阪府の範囲、z10〜16、全レイヤ）
+#   python scripts/prefetch_tiles.py [--zooms 10-16] [--layers flood,tsunami] [--concurrency 8]
+# API と同じ TILE_CACHE_DIR / TILE_UPSTREAM_* を使うので、同じ .env のまま実行すればよい。
+# キャッシュ済みで期限内のタイルは上流に取りに行かない（途中で止めても再実行で続きから埋まる）。
+import argparse
+import asyncio
+import time
+
+from landform import tiles_in_bbox
+from tile_proxy import TILE_CACHE_MAX_BYTES, TILE_LAYERS, TileUpstreamError, tile_proxy
+
+# 大阪府の概略範囲（import_shelters_from_geojson.py と同じ）minLon, minLat, maxLon, maxLat
+OSAKA_BBOX = (135.25, 34.35, 135.85, 34.95)
+
+
+def parse_zooms(text: str) -> list[int]:
+    lo, _, hi = text.partition("-")
+    return list(range(int(lo), int(hi or lo) + 1))
+
+
+async def prefetch(layers: list[str], zooms: list[int], bbox, concurrency: int):
+    jobs = [(layer, z, x, y) for layer in layers for z in zooms for x, y in tiles_in_bbox(bbox, z)]
+    print(f"[prefetch] {len(jobs):,} tiles ({','.join(layers)}, z{zooms[0]}-{zooms[-1]})")
+    counts = {"HIT": 0, "MISS": 0, "REVALIDATED": 0, "STALE": 0, "empty": 0, "failed": 0}
+    queue = iter(jobs)
+    done = 0
+    t0 = time.perf_counter()
+
+    async def worker():
+        nonlocal done
+        for job in queue:
+            try:
+                entry, outcome = await tile_proxy.get(*job)
+                counts[outcome] += 1
+                if entry.status == 404:
+                    counts["empty"] += 1
+            except TileUpstreamError as e:
+                counts["failed"] += 1
+                print(f"  ! {job}: {e}")
+            done += 1
+            if done % 1000 == 0:
+                rate = done / (time.perf_counter() - t0)
+                print(f"  {done:,}/{len(jobs):,} ({rate:,.0f} tiles/s) {counts}")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        await tile_proxy.aclose()
+    disk = tile_proxy.cache.stats()
+    print(f"[prefetch] done in {time.perf_counter() - t0:.1f}s {counts}")
+    print(f"[prefetch] cache: {disk['files']:,} files, {disk['bytes'] / 1024 / 1024:,.1f} MB "
+          f"(max {TILE_CACHE_MAX_BYTES / 1024 / 1024:,.0f} MB, evictions={disk['evictions']})")
+    return counts
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--layers", default=",".join(TILE_LAYERS), help="カンマ区切り（既定は全レイヤ）")
+    ap.add_argument("--zooms", default="10-16", help="例: 10-16 / 14")
+    ap.add_argument("--bbox", default=",".join(map(str, OSAKA_BBOX)), help="minLon,minLat,maxLon,maxLat")
+    ap.add_argument("--concurrency", type=int, default=8, help="同時取得数（地理院に負荷をかけすぎないこと）")
+    args = ap.parse_args()
+
+    layers = [name.strip() for name in args.layers.split(",")]
+    unknown = [name for name in layers if name not in TILE_LAYERS]
+    if unknown:
+        raise SystemExit(f"未対応のレイヤ: {unknown}（{list(TILE_LAYERS)}）")
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+
+    # 既存キャッシュの容量を把握してから埋める（上限を超えたら古いものから消える）
+    tile_proxy.cache.scan()
+    counts = asyncio.run(prefetch(layers, parse_zooms(args.zooms), bbox, args.concurrency))
+    if counts["failed"]:
+        raise SystemExit(1)
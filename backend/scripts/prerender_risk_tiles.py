@@ -0,0 +1,99 @@
+# prerender_risk_tiles.py
+# /risk/tiles のヒートマップタイルを大阪府の範囲で事前に描いておく（CPU コア数ぶんのプロセスで並列）
+#   python scripts/prerender_risk_tiles.py [--zooms 10-16] [--metrics overall,flood] [--workers 4]
+# API と同じ RISK_TILE_DIR に、現在の版（terrain_risk と近傍検索のラスタ）のディレクトリとして書き出す。
+# terrain_risk を入れ替えた・ラスタを作り直したら版が変わるので、実行し直すこと（--keep-old を付けなければ古い版は消す）。
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+from landform import tiles_in_bbox
+from risk_tiles import (
+    RISK_TILE_DIR, RISK_TILE_MAX_ZOOM, RISK_TILE_METRICS, RISK_TILE_MIN_ZOOM, EMPTY_TILE_PNG,
+    prune_old_versions, read_cached, risk_tiles, write_cached,
+)
+from spatial_index import get_risk_locator
+
+# 大阪府の概略範囲（import_shelters_from_geojson.py と同じ）minLon, minLat, maxLon, maxLat
+OSAKA_BBOX = (135.25, 34.35, 135.85, 34.95)
+CHUNK_TILES = 64
+
+
+def parse_zooms(text: str) -> list[int]:
+    lo, _, hi = text.partition("-")
+    return list(range(int(lo), int(hi or lo) + 1))
+
+
+def render_chunk(args) -> tuple[int, int, int]:
+    # 戻り値: (描いた枚数, 透明タイル, 既存でスキップ)
+    jobs, force = args
+    renderer = risk_tiles.renderer()
+    rendered = empty = skipped = 0
+    for metric, z, x, y in jobs:
+        if not force and read_cached(renderer.version, metric, z, x, y) is not None:
+            skipped += 1
+            continue
+        png = renderer.render(metric, z, x, y)
+        write_cached(renderer.version, metric, z, x, y, png)
+        rendered += 1
+        empty += png is EMPTY_TILE_PNG
+    return rendered, empty, skipped
+
+
+def _init_worker():
+    # fork で親の読み込み結果を引き継いでいれば何もしない。spawn の環境では各プロセスで読み込む
+    risk_tiles.renderer()
+
+
+def main(metrics, zooms, bbox, workers: int, force: bool, keep_old: bool):
+    t0 = time.perf_counter()
+    # 子プロセスを作る前に親で 1 回だけ読み込む（fork なら値の配列も近傍インデックスも共有される）
+    renderer = risk_tiles.renderer()
+    get_risk_locator()
+    print(f"[prerender] version={renderer.version} points={len(renderer.ids):,} "
+          f"loaded in {time.perf_counter() - t0:.1f}s -> {RISK_TILE_DIR / renderer.version}")
+    if not keep_old:
+        removed = prune_old_versions(renderer.version)
+        if removed:
+            print(f"[prerender] removed old versions: {removed}")
+
+    jobs = [(m, z, x, y) for m in metrics for z in zooms for x, y in tiles_in_bbox(bbox, z)]
+    chunks = [(jobs[i:i + CHUNK_TILES], force) for i in range(0, len(jobs), CHUNK_TILES)]
+    print(f"[prerender] {len(jobs):,} tiles ({','.join(metrics)}, z{zooms[0]}-{zooms[-1]}) with {workers} workers")
+
+    totals = [0, 0, 0]
+    done = 0
+    t1 = time.perf_counter()
+    method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+    with mp.get_context(method).Pool(workers, initializer=_init_worker) as pool:
+        for counts, (chunk, _) in zip(pool.imap(render_chunk, chunks), chunks):
+            totals = [a + b for a, b in zip(totals, counts)]
+            done += len(chunk)
+            if done % (CHUNK_TILES * 50) < CHUNK_TILES:
+                rate = done / (time.perf_counter() - t1)
+                print(f"  {done:,}/{len(jobs):,} ({rate:,.0f} tiles/s)")
+    rendered, empty, skipped = totals
+    print(f"[prerender] done in {time.perf_counter() - t1:.1f}s "
+          f"rendered={rendered:,} (empty={empty:,}) skipped={skipped:,}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--metrics", default="overall", help=f"カンマ区切り（{','.join(RISK_TILE_METRICS)}）")
+    ap.add_argument("--zooms", default=f"{RISK_TILE_MIN_ZOOM}-16", help="例: 10-16 / 14")
+    ap.add_argument("--bbox", default=",".join(map(str, OSAKA_BBOX)), help="minLon,minLat,maxLon,maxLat")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--force", action="store_true", help="描画済みのタイルも描き直す")
+    ap.add_argument("--keep-old", action="store_true", help="古い版のタイルを消さない")
+    args = ap.parse_args()
+
+    metrics = [m.strip() for m in args.metrics.split(",")]
+    unknown = [m for m in metrics if m not in RISK_TILE_METRICS]
+    if unknown:
+        raise SystemExit(f"未対応の指標: {unknown}（{list(RISK_TILE_METRICS)}）")
+    zooms = parse_zooms(args.zooms)
+    if zooms[0] < RISK_TILE_MIN_ZOOM or zooms[-1] > RISK_TILE_MAX_ZOOM:
+        raise SystemExit(f"ズームは {RISK_TILE_MIN_ZOOM}〜{RISK_TILE_MAX_ZOOM} の範囲で指定してください")
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+    main(metrics, zooms, bbox, args.workers, args.force, args.keep_old)
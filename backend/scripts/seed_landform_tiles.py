@@ -0,0 +1,86 @@
+# seed_landform_tiles.py
+# 国土地理院の地形分類タイル（z14 GeoJSON、自然地形 / 人工地形）を大阪府の範囲だけ取得し、/terrain 用に置いておく
+#   python scripts/seed_landform_tiles.py --out ./data/landform_tiles [--workers 8] [--force]
+# 出力先は API 側の LANDFORM_TILE_DIR と合わせること（既定は同じ ./data/landform_tiles）。
+# 地理院側にデータが無いタイル（404）は空の FeatureCollection を置く（再実行で取りに行かないため）。
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from landform import LANDFORM_LAYERS, LANDFORM_TILE_DIR, LANDFORM_ZOOM, tiles_in_bbox
+
+GSI_URL = "https://cyberjapandata.gsi.go.jp/xyz/{layer}/{z}/{x}/{y}.geojson"
+# 大阪府の概略範囲（import_shelters_from_geojson.py と同じ）minLon, minLat, maxLon, maxLat
+OSAKA_BBOX = (135.25, 34.35, 135.85, 34.95)
+EMPTY_COLLECTION = b'{"type":"FeatureCollection","features":[]}'
+
+
+def fetch(layer: str, zoom: int, x: int, y: int, timeout: float, retries: int = 3) -> bytes:
+    url = GSI_URL.format(layer=layer, z=zoom, x=x, y=y)
+    for attempt in range(retries):
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as res:
+                body = res.read()
+            json.loads(body)  # 途中で切れた応答を置かないよう、パースできるか確認しておく
+            return body
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return EMPTY_COLLECTION
+            if attempt == retries - 1:
+                raise
+        except (urllib.error.URLError, TimeoutError, ValueError):
+            if attempt == retries - 1:
+                raise
+        time.sleep(1.0 * (attempt + 1))
+
+
+def seed_one(out_dir: Path, layer: str, zoom: int, x: int, y: int, timeout: float, force: bool) -> str:
+    path = out_dir / layer / str(zoom) / str(x) / f"{y}.geojson"
+    if path.exists() and not force:
+        return "skipped"
+    body = fetch(layer, zoom, x, y, timeout)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 稼働中の API が読みかけのファイルを壊さないよう、別名で書いて置き換える
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(body)
+    os.replace(tmp, path)
+    return "empty" if body == EMPTY_COLLECTION else "fetched"
+
+
+def seed(out_dir: Path, bbox, workers: int, timeout: float, force: bool):
+    jobs = [(layer, x, y) for _, layer in LANDFORM_LAYERS for x, y in tiles_in_bbox(bbox, LANDFORM_ZOOM)]
+    print(f"[seed] {len(jobs)} tiles (z{LANDFORM_ZOOM}, {len(LANDFORM_LAYERS)} layers) -> {out_dir}")
+    counts = {"fetched": 0, "empty": 0, "skipped": 0, "failed": 0}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(seed_one, out_dir, layer, LANDFORM_ZOOM, x, y, timeout, force) for layer, x, y in jobs]
+        for n, (job, fut) in enumerate(zip(jobs, futures), 1):
+            try:
+                counts[fut.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"  ! {job}: {e}")
+            if n % 200 == 0:
+                print(f"  {n}/{len(jobs)} {counts}")
+    print(f"[seed] done in {time.perf_counter() - t0:.1f}s {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default=str(LANDFORM_TILE_DIR))
+    ap.add_argument("--bbox", default=",".join(map(str, OSAKA_BBOX)), help="minLon,minLat,maxLon,maxLat")
+    ap.add_argument("--workers", type=int, default=8, help="同時ダウンロード数（地理院に負荷をかけすぎないこと）")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--force", action="store_true", help="取得済みのタイルも取り直す")
+    args = ap.parse_args()
+
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+    counts = seed(Path(args.out), bbox, args.workers, args.timeout, args.force)
+    if counts["failed"]:
+        raise SystemExit(1)
@@ -0,0 +1,675 @@
+# spatial_index.py
+# 近傍検索用のインメモリ空間インデックス（起動時に1回だけ構築して使い回す）
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import Connection, text
+from sqlalchemy.orm import Session
+
+from database import ReadSessionLocal
+from dataset_versions import RISK_RASTER, SHELTERS, TERRAIN_RISK, WALK_NETWORK
+from models import Shelter
+
+logger = logging.getLogger("app.spatial_index")
+
+EARTH_RADIUS_KM = 6371.0
+MAX_DISTANCE_M = 400
+
+# 事前計算ラスタ（scripts/build_risk_raster.py で作成）。未設定なら KD-tree を使う
+RISK_RASTER_DIR = os.getenv("RISK_RASTER_DIR", "")
+
+# 徒歩距離の最寄り避難所表（scripts/build_walk_network.py で作成）。未設定なら mode=walk は使えない
+WALK_NETWORK_DIR = os.getenv("WALK_NETWORK_DIR", "")
+WALK_SNAP_MAX_M = float(os.getenv("WALK_SNAP_MAX_M", "300"))  # 道路ノードに寄せる最大距離
+
+# 避難所クラスタ（GET /shelters）。半径はタイル 256px 上のピクセル数
+SHELTER_CLUSTER_RADIUS_PX = float(os.getenv("SHELTER_CLUSTER_RADIUS_PX", "60"))
+SHELTER_CLUSTER_MAX_ZOOM = int(os.getenv("SHELTER_CLUSTER_MAX_ZOOM", "16"))  # これより拡大したら個別表示
+SHELTER_CLUSTER_MIN_ZOOM = 0
+TILE_EXTENT_PX = 256
+
+
+def fetch_array(db: Session | Connection, sql: str, ncols: int, dtype=np.float64) -> np.ndarray:
+    # 数値だけの SELECT を (行数, ncols) の配列で読む。起動時に数十万行を読むので ORM の行オブジェクトを作らず
+    # DBAPI のカーソルから直接詰める（NULL を含む列は SQL 側で COALESCE しておくこと）
+    conn = db.connection() if isinstance(db, Session) else db
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(sql)
+        flat = np.fromiter((v for row in cursor for v in row), dtype=dtype)
+    finally:
+        cursor.close()
+    return flat.reshape(-1, ncols)
+
+
+# -----------------------------------------------------------------------------
+# terrain_risk 用 KD-tree
+# -----------------------------------------------------------------------------
+class RiskIndex:
+    # terrain_risk の lon/lat 列は EPSG:6674 の (x, y) [m] が入っている前提
+    # （従来の nearest_point が Point(row.lon, row.lat) と比較していたのと同じ解釈）
+    def __init__(self, ids: np.ndarray, xy: np.ndarray):
+        self.ids = ids
+        self.xy = xy
+        self.tree = cKDTree(xy) if len(ids) else None
+
+    @classmethod
+    def from_session(cls, db: Session) -> "RiskIndex":
+        arr = fetch_array(
+            db, "SELECT id, lon, lat FROM terrain_risk WHERE lon IS NOT NULL AND lat IS NOT NULL ORDER BY id", 3,
+        )
+        return cls(arr[:, 0].astype(np.int64), np.ascontiguousarray(arr[:, 1:]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, x: float, y: float, max_distance: float = np.inf):
+        # 戻り値: (terrain_risk.id | None, 距離[m])
+        # max_distance ちょうどの点も一致扱い（従来の `min_dist > MAX_DISTANCE_M` 判定と同じ）
+        if self.tree is None:
+            return None, float("inf")
+        dist, i = self.tree.query((x, y), distance_upper_bound=np.nextafter(max_distance, np.inf))
+        if not np.isfinite(dist):
+            return None, float("inf")
+        return int(self.ids[i]), float(dist)
+
+    def nearest_many(self, xs, ys, max_distance: float = np.inf):
+        # 一括版。戻り値: (ids, dists)  一致なしは id=-1 / dist=inf
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        if self.tree is None:
+            return np.full(len(xs), -1, dtype=np.int64), np.full(len(xs), np.inf)
+        dist, i = self.tree.query(
+            np.column_stack([xs, ys]), distance_upper_bound=np.nextafter(max_distance, np.inf)
+        )
+        found = np.isfinite(dist)
+        ids = np.full(len(xs), -1, dtype=np.int64)
+        ids[found] = self.ids[i[found]]
+        return ids, dist
+
+
+# -----------------------------------------------------------------------------
+# terrain_risk 用の事前計算ラスタ（メモリマップで O(1) 参照）
+# -----------------------------------------------------------------------------
+class RiskRaster:
+    # EPSG:6674 の固定グリッド。各セルには次のどれかを持つ（scripts/build_risk_raster.py）
+    #   0 以上   : セル内のどこから引いても最寄り点はこの点（配列インデックス）
+    #   NO_MATCH : セル内のどこからでも max_distance 以内に点が無い
+    #   -2 以下  : 最寄り点がセル内の位置で入れ替わる。-2 - 値 番目の候補リスト（cand_indptr / cand_idx）を実距離で比べる
+    # どれも KD-tree（RiskIndex）と同じ点・同じ一致/不一致になる（max_distance は meta の値以下で使う）
+    NO_MATCH = -1
+    FORMAT = 2  # meta.json の format。候補リストを持たない旧形式（セル中心の最寄り点だけ）は使わない
+
+    def __init__(self, path):
+        path = Path(path)
+        meta_text = (path / "meta.json").read_text(encoding="utf-8")
+        self.meta = meta = json.loads(meta_text)
+        # ラスタの版（作り直すと meta.json も書き直される。ヒートマップタイルの版に含める）
+        self.version = hashlib.sha1(meta_text.encode()).hexdigest()[:12]
+        # 作った時の terrain_risk の指紋（terrain_fingerprint）。今のテーブルと違えば ids が別の地点を指している
+        self.terrain_fingerprint = meta.get("terrain_fingerprint")
+        self.format = meta.get("format", 1)
+        self.x0 = float(meta["x0"])
+        self.y0 = float(meta["y0"])
+        self.cell_size = float(meta["cell_size"])
+        self.max_distance = float(meta["max_distance"])
+        # mmap_mode="r" → 複数ワーカーで OS のページキャッシュを共有
+        self.cells = np.load(path / "cells.npy", mmap_mode="r")
+        self.ids = np.load(path / "ids.npy", mmap_mode="r")
+        self.xy = np.load(path / "xy.npy", mmap_mode="r")
+        if self.format >= 2:
+            self.cand_indptr = np.load(path / "cand_indptr.npy", mmap_mode="r")
+            self.cand_idx = np.load(path / "cand_idx.npy", mmap_mode="r")
+        self.nrows, self.ncols = self.cells.shape
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, x: float, y: float, max_distance: float = np.inf):
+        col = math.floor((x - self.x0) / self.cell_size)
+        row = math.floor((y - self.y0) / self.cell_size)
+        if not (0 <= row < self.nrows and 0 <= col < self.ncols):
+            return None, float("inf")
+        k = int(self.cells[row, col])
+        if k == self.NO_MATCH:
+            return None, float("inf")
+        if k < self.NO_MATCH:
+            # 候補は数点なので numpy を通さずに比べる
+            j = -2 - k
+            dist = float("inf")
+            for c in self.cand_idx[self.cand_indptr[j]:self.cand_indptr[j + 1]].tolist():
+                d = math.hypot(float(self.xy[c, 0]) - x, float(self.xy[c, 1]) - y)
+                if d < dist:
+                    k, dist = c, d
+        else:
+            dist = math.hypot(float(self.xy[k, 0]) - x, float(self.xy[k, 1]) - y)
+        if dist > max_distance:
+            return None, float("inf")
+        return int(self.ids[k]), dist
+
+    def nearest_many(self, xs, ys, max_distance: float = np.inf):
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        col = np.floor((xs - self.x0) / self.cell_size).astype(np.int64)
+        row = np.floor((ys - self.y0) / self.cell_size).astype(np.int64)
+        inside = (row >= 0) & (row < self.nrows) & (col >= 0) & (col < self.ncols)
+        k = np.full(len(xs), self.NO_MATCH, dtype=np.int64)
+        k[inside] = self.cells[row[inside], col[inside]]
+
+        ambiguous = np.flatnonzero(k < self.NO_MATCH)
+        if len(ambiguous):
+            # 候補リストを1本の配列に並べて実距離を求め、問い合わせごとに一番近い候補を採る
+            j = -2 - k[ambiguous]
+            starts = self.cand_indptr[j]
+            counts = self.cand_indptr[j + 1] - starts
+            owner = np.repeat(np.arange(len(ambiguous)), counts)
+            offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            cand = np.asarray(self.cand_idx[np.repeat(starts, counts) + offset], dtype=np.int64)
+            q = ambiguous[owner]
+            d = np.hypot(self.xy[cand, 0] - xs[q], self.xy[cand, 1] - ys[q])
+            order = np.lexsort((d, owner))
+            first = order[np.r_[0, np.cumsum(counts)[:-1]]]
+            k[ambiguous] = cand[first]
+
+        hit = k != self.NO_MATCH
+        dist = np.full(len(xs), np.inf)
+        dist[hit] = np.hypot(self.xy[k[hit], 0] - xs[hit], self.xy[k[hit], 1] - ys[hit])
+        ok = hit & (dist <= max_distance)
+        ids = np.full(len(xs), -1, dtype=np.int64)
+        ids[ok] = self.ids[k[ok]]
+        dist[~ok] = np.inf
+        return ids, dist
+
+
+TERRAIN_FINGERPRINT_SQL = text("""
+    SELECT COUNT(*), MAX(id), TOTAL(lon), TOTAL(lat) FROM terrain_risk WHERE lon IS NOT NULL AND lat IS NOT NULL
+""")
+
+
+def terrain_fingerprint(db: Session | Connection) -> list:
+    # ラスタが今の terrain_risk から作られたかを確かめる指紋（行数・最大 id・座標の合計）
+    # 再インポートで id が振り直されると、行数が同じでも座標の合計が変わる
+    count, max_id, sum_x, sum_y = db.execute(TERRAIN_FINGERPRINT_SQL).one()
+    return [int(count), int(max_id or 0), round(float(sum_x), 1), round(float(sum_y), 1)]
+
+
+def open_risk_raster(db: Session | Connection) -> RiskRaster | None:
+    # RISK_RASTER_DIR のラスタを開く。無い・今の terrain_risk と指紋が違う時は None（KD-tree で応答する）
+    if not RISK_RASTER_DIR or not (Path(RISK_RASTER_DIR) / "meta.json").exists():
+        return None
+    raster = RiskRaster(RISK_RASTER_DIR)
+    if raster.format != RiskRaster.FORMAT:
+        logger.warning("%s は古い形式のラスタなので使いません（scripts/build_risk_raster.py で作り直すと使います）",
+                       RISK_RASTER_DIR)
+        return None
+    if raster.terrain_fingerprint != terrain_fingerprint(db):
+        logger.warning("%s は今の terrain_risk から作ったものではないので使いません"
+                       "（scripts/build_risk_raster.py で作り直すと使います）", RISK_RASTER_DIR)
+        return None
+    return raster
+
+
+# -----------------------------------------------------------------------------
+# shelters 用インデックス（列指向の属性配列 + 単位球面上の KD-tree）
+# -----------------------------------------------------------------------------
+def haversine_km_array(lat, lon, lats, lons):
+    # app_API.haversine_km のベクトル版（同じ式・同じ順序で計算）
+    dlat = np.radians(lats - lat)
+    dlon = np.radians(lons - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat)) * np.cos(np.radians(lats)) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def unit_vectors(lat, lon):
+    # 単位球面上の弦の長さは大円距離に対して単調 → KD-tree の順位 = haversine の順位
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class ShelterIndex:
+    COLUMNS = ("id", "name", "ward", "address", "type", "capacity", "lat", "lon", "phone", "opening_condition")
+
+    def __init__(self, rows):
+        n = len(rows)
+        cols = list(zip(*rows)) if n else [()] * len(self.COLUMNS)
+        self.cols = {}
+        for name, values in zip(self.COLUMNS, cols):
+            if name == "id":
+                arr = np.array(values, dtype=np.int64)
+            elif name in ("lat", "lon"):
+                arr = np.array(values, dtype=np.float64)
+            else:
+                arr = np.empty(n, dtype=object)
+                arr[:] = values
+            self.cols[name] = arr
+        # フィルタ用（None は NaN → 比較で常に False）
+        self.capacity_f = np.array(
+            [c if c is not None else np.nan for c in self.cols["capacity"]], dtype=np.float64
+        )
+        self.tree = cKDTree(unit_vectors(self.cols["lat"], self.cols["lon"])) if n else None
+
+    @classmethod
+    def from_session(cls, db: Session) -> "ShelterIndex":
+        rows = (
+            db.query(*(getattr(Shelter, c) for c in cls.COLUMNS))
+            .filter(Shelter.lat.isnot(None), Shelter.lon.isnot(None))
+            .order_by(Shelter.id)
+            .all()
+        )
+        return cls([tuple(r) for r in rows])
+
+    def __len__(self):
+        return len(self.cols["id"])
+
+    def _filter_mask(self, shelter_type=None, min_capacity=None, ward=None):
+        if shelter_type is None and min_capacity is None and ward is None:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        if shelter_type is not None:
+            mask &= self.cols["type"] == shelter_type
+        if min_capacity is not None:
+            mask &= self.capacity_f >= min_capacity
+        if ward is not None:
+            mask &= self.cols["ward"] == ward
+        return mask
+
+    def nearest(self, lat: float, lon: float, limit: int,
+                shelter_type=None, min_capacity=None, ward=None) -> list[dict]:
+        n = len(self)
+        if n == 0 or limit <= 0:
+            return []
+        mask = self._filter_mask(shelter_type, min_capacity, ward)
+        if mask is None:
+            # 全件対象：KD-tree で上位 k 件だけ取り出す
+            k = min(limit, n)
+            _, idx = self.tree.query(unit_vectors(lat, lon)[0], k=k)
+            idx = np.atleast_1d(idx)
+        else:
+            # フィルタあり：条件に合う行だけをベクトル計算して部分選択
+            idx = np.flatnonzero(mask)
+            if len(idx) == 0:
+                return []
+            if len(idx) > limit:
+                d = haversine_km_array(lat, lon, self.cols["lat"][idx], self.cols["lon"][idx])
+                idx = idx[np.argpartition(d, limit - 1)[:limit]]
+
+        dist = haversine_km_array(lat, lon, self.cols["lat"][idx], self.cols["lon"][idx])
+        order = np.lexsort((idx, dist))
+        return [self._row(int(idx[i]), float(dist[i])) for i in order]
+
+    def record(self, i: int) -> dict:
+        c = self.cols
+        return {
+            "id": int(c["id"][i]), "name": c["name"][i], "ward": c["ward"][i], "address": c["address"][i],
+            "type": c["type"][i], "capacity": c["capacity"][i],
+            "lat": float(c["lat"][i]), "lon": float(c["lon"][i]),
+            "phone": c["phone"][i], "opening_condition": c["opening_condition"][i],
+        }
+
+    def _row(self, i: int, distance_km: float) -> dict:
+        return {**self.record(i), "distance_km": distance_km}
+
+
+# -----------------------------------------------------------------------------
+# 徒歩距離の最寄り避難所表（道路ノードごとに近い順 k 件の shelters.id と道のり [m]）
+# -----------------------------------------------------------------------------
+class WalkNetwork:
+    def __init__(self, path):
+        path = Path(path)
+        self.meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        self.k = int(self.meta["k"])
+        # mmap_mode="r" → 複数ワーカーで OS のページキャッシュを共有（CSR 本体は API では読まない）
+        self.nodes = np.load(path / "nodes.npy", mmap_mode="r")              # (N, 2) lon/lat
+        self.nearest_ids = np.load(path / "nearest_ids.npy", mmap_mode="r")  # (N, k) int32, 無しは -1
+        self.nearest_m = np.load(path / "nearest_m.npy", mmap_mode="r")      # (N, k) float32
+        # 避難所にたどり着けるノードにだけ寄せる（道路網から切れた小さな断片に寄せて結果が空になるのを防ぐ）
+        self.snap_nodes = np.flatnonzero(np.asarray(self.nearest_ids[:, 0]) >= 0)
+        lonlat = np.asarray(self.nodes)[self.snap_nodes]
+        self.tree = cKDTree(unit_vectors(lonlat[:, 1], lonlat[:, 0])) if len(self.snap_nodes) else None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def stale(self, shelters: ShelterIndex) -> bool:
+        # 表を作った後に避難所が入れ替わっていれば True（消えた避難所は引いた時に読み飛ばすが、増えた分は載らない）
+        ids = shelters.cols["id"]
+        current = [len(shelters), int(ids.max()) if len(ids) else None]
+        return current != self.meta.get("shelter_fingerprint")
+
+    def snap(self, lat: float, lon: float):
+        # 戻り値: (ノード番号 | None, 寄せた距離[m])
+        if self.tree is None:
+            return None, float("inf")
+        chord, i = self.tree.query(unit_vectors(lat, lon)[0])
+        return int(self.snap_nodes[i]), float(2 * EARTH_RADIUS_KM * 1000 * np.arcsin(min(chord / 2, 1.0)))
+
+    def nearest(self, lat: float, lon: float, limit: int, shelters: ShelterIndex,
+                shelter_type=None, min_capacity=None, ward=None) -> list[dict] | None:
+        # 道のりの近い順。道路から WALK_SNAP_MAX_M より離れた地点は None
+        # 表はノードごとに k 件までなので、絞り込み条件が厳しいと limit 件に満たないことがある
+        node, snap_m = self.snap(lat, lon)
+        if node is None or snap_m > WALK_SNAP_MAX_M or len(shelters) == 0:
+            return None
+        ids = np.asarray(self.nearest_ids[node], dtype=np.int64)
+        walk_m = np.asarray(self.nearest_m[node], dtype=np.float64)
+        # shelters.id → ShelterIndex の行（再インポートで消えた避難所は除く）
+        shelter_ids = shelters.cols["id"]
+        pos = np.minimum(np.searchsorted(shelter_ids, ids), len(shelter_ids) - 1)
+        keep = (ids >= 0) & (shelter_ids[pos] == ids)
+        mask = shelters._filter_mask(shelter_type, min_capacity, ward)
+        if mask is not None:
+            keep &= mask[pos]
+        pos, walk_m = pos[keep][:limit], walk_m[keep][:limit]
+
+        dist = haversine_km_array(lat, lon, shelters.cols["lat"][pos], shelters.cols["lon"][pos])
+        return [
+            {**shelters._row(int(i), float(d)), "walk_distance_km": (snap_m + float(w)) / 1000}
+            for i, d, w in zip(pos, dist, walk_m)
+        ]
+
+
+# -----------------------------------------------------------------------------
+# 避難所のズーム別クラスタ（supercluster と同じ方式）
+#   Web メルカトルの [0,1] 座標上で、最大ズーム+1（個別の避難所）から 1 段ずつ下へ
+#   「半径 SHELTER_CLUSTER_RADIUS_PX 以内の点を重み付き重心にまとめる」を繰り返し、全ズーム分を前計算する
+#   同じズームでは点どうしがおおむね半径以上離れるので、画面内の件数は登録数によらず頭打ちになる
+# -----------------------------------------------------------------------------
+def _lon_to_mx(lon):
+    return np.asarray(lon, dtype=np.float64) / 360.0 + 0.5
+
+
+def _lat_to_my(lat):
+    s = np.sin(np.radians(np.asarray(lat, dtype=np.float64)))
+    with np.errstate(divide="ignore"):
+        y = 0.5 - 0.25 * np.log((1 + s) / (1 - s)) / np.pi
+    return np.clip(y, 0.0, 1.0)
+
+
+def _mx_to_lon(x):
+    return (x - 0.5) * 360.0
+
+
+def _my_to_lat(y):
+    return np.degrees(2 * np.arctan(np.exp((0.5 - y) * 2 * np.pi))) - 90.0
+
+
+class _ClusterLevel:
+    # 1 ズーム分。x 昇順に並べておき、bbox は searchsorted + y のマスクで引く
+    #   row: 個別の避難所なら ShelterIndex の行番号、クラスタなら -1
+    def __init__(self, x, y, count, capacity, row, cluster_id, formed_zoom):
+        order = np.argsort(x, kind="stable")
+        self.x = x[order]
+        self.y = y[order]
+        self.count = count[order]
+        self.capacity = capacity[order]
+        self.row = row[order]
+        self.cluster_id = cluster_id[order]
+        self.formed_zoom = formed_zoom[order]
+
+    def __len__(self):
+        return len(self.x)
+
+    def in_bbox(self, minx, miny, maxx, maxy) -> np.ndarray:
+        lo = np.searchsorted(self.x, minx, side="left")
+        hi = np.searchsorted(self.x, maxx, side="right")
+        idx = np.arange(lo, hi)
+        return idx[(self.y[idx] >= miny) & (self.y[idx] <= maxy)]
+
+
+class ShelterClusters:
+    def __init__(self, shelters: ShelterIndex,
+                 radius_px: float = SHELTER_CLUSTER_RADIUS_PX,
+                 min_zoom: int = SHELTER_CLUSTER_MIN_ZOOM, max_zoom: int = SHELTER_CLUSTER_MAX_ZOOM):
+        self.shelters = shelters
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        n = len(shelters)
+        x = _lon_to_mx(shelters.cols["lon"])
+        y = _lat_to_my(shelters.cols["lat"])
+        count = np.ones(n, dtype=np.int64)
+        capacity = np.nan_to_num(shelters.capacity_f, nan=0.0).astype(np.int64)
+        row = np.arange(n, dtype=np.int64)
+        cluster_id = np.full(n, -1, dtype=np.int64)
+        formed = np.full(n, max_zoom + 1, dtype=np.int64)
+
+        self.levels = {max_zoom + 1: _ClusterLevel(x, y, count, capacity, row, cluster_id, formed)}
+        next_id = 0
+        for z in range(max_zoom, min_zoom - 1, -1):
+            x, y, count, capacity, row, cluster_id, formed, next_id = self._cluster(
+                z, radius_px / (TILE_EXTENT_PX * 2 ** z), x, y, count, capacity, row, cluster_id, formed, next_id,
+            )
+            self.levels[z] = _ClusterLevel(x, y, count, capacity, row, cluster_id, formed)
+
+    @staticmethod
+    def _cluster(z, r, x, y, count, capacity, row, cluster_id, formed, next_id):
+        # 1 段上（z+1）の点を先頭から順に貪欲にまとめる（入力が同じなら結果も毎回同じ）
+        n = len(x)
+        if n == 0:
+            return x, y, count, capacity, row, cluster_id, formed, next_id
+        xy = np.column_stack([x, y])
+        neighbors = cKDTree(xy).query_ball_point(xy, r)
+        visited = np.zeros(n, dtype=bool)
+        carried = []                          # 近くに誰もいない点（そのまま下の段へ持ち越す）
+        merged = []                           # クラスタごとの、まとめた点の添字配列
+        for i in range(n):
+            if visited[i]:
+                continue
+            members = neighbors[i]
+            if len(members) > 1:
+                members = np.asarray(members, dtype=np.int64)
+                members = members[~visited[members]]
+            if len(members) == 1:
+                visited[i] = True
+                carried.append(i)
+                continue
+            visited[members] = True
+            merged.append(members)
+
+        carried = np.asarray(carried, dtype=np.int64)
+        m = len(merged)
+        if m:
+            owner = np.repeat(np.arange(m), [len(g) for g in merged])
+            flat = np.concatenate(merged)
+            w = count[flat]
+            total = np.bincount(owner, weights=w, minlength=m)
+            cx = np.bincount(owner, weights=x[flat] * w, minlength=m) / total
+            cy = np.bincount(owner, weights=y[flat] * w, minlength=m) / total
+            ccap = np.bincount(owner, weights=capacity[flat], minlength=m)
+        else:
+            total = cx = cy = ccap = np.empty(0)
+        return (
+            np.concatenate([x[carried], cx]),
+            np.concatenate([y[carried], cy]),
+            np.concatenate([count[carried], total.astype(np.int64)]),
+            np.concatenate([capacity[carried], ccap.astype(np.int64)]),
+            np.concatenate([row[carried], np.full(m, -1, dtype=np.int64)]),
+            np.concatenate([cluster_id[carried], np.arange(next_id, next_id + m, dtype=np.int64)]),
+            np.concatenate([formed[carried], np.full(m, z, dtype=np.int64)]),
+            next_id + m,
+        )
+
+    def query(self, bbox, zoom: float, max_items: int) -> dict:
+        # bbox = (minLon, minLat, maxLon, maxLat)
+        #   max_items を超える場合は 1 段ずつ粗いズームに落とす（広い範囲を高ズームで頼まれても件数は増えない）
+        min_lon, min_lat, max_lon, max_lat = bbox
+        minx, maxx = float(_lon_to_mx(min_lon)), float(_lon_to_mx(max_lon))
+        miny, maxy = float(_lat_to_my(max_lat)), float(_lat_to_my(min_lat))
+        z = min(max(math.floor(zoom), self.min_zoom), self.max_zoom + 1)
+        while True:
+            level = self.levels[z]
+            idx = level.in_bbox(minx, miny, maxx, maxy)
+            if len(idx) <= max_items or z == self.min_zoom:
+                break
+            z -= 1
+        truncated = len(idx) > max_items
+        if truncated:
+            idx = idx[np.argsort(-level.count[idx], kind="stable")[:max_items]]
+
+        lats = _my_to_lat(level.y[idx])
+        lons = _mx_to_lon(level.x[idx])
+        items = []
+        for k, i in enumerate(idx.tolist()):
+            r = int(level.row[i])
+            if r >= 0:
+                items.append({"kind": "shelter", **self.shelters.record(r)})
+            else:
+                items.append({
+                    "kind": "cluster",
+                    "id": int(level.cluster_id[i]),
+                    "lat": float(lats[k]),
+                    "lon": float(lons[k]),
+                    "count": int(level.count[i]),
+                    "capacity": int(level.capacity[i]),
+                    "expansion_zoom": int(level.formed_zoom[i]) + 1,  # このズームまで拡大すると分かれる
+                })
+        return {"zoom": zoom, "cluster_zoom": z, "count": len(items), "truncated": truncated, "items": items}
+
+
+# -----------------------------------------------------------------------------
+# プロセス内で共有するインデックス（遅延構築・スレッドセーフ）
+#   構築は同期の読み取りセッションで行う。async 側で未構築の可能性があるときは
+#   indexes_ready() を見てスレッドプールから呼ぶ（イベントループを止めない）
+# -----------------------------------------------------------------------------
+_risk_index: RiskIndex | None = None
+_shelter_index: ShelterIndex | None = None
+_shelter_clusters: ShelterClusters | None = None
+_risk_raster: RiskRaster | bool | None = None  # None: 未確認 / False: 使えない（無い・古い）
+_walk_network: WalkNetwork | None = None
+_build_lock = threading.Lock()
+
+
+def get_risk_index() -> RiskIndex:
+    global _risk_index
+    index = _risk_index
+    if index is None:
+        with _build_lock:
+            if _risk_index is None:
+                with ReadSessionLocal() as db:
+                    _risk_index = RiskIndex.from_session(db)
+            index = _risk_index
+    return index
+
+
+def get_risk_raster() -> RiskRaster | None:
+    # 確認は1回だけ（ラスタを作り直した時は dataset_versions の risk_raster が上がり、build_indexes で開き直す）
+    global _risk_raster
+    if not RISK_RASTER_DIR:
+        return None
+    raster = _risk_raster
+    if raster is None:
+        with _build_lock:
+            if _risk_raster is None:
+                with ReadSessionLocal() as db:
+                    _risk_raster = open_risk_raster(db) or False
+            raster = _risk_raster
+    return raster or None
+
+
+def get_walk_network() -> WalkNetwork | None:
+    global _walk_network
+    if not WALK_NETWORK_DIR or not (Path(WALK_NETWORK_DIR) / "meta.json").exists():
+        return None
+    network = _walk_network
+    if network is None:
+        with _build_lock:
+            if _walk_network is None:
+                _walk_network = WalkNetwork(WALK_NETWORK_DIR)
+            network = _walk_network
+    return network
+
+
+def walk_network_ready() -> bool:
+    return _walk_network is not None or not WALK_NETWORK_DIR
+
+
+def get_risk_locator():
+    # ラスタがあれば O(1) 参照、無ければ KD-tree（どちらも nearest / nearest_many を持つ）
+    return get_risk_raster() or get_risk_index()
+
+
+def risk_locator_after(built: dict):
+    # build_indexes の結果を swap_indexes した後に get_risk_locator() が返すもの（差し替え前に作る物の準備用）
+    raster = (built["risk_raster"] or None) if "risk_raster" in built else get_risk_raster()
+    if raster is not None:
+        return raster
+    return built["risk_index"] if "risk_index" in built else get_risk_index()
+
+
+def risk_locator_version(locator) -> str:
+    # 近傍検索に使うもの（ラスタとその版 / KD-tree）。ヒートマップタイルの版に含める
+    return f"raster:{locator.version}" if isinstance(locator, RiskRaster) else "kdtree"
+
+
+def get_shelter_index() -> ShelterIndex:
+    global _shelter_index
+    index = _shelter_index
+    if index is None:
+        with _build_lock:
+            if _shelter_index is None:
+                with ReadSessionLocal() as db:
+                    _shelter_index = ShelterIndex.from_session(db)
+            index = _shelter_index
+    return index
+
+
+def get_shelter_clusters() -> ShelterClusters:
+    global _shelter_clusters
+    clusters = _shelter_clusters
+    if clusters is None:
+        shelters = get_shelter_index()
+        with _build_lock:
+            if _shelter_clusters is not None:
+                return _shelter_clusters
+            clusters = ShelterClusters(shelters)
+            if shelters is _shelter_index:  # 構築中に swap_indexes() されていたら古い結果は残さない
+                _shelter_clusters = clusters
+    return clusters
+
+
+def indexes_ready() -> bool:
+    raster_checked = _risk_raster is not None or not RISK_RASTER_DIR
+    risk_ready = raster_checked and (bool(_risk_raster) or _risk_index is not None)
+    return risk_ready and _shelter_index is not None and _shelter_clusters is not None
+
+
+# -----------------------------------------------------------------------------
+# データの入れ替え（dataset_versions の版が上がった時。app_API.reload_changed_datasets から呼ぶ）
+#   build_indexes で新しいインデックスを作っている間も、リクエストは今のインデックスで応答する。
+#   作り終えたら swap_indexes でまとめて差し替える（処理中のリクエストは手元の古い方で最後まで動く）
+# -----------------------------------------------------------------------------
+def build_indexes(datasets: set[str]) -> dict:
+    # datasets: 版が変わったデータ名。KD-tree はラスタを使っていて未構築なら作らない（必要になった時に作る）
+    built = {}
+    with ReadSessionLocal() as db:
+        if RISK_RASTER_DIR and datasets & {TERRAIN_RISK, RISK_RASTER}:
+            # terrain_risk を入れ直したら、開いているラスタの ids は別の地点を指している。
+            # 指紋で確かめ直し、合わなければ外して KD-tree で応答する（build_risk_raster.py で作り直すと戻る）
+            built["risk_raster"] = open_risk_raster(db) or False
+        raster_dropped = built.get("risk_raster") is False and _risk_index is None
+        if (TERRAIN_RISK in datasets and _risk_index is not None) or raster_dropped:
+            built["risk_index"] = RiskIndex.from_session(db)
+        if SHELTERS in datasets:
+            built["shelter_index"] = ShelterIndex.from_session(db)
+    if "shelter_index" in built:
+        built["shelter_clusters"] = ShelterClusters(built["shelter_index"])
+    if WALK_NETWORK in datasets and WALK_NETWORK_DIR and (Path(WALK_NETWORK_DIR) / "meta.json").exists():
+        built["walk_network"] = WalkNetwork(WALK_NETWORK_DIR)
+    return built
+
+
+def swap_indexes(built: dict):
+    global _risk_index, _shelter_index, _shelter_clusters, _risk_raster, _walk_network
+    with _build_lock:
+        _risk_index = built.get("risk_index", _risk_index)
+        _shelter_index = built.get("shelter_index", _shelter_index)
+        _shelter_clusters = built.get("shelter_clusters", _shelter_clusters)
+        _risk_raster = built.get("risk_raster", _risk_raster)
+        _walk_network = built.get("walk_network", _walk_network)
@@ -0,0 +1,90 @@
+# spatial_sql.py
+# R*Tree（schema.ensure_spatial_tables）を使った SQL 側の空間フィルタ
+#   ・R*Tree で候補を絞り込み、元テーブルの座標で最終判定する（R*Tree は float32 で外側に丸めて持つため）
+#   ・Session / Connection のどちらでも使える（.execute(text, params) があれば良い）
+# API の応答経路は起動時のインメモリインデックス（spatial_index.py）を使う。これは import スクリプトや手元の集計向け
+import math
+
+from sqlalchemy import text
+
+M_PER_DEG_LAT = 111_320.0
+EARTH_RADIUS_KM = 6371.0
+
+_TERRAIN_BBOX_SQL = text("""
+    SELECT t.id FROM terrain_risk_rtree r JOIN terrain_risk t ON t.id = r.id
+    WHERE r.min_x <= :max_x AND r.max_x >= :min_x AND r.min_y <= :max_y AND r.max_y >= :min_y
+      AND t.lon BETWEEN :min_x AND :max_x AND t.lat BETWEEN :min_y AND :max_y
+    ORDER BY t.id
+""")
+
+_TERRAIN_RADIUS_SQL = text("""
+    SELECT t.id, (t.lon - :x) * (t.lon - :x) + (t.lat - :y) * (t.lat - :y) AS d2
+    FROM terrain_risk_rtree r JOIN terrain_risk t ON t.id = r.id
+    WHERE r.min_x <= :x + :r AND r.max_x >= :x - :r AND r.min_y <= :y + :r AND r.max_y >= :y - :r
+      AND d2 <= :r * :r
+    ORDER BY d2, t.id
+""")
+
+_SHELTER_BBOX_SQL = text("""
+    SELECT s.id FROM shelters_rtree r JOIN shelters s ON s.id = r.id
+    WHERE r.min_x <= :max_lon AND r.max_x >= :min_lon AND r.min_y <= :max_lat AND r.max_y >= :min_lat
+      AND s.lon BETWEEN :min_lon AND :max_lon AND s.lat BETWEEN :min_lat AND :max_lat
+    ORDER BY s.id
+""")
+
+_SHELTER_CANDIDATES_SQL = text("""
+    SELECT s.id, s.lat, s.lon FROM shelters_rtree r JOIN shelters s ON s.id = r.id
+    WHERE r.min_x <= :max_lon AND r.max_x >= :min_lon AND r.min_y <= :max_lat AND r.max_y >= :min_lat
+""")
+
+
+# -----------------------------------------------------------------------------
+# terrain_risk（EPSG:6674 [m]）
+# -----------------------------------------------------------------------------
+def terrain_risk_ids_in_bbox(db, min_x: float, min_y: float, max_x: float, max_y: float) -> list[int]:
+    # 戻り値: 矩形（境界を含む）に入る id の昇順
+    rows = db.execute(_TERRAIN_BBOX_SQL, {"min_x": min_x, "min_y": min_y, "max_x": max_x, "max_y": max_y})
+    return [r[0] for r in rows]
+
+
+def terrain_risk_within_radius(db, x: float, y: float, radius_m: float) -> list[tuple[int, float]]:
+    # 戻り値: [(id, 距離[m]), ...] 距離の昇順
+    rows = db.execute(_TERRAIN_RADIUS_SQL, {"x": x, "y": y, "r": radius_m})
+    return [(r[0], math.sqrt(r[1])) for r in rows]
+
+
+# -----------------------------------------------------------------------------
+# shelters（経度/緯度 [度]）
+# -----------------------------------------------------------------------------
+def shelter_ids_in_bbox(db, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> list[int]:
+    # 戻り値: 矩形（境界を含む）に入る id の昇順
+    rows = db.execute(_SHELTER_BBOX_SQL, {
+        "min_lon": min_lon, "min_lat": min_lat, "max_lon": max_lon, "max_lat": max_lat,
+    })
+    return [r[0] for r in rows]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def shelters_within_radius_km(db, lat: float, lon: float, radius_km: float) -> list[tuple[int, float]]:
+    # 半径を包む緯度経度の矩形で候補を取り、haversine で最終判定
+    # 戻り値: [(id, 距離[km]), ...] 距離の昇順
+    # 矩形は球面上の円を確実に包むよう少し広げる（緯線方向は高緯度側の cos で割る）
+    dlat = radius_km * 1000 / M_PER_DEG_LAT * 1.01
+    max_abs_lat = min(abs(lat) + dlat, 89.9)
+    dlon = dlat / math.cos(math.radians(max_abs_lat))
+    rows = db.execute(_SHELTER_CANDIDATES_SQL, {
+        "min_lon": lon - dlon, "min_lat": lat - dlat, "max_lon": lon + dlon, "max_lat": lat + dlat,
+    })
+    hits = []
+    for sid, s_lat, s_lon in rows:
+        d = haversine_km(lat, lon, s_lat, s_lon)
+        if d <= radius_km:
+            hits.append((sid, d))
+    hits.sort(key=lambda h: (h[1], h[0]))
+    return hits
@@ -0,0 +1,104 @@
+# tests/conftest.py
+# backend のテスト共通設定
+#   cd backend && python -m pytest -q
+# database.py などは import 時に環境変数を読むので、テスト用の一時 DB に向けてから読み込む
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(BACKEND_DIR / "scripts"))
+
+_tmp = Path(tempfile.mkdtemp(prefix="backend-tests-"))
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp / 'app.db'}"
+os.environ["SECRET_KEY"] = "test-secret-key-0123456789abcdef0123456789"
+os.environ["TILE_CACHE_DIR"] = str(_tmp / "tile_cache")
+os.environ["RISK_TILE_DIR"] = str(_tmp / "risk_tiles")
+os.environ["WARD_GEOJSON_PATH"] = str(_tmp / "no_wards.geojson")
+os.environ["DATASET_CHECK_INTERVAL_S"] = "3600"  # 読み直しはテストから reload_changed_datasets() を直接呼ぶ
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from pyproj import Transformer  # noqa: E402
+
+from database import engine  # noqa: E402
+from models import Base, Shelter, TerrainRisk  # noqa: E402
+from schema import ensure_sqlite_schema  # noqa: E402
+
+to_6674 = Transformer.from_crs("EPSG:4326", "EPSG:6674", always_xy=True)
+
+LAT_RANGE = (34.60, 34.75)
+LON_RANGE = (135.40, 135.60)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    Base.metadata.create_all(bind=engine)
+    ensure_sqlite_schema(engine)
+
+
+@pytest.fixture
+def tmp_root() -> Path:
+    return _tmp
+
+
+@pytest.fixture
+def db():
+    # テストごとに全テーブルを空にする（R*Tree はトリガで追従する）
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    yield engine
+
+
+@pytest.fixture(autouse=True)
+def reset_app_state():
+    # プロセス内で共有しているインデックス・キャッシュを次のテストに持ち越さない
+    yield
+    import spatial_index
+    from risk_payloads import risk_payloads
+    from risk_tiles import risk_tiles
+
+    with spatial_index._build_lock:
+        spatial_index._risk_index = None
+        spatial_index._shelter_index = None
+        spatial_index._shelter_clusters = None
+        spatial_index._risk_raster = None
+        spatial_index._walk_network = None
+    risk_payloads.reset()
+    risk_tiles.reset()
+    app_api = sys.modules.get("app_API")
+    if app_api is not None:
+        app_api.risk_cache.clear()
+        app_api.shelter_cache.clear()
+        app_api.dataset_versions.clear()
+
+
+def insert_terrain(conn, n: int, seed: int = 0, overall_risk=None) -> list[tuple[float, float]]:
+    # 大阪市内にランダムな地点を n 件。戻り値は各地点の (lat, lon)
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(*LAT_RANGE, n)
+    lons = rng.uniform(*LON_RANGE, n)
+    xs, ys = to_6674.transform(lons, lats)
+    risks = rng.integers(0, 5, n) if overall_risk is None else np.full(n, overall_risk)
+    conn.execute(TerrainRisk.__table__.insert(), [
+        {"lon": float(x), "lat": float(y), "overall_risk": int(r), "flood_risk": int(r) * 20,
+         "risk_description": "洪水" if r else "", "elev_score": 10.0, "slope_score": 5.0, "river_score": 1.0}
+        for x, y, r in zip(xs, ys, risks)
+    ])
+    return list(zip(lats.tolist(), lons.tolist()))
+
+
+def insert_shelters(conn, n: int, seed: int = 0, prefix: str = "避難所") -> list[tuple[float, float]]:
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(*LAT_RANGE, n)
+    lons = rng.uniform(*LON_RANGE, n)
+    conn.execute(Shelter.__table__.insert(), [
+        {"name": f"{prefix}{i}", "ward": "27102", "type": "指定避難所", "capacity": 100, "lat": float(a), "lon": float(b)}
+        for i, (a, b) in enumerate(zip(lats, lons))
+    ])
+    return list(zip(lats.tolist(), lons.tolist()))
@@ -0,0 +1,93 @@
+# dataset_versions の版が上がった時の読み直し（app_API.reload_changed_datasets）
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+import app_API
+import spatial_index
+from build_risk_raster import build as build_risk_raster
+from conftest import insert_shelters, insert_terrain
+from dataset_versions import TERRAIN_RISK, bump_dataset_version
+from spatial_index import MAX_DISTANCE_M, RiskIndex, RiskRaster, get_risk_locator
+
+
+@pytest.fixture
+def raster_dir(tmp_path, monkeypatch):
+    path = tmp_path / "risk_raster"
+    monkeypatch.setattr(spatial_index, "RISK_RASTER_DIR", str(path))
+    return path
+
+
+def _risk_at(client, points):
+    return [client.get("/risk", params={"lat": lat, "lon": lon}).json()["overall_risk"] for lat, lon in points]
+
+
+def _expected_risk(db, n):
+    with db.connect() as conn:
+        return [r for (r,) in conn.execute(text("SELECT overall_risk FROM terrain_risk ORDER BY id LIMIT :n"), {"n": n})]
+
+
+def test_reimport_while_raster_exists(db, raster_dir):
+    with db.begin() as conn:
+        insert_terrain(conn, 500, seed=1)
+        insert_shelters(conn, 20)
+    build_risk_raster(raster_dir, 20.0, MAX_DISTANCE_M)
+
+    with TestClient(app_API.app) as client:
+        assert isinstance(get_risk_locator(), RiskRaster)
+
+        # 再インポート（同じ件数なので id は 1..500 のまま、地点とリスクは別物）
+        with db.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM terrain_risk")
+            points = insert_terrain(conn, 500, seed=2)[:50]
+        bump_dataset_version(db, TERRAIN_RISK)
+        assert client.portal.call(app_API.reload_changed_datasets) == {TERRAIN_RISK}
+
+        # 古いラスタの ids は別の地点を指すので外し、KD-tree で今の地点を返す
+        assert isinstance(get_risk_locator(), RiskIndex)
+        assert _risk_at(client, points) == _expected_risk(db, 50)
+
+        # ラスタを作り直せば（risk_raster の版が上がる）またラスタで応答する
+        build_risk_raster(raster_dir, 20.0, MAX_DISTANCE_M)
+        assert client.portal.call(app_API.reload_changed_datasets) == {"risk_raster"}
+        assert isinstance(get_risk_locator(), RiskRaster)
+        assert _risk_at(client, points) == _expected_risk(db, 50)
+
+
+def _tile_of(lat, lon, z=14):
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return z, x, y
+
+
+def test_heatmap_tile_version_follows_risk_raster(db, raster_dir, tmp_root):
+    with db.begin() as conn:
+        lat, lon = insert_terrain(conn, 500, seed=3)[0]
+    z, x, y = _tile_of(lat, lon)
+    url = f"/risk/tiles/overall/{z}/{x}/{y}.png"
+
+    with TestClient(app_API.app) as client:
+        kd_tile = client.get(url)
+        assert kd_tile.status_code == 200
+        assert client.get(url, headers={"If-None-Match": kd_tile.headers["ETag"]}).status_code == 304
+
+        # ラスタを作る → 近傍検索が入れ替わるので、タイルの版（ETag・保存先）も変わる
+        build_risk_raster(raster_dir, 20.0, MAX_DISTANCE_M)
+        assert client.portal.call(app_API.reload_changed_datasets) == {"risk_raster"}
+        assert isinstance(get_risk_locator(), RiskRaster)
+        raster_tile = client.get(url, headers={"If-None-Match": kd_tile.headers["ETag"]})
+        assert raster_tile.status_code == 200
+        assert raster_tile.headers["ETag"] != kd_tile.headers["ETag"]
+        assert app_API.risk_tiles.renderer().locator is get_risk_locator()
+
+        # 作り直しても（セルの大きさが変われば）また変わる
+        build_risk_raster(raster_dir, 40.0, MAX_DISTANCE_M)
+        client.portal.call(app_API.reload_changed_datasets)
+        rebuilt = client.get(url, headers={"If-None-Match": raster_tile.headers["ETag"]})
+        assert rebuilt.status_code == 200
+        assert rebuilt.headers["ETag"] != raster_tile.headers["ETag"]
+        versions = {p.name for p in (tmp_root / "risk_tiles").iterdir()}
+        assert {t.headers["ETag"].strip('"') for t in (kd_tile, raster_tile, rebuilt)} <= versions
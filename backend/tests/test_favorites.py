@@ -0,0 +1,114 @@
+# お気に入り API（GET /favorites のページング・ETag、/favorites/sync）
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import app_API
+from conftest import insert_terrain
+
+DEVICE = {"X-Device-ID": "test-device"}
+
+
+@pytest.fixture
+def client(db):
+    with TestClient(app_API.app) as client:
+        yield client
+
+
+def add(client, title, headers=DEVICE):
+    res = client.post("/favorites", json={"lat": 34.7, "lon": 135.5, "title": title}, headers=headers)
+    assert res.status_code == 200
+    return res.json()["id"]
+
+
+def test_pages_follow_next_cursor(client):
+    ids = [add(client, f"地点{i}") for i in range(5)]
+    seen, cursor = [], None
+    while True:
+        res = client.get("/favorites", params={"limit": 2, **({"cursor": cursor} if cursor else {})}, headers=DEVICE)
+        assert res.status_code == 200
+        seen += [item["id"] for item in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(ids) and len(seen) == len(set(seen))
+
+
+def test_owner_is_isolated(client):
+    add(client, "自分の")
+    add(client, "他人の", headers={"X-Device-ID": "other-device"})
+    assert [item["title"] for item in client.get("/favorites", headers=DEVICE).json()] == ["自分の"]
+    assert client.get("/favorites").json() == []
+
+
+def test_unchanged_list_is_not_modified(client):
+    add(client, "地点")
+    first = client.get("/favorites", headers=DEVICE)
+    again = client.get("/favorites", headers={**DEVICE, "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.headers["ETag"] == first.headers["ETag"]
+
+
+def test_bad_cursor_is_rejected(client):
+    assert client.get("/favorites", params={"cursor": "!!"}, headers=DEVICE).status_code == 400
+
+
+def test_ward_stats_missing(client):
+    assert client.get("/wards/27102/stats").status_code == 404
+    assert client.get("/wards/abc/stats").status_code == 400
+
+
+def test_slow_read_does_not_block_other_requests(db, monkeypatch):
+    # 読み取りが busy_timeout で待たされている間も /risk は応答する（読み取りはイベントループの外で実行する）
+    with db.begin() as conn:
+        (lat, lon), = insert_terrain(conn, 1)
+    monkeypatch.setattr(app_API, "_read_ward_stats", lambda db, code: time.sleep(1.0))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app_API.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            started = time.perf_counter()
+            slow = asyncio.create_task(http.get("/wards/27102/stats"))
+            await asyncio.sleep(0.1)
+            risk = await http.get("/risk", params={"lat": lat, "lon": lon})
+            elapsed = time.perf_counter() - started
+            return (await slow).status_code, risk.status_code, elapsed
+
+    with TestClient(app_API.app) as client:
+        slow_status, risk_status, elapsed = client.portal.call(scenario)
+    assert (slow_status, risk_status) == (404, 200)
+    assert elapsed < 0.5
+
+
+def test_edit_in_same_second_changes_etag(client, db):
+    first_id = add(client, "地点A")
+    add(client, "地点B")
+    etag = client.get("/favorites", headers=DEVICE).headers["ETag"]
+
+    # 件数も最大 ID も updated_at（秒単位）も変わらない更新
+    with db.begin() as conn:
+        conn.exec_driver_sql("UPDATE favorites SET title = '地点A2' WHERE id = ?", (first_id,))
+    res = client.get("/favorites", headers={**DEVICE, "If-None-Match": etag})
+    assert res.status_code == 200
+    assert "地点A2" in [item["title"] for item in res.json()]
+    assert res.headers["ETag"] != etag
+
+
+def test_delete_and_add_in_one_sync_changes_etag(client):
+    ids = [add(client, f"地点{i}") for i in range(3)]
+    etag = client.get("/favorites", headers=DEVICE).headers["ETag"]
+
+    res = client.post("/favorites/sync", json={"creates": [{"lat": 34.7, "lon": 135.5, "title": "新"}],
+                                               "deletes": [ids[0]]}, headers=DEVICE)
+    assert res.status_code == 200
+    res = client.get("/favorites", headers={**DEVICE, "If-None-Match": etag})
+    assert res.status_code == 200
+    assert sorted(item["title"] for item in res.json()) == ["地点1", "地点2", "新"]
+
+    # 一番新しい番号の行を消しても、墓標の番号で変わる
+    etag = res.headers["ETag"]
+    newest = max(res.json(), key=lambda item: item["version"])["id"]
+    assert client.delete(f"/favorites/{newest}", headers=DEVICE).status_code == 200
+    assert client.get("/favorites", headers={**DEVICE, "If-None-Match": etag}).status_code == 200
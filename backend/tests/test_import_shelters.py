@@ -0,0 +1,57 @@
+# 避難所 GeoJSON の取り込み（scripts/import_shelters_from_geojson.py）と geojson_stream
+import json
+
+from sqlalchemy import text
+
+import geojson_stream
+from geojson_stream import iter_features
+from import_shelters_from_geojson import main as import_shelters
+
+
+def _point(name, code, lon, lat):
+    props = {"P20_002": name, **({"P20_001": code} if code else {})}
+    return {"type": "Feature", "properties": props, "geometry": {"type": "Point", "coordinates": [lon, lat]}}
+
+
+def _write(path, features):
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}, ensure_ascii=False),
+                    encoding="utf-8")
+    return path
+
+
+def test_ward_code_decides_before_bbox(db, tmp_path):
+    path = _write(tmp_path / "shelters.geojson", [
+        _point("大阪市北区", "27127", 135.50, 34.70),
+        _point("尼崎市", "28202", 135.42, 34.73),    # bbox の中だが兵庫県
+        _point("生駒市", "29209", 135.70, 34.69),    # bbox の中だが奈良県
+        _point("府内・区コード無し", "", 135.52, 34.68),
+        _point("府外・区コード無し", "", 136.90, 35.18),
+        _point("能勢町", "27321", 135.42, 34.97),    # bbox の外でも区コードが大阪府
+    ])
+    import_shelters(str(path))
+    with db.connect() as conn:
+        names = {n for (n,) in conn.execute(text("SELECT name FROM shelters"))}
+    assert names == {"大阪市北区", "府内・区コード無し", "能勢町"}
+
+
+def test_large_feature_across_many_reads(tmp_path, monkeypatch):
+    # 1件で読込単位の数千倍ある feature も、解析し直しは読込回数に比例しない
+    ring = [[135.0 + i * 1e-5, 34.0 + (i % 7) * 1e-5] for i in range(20000)]
+    polygon = {"type": "Feature", "properties": {"name": "大きい"},
+               "geometry": {"type": "Polygon", "coordinates": [ring]}}
+    path = _write(tmp_path / "large.geojson", [_point("前", "27127", 135.5, 34.7), polygon,
+                                               _point("後", "27127", 135.5, 34.7)])
+
+    calls = []
+
+    class CountingDecoder(json.JSONDecoder):
+        def raw_decode(self, s, idx=0):
+            calls.append(len(s) - idx)
+            return super().raw_decode(s, idx)
+
+    monkeypatch.setattr(geojson_stream.json, "JSONDecoder", CountingDecoder)
+    features = list(iter_features(path, read_size=256))
+    assert [f["properties"].get("P20_002") or f["properties"]["name"] for f in features] == ["前", "大きい", "後"]
+    assert features[1]["geometry"]["coordinates"] == [ring]
+    assert len(calls) < 40
+    assert sum(calls) < 4 * path.stat().st_size
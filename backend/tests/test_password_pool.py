@@ -0,0 +1,32 @@
+# パスワードのハッシュ化・検証用プロセスプール（password_pool.PasswordPool）
+import time
+
+import pytest
+
+from password_pool import PasswordPool, PasswordPoolBusy
+
+
+@pytest.fixture
+def pool():
+    pool = PasswordPool(workers=1, max_pending=1, rounds=1000)
+    yield pool
+    pool.shutdown()
+
+
+def test_hash_and_verify_in_worker(pool):
+    hashed = pool.hash("正しいパスワード").result(timeout=30)
+    assert hashed.startswith("$pbkdf2-sha256$1000$")
+    assert pool.verify("正しいパスワード", hashed).result(timeout=30) is True
+    assert pool.verify("違うパスワード", hashed).result(timeout=30) is False
+    stats = pool.stats()
+    assert (stats["submitted"], stats["completed"], stats["pending"], stats["rounds"]) == (3, 3, 0, 1000)
+
+
+def test_rejects_beyond_max_pending(pool):
+    busy = pool.submit(time.sleep, 0.5)
+    with pytest.raises(PasswordPoolBusy):
+        pool.hash("待たされる")
+    busy.result(timeout=30)
+    assert pool.stats()["rejected"] == 1
+    # 空いたら受け付ける
+    assert pool.hash("空いた").result(timeout=30).startswith("$pbkdf2-sha256$")
@@ -0,0 +1,92 @@
+# 事前計算ラスタ（spatial_index.RiskRaster / scripts/build_risk_raster.py）
+import json
+
+import numpy as np
+import pytest
+
+import spatial_index
+from build_risk_raster import build as build_risk_raster
+from conftest import insert_terrain, to_6674
+from spatial_index import MAX_DISTANCE_M, RiskIndex, RiskRaster, get_risk_locator
+
+
+@pytest.fixture
+def raster_dir(tmp_path, monkeypatch):
+    path = tmp_path / "risk_raster"
+    monkeypatch.setattr(spatial_index, "RISK_RASTER_DIR", str(path))
+    return path
+
+
+def _query_points(n=300, seed=42):
+    rng = np.random.default_rng(seed)
+    return to_6674.transform(rng.uniform(135.40, 135.60, n), rng.uniform(34.60, 34.75, n))
+
+
+@pytest.mark.parametrize("cell_size", [20.0, 75.0])
+def test_raster_matches_kdtree(db, raster_dir, cell_size):
+    with db.begin() as conn:
+        insert_terrain(conn, 500)
+    build_risk_raster(raster_dir, cell_size, MAX_DISTANCE_M)
+
+    locator = get_risk_locator()
+    assert isinstance(locator, RiskRaster)
+    kd = spatial_index.get_risk_index()
+    xs, ys = _query_points(20000)
+    # しきい値ちょうど付近（各点から MAX_DISTANCE_M ± 1 m の円周上）も混ぜる
+    rng = np.random.default_rng(7)
+    angle = rng.uniform(0, 2 * np.pi, 2000)
+    radius = MAX_DISTANCE_M + rng.uniform(-1.0, 1.0, 2000)
+    base = kd.xy[rng.integers(0, len(kd), 2000)]
+    xs = np.concatenate([xs, base[:, 0] + radius * np.cos(angle)])
+    ys = np.concatenate([ys, base[:, 1] + radius * np.sin(angle)])
+
+    raster_ids, raster_dist = locator.nearest_many(xs, ys, MAX_DISTANCE_M)
+    kd_ids, kd_dist = kd.nearest_many(xs, ys, MAX_DISTANCE_M)
+    assert ((raster_ids >= 0) == (kd_ids >= 0)).all()
+    assert (raster_ids == kd_ids).all()
+    assert np.allclose(raster_dist[kd_ids >= 0], kd_dist[kd_ids >= 0])
+    for x, y, expected in zip(xs[:500], ys[:500], kd_ids[:500]):
+        found, _ = locator.nearest(x, y, MAX_DISTANCE_M)
+        assert (-1 if found is None else found) == expected
+
+
+def test_raster_of_old_format_is_not_used(db, raster_dir):
+    with db.begin() as conn:
+        insert_terrain(conn, 200)
+    build_risk_raster(raster_dir, 20.0, MAX_DISTANCE_M)
+    meta = json.loads((raster_dir / "meta.json").read_text(encoding="utf-8"))
+    del meta["format"]  # 候補リストを持たない旧形式（セル中心の最寄り点だけ）
+    (raster_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+
+    assert isinstance(get_risk_locator(), RiskIndex)
+
+
+def test_raster_from_previous_import_is_not_used(db, raster_dir):
+    with db.begin() as conn:
+        insert_terrain(conn, 500, seed=1)
+    build_risk_raster(raster_dir, 20.0, MAX_DISTANCE_M)
+
+    # 再インポート: 同じ件数を入れ直すと id も 1..500 に振り直されるが、地点は別物
+    with db.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM terrain_risk")
+        insert_terrain(conn, 500, seed=2)
+
+    locator = get_risk_locator()  # 新しく起動したワーカー
+    assert isinstance(locator, RiskIndex)
+    xs, ys = _query_points()
+    ids, _ = locator.nearest_many(xs, ys, MAX_DISTANCE_M)
+    with db.connect() as conn:
+        fresh = RiskIndex.from_session(conn)
+    assert (ids == fresh.nearest_many(xs, ys, MAX_DISTANCE_M)[0]).all()
+
+
+def test_raster_without_fingerprint_is_not_used(db, raster_dir):
+    with db.begin() as conn:
+        insert_terrain(conn, 200)
+    build_risk_raster(raster_dir, 20.0, MAX_DISTANCE_M)
+    meta = json.loads((raster_dir / "meta.json").read_text(encoding="utf-8"))
+    del meta["terrain_fingerprint"]  # 指紋を記録する前の版のスクリプトで作ったラスタ
+    (raster_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+
+    assert isinstance(get_risk_locator(), RiskIndex)
+    assert spatial_index.indexes_ready() is False  # 避難所はまだ
@@ -0,0 +1,117 @@
+# R*Tree 空間インデックス（schema.ensure_spatial_tables）とトリガによる同期、spatial_sql の矩形・半径検索
+import numpy as np
+import pytest
+from sqlalchemy import text
+
+from conftest import insert_shelters, insert_terrain, to_6674
+from schema import ensure_spatial_tables
+from spatial_sql import (
+    haversine_km, shelter_ids_in_bbox, shelters_within_radius_km, terrain_risk_ids_in_bbox, terrain_risk_within_radius,
+)
+
+BBOX_HELPERS = {
+    "shelters": shelter_ids_in_bbox,
+    "terrain_risk": terrain_risk_ids_in_bbox,
+}
+
+
+def _rtree_ids(conn, table, box) -> set[int]:
+    ids = BBOX_HELPERS[table](conn, *box)
+    assert ids == sorted(ids)
+    return set(ids)
+
+
+def _scan_ids(conn, table, box) -> set[int]:
+    min_x, min_y, max_x, max_y = box
+    rows = conn.execute(text(f"SELECT id, lon, lat FROM {table} WHERE lon IS NOT NULL AND lat IS NOT NULL")).all()
+    return {i for i, x, y in rows if min_x <= x <= max_x and min_y <= y <= max_y}
+
+
+def _random_boxes(conn, table, n=30, seed=0):
+    # データ範囲の中に大小さまざまな矩形
+    min_x, min_y, max_x, max_y = conn.execute(text(
+        f"SELECT MIN(lon), MIN(lat), MAX(lon), MAX(lat) FROM {table}"
+    )).one()
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        w, h = rng.uniform(0.02, 0.5) * (max_x - min_x), rng.uniform(0.02, 0.5) * (max_y - min_y)
+        x0, y0 = rng.uniform(min_x, max_x - w), rng.uniform(min_y, max_y - h)
+        yield x0, y0, x0 + w, y0 + h
+
+
+def assert_matches_scan(conn, table):
+    assert conn.execute(text(f"SELECT COUNT(*) FROM {table}_rtree")).scalar() == conn.execute(
+        text(f"SELECT COUNT(*) FROM {table} WHERE lon IS NOT NULL AND lat IS NOT NULL")
+    ).scalar()
+    for box in _random_boxes(conn, table):
+        expected = _scan_ids(conn, table, box)
+        assert _rtree_ids(conn, table, box) == expected
+
+
+@pytest.fixture
+def populated(db):
+    with db.begin() as conn:
+        insert_terrain(conn, 1000)
+        insert_shelters(conn, 300)
+    return db
+
+
+@pytest.mark.parametrize("table", ["shelters", "terrain_risk"])
+def test_bbox_matches_scan_after_insert(populated, table):
+    with populated.connect() as conn:
+        assert_matches_scan(conn, table)
+
+
+@pytest.mark.parametrize("table", ["shelters", "terrain_risk"])
+def test_triggers_follow_updates_and_deletes(populated, table):
+    with populated.begin() as conn:
+        ids = [i for (i,) in conn.execute(text(f"SELECT id FROM {table} ORDER BY id"))]
+        # 動かす・座標を消す・消す・id を変える
+        conn.execute(text(f"UPDATE {table} SET lon = lat, lat = lon WHERE id % 7 = 0"))
+        if table == "terrain_risk":  # shelters の座標は NOT NULL
+            conn.execute(text(f"UPDATE {table} SET lon = NULL WHERE id % 11 = 0"))
+        conn.execute(text(f"DELETE FROM {table} WHERE id % 5 = 0"))
+        conn.execute(text(f"UPDATE {table} SET lon = (SELECT MIN(lon) FROM {table}) WHERE id = :id"), {"id": ids[10]})
+        conn.execute(text(f"UPDATE {table} SET id = :new WHERE id = :old"), {"new": ids[-1] + 100, "old": ids[1]})
+    with populated.connect() as conn:
+        assert_matches_scan(conn, table)
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {table}_rtree WHERE id = :old"), {"old": ids[1]}).scalar() == 0
+
+
+def test_ensure_spatial_tables_rebuilds_out_of_sync_mirror(populated):
+    with populated.begin() as conn:
+        conn.exec_driver_sql("DROP TRIGGER shelters_rtree_ad")
+        conn.exec_driver_sql("DELETE FROM shelters WHERE id % 3 = 0")  # トリガが無いので R*Tree に残る
+        ensure_spatial_tables(conn)
+    with populated.connect() as conn:
+        assert_matches_scan(conn, "shelters")
+
+
+def test_terrain_radius_matches_scan(populated):
+    with populated.connect() as conn:
+        rows = conn.execute(text("SELECT id, lon, lat FROM terrain_risk")).all()
+        rng = np.random.default_rng(1)
+        centers = [(x, y) for _, x, y in rows[:10]]  # 点の真上（距離 0）も含める
+        centers += list(zip(*to_6674.transform(rng.uniform(135.40, 135.60, 20), rng.uniform(34.60, 34.75, 20))))
+        for (x, y), radius in zip(centers, np.tile([50.0, 500.0, 1500.0], 10)):
+            expected = sorted(
+                ((i, float(np.hypot(px - x, py - y))) for i, px, py in rows if np.hypot(px - x, py - y) <= radius),
+                key=lambda h: (h[1], h[0]),
+            )
+            got = terrain_risk_within_radius(conn, float(x), float(y), float(radius))
+            assert [i for i, _ in got] == [i for i, _ in expected]
+            assert np.allclose([d for _, d in got], [d for _, d in expected])
+
+
+def test_shelter_radius_matches_scan(populated):
+    with populated.connect() as conn:
+        rows = conn.execute(text("SELECT id, lat, lon FROM shelters")).all()
+        rng = np.random.default_rng(2)
+        for lat, lon, radius_km in zip(rng.uniform(34.60, 34.75, 30), rng.uniform(135.40, 135.60, 30),
+                                       np.tile([0.3, 1.0, 3.0], 10)):
+            expected = sorted(
+                ((i, haversine_km(lat, lon, s_lat, s_lon)) for i, s_lat, s_lon in rows
+                 if haversine_km(lat, lon, s_lat, s_lon) <= radius_km),
+                key=lambda h: (h[1], h[0]),
+            )
+            assert shelters_within_radius_km(conn, float(lat), float(lon), float(radius_km)) == expected
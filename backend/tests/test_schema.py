@@ -0,0 +1,73 @@
+# スキーマの版（schema.SCHEMA_VERSION / PRAGMA user_version）
+import pytest
+from sqlalchemy import create_engine
+
+from conftest import insert_shelters, insert_terrain
+from models import Base
+from schema import SCHEMA_VERSION, SchemaVersionError, ensure_sqlite_schema
+
+
+def _columns(conn, table) -> set[str]:
+    return {c[1] for c in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def _user_version(engine) -> int:
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+@pytest.fixture
+def v1_engine(tmp_path):
+    # SCHEMA_VERSION = 1 の頃の DB（ward_code 列が無い）にデータが入っている状態
+    engine = create_engine(f"sqlite:///{tmp_path / 'v1.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for table in ("terrain_risk", "shelters"):
+            for (name,) in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql LIKE '%ward_code%'",
+                (table,),
+            ).all():
+                conn.exec_driver_sql(f"DROP INDEX {name}")
+            conn.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN ward_code")
+        insert_terrain(conn, 50)
+        insert_shelters(conn, 10)
+        conn.exec_driver_sql("PRAGMA user_version = 1")
+    yield engine
+    engine.dispose()
+
+
+def test_version_1_database_is_migrated(v1_engine):
+    ensure_sqlite_schema(v1_engine)
+
+    assert _user_version(v1_engine) == SCHEMA_VERSION
+    with v1_engine.connect() as conn:
+        assert "ward_code" in _columns(conn, "terrain_risk")
+        assert "ward_code" in _columns(conn, "shelters")
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM terrain_risk").scalar() == 50
+        # 既存の行も R*Tree に取り込まれ、お気に入りの同期トリガもある
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM terrain_risk_rtree").scalar() == 50
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM shelters_rtree").scalar() == 10
+        triggers = {name for (name,) in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        assert {"favorites_sync_ai", "favorites_sync_au", "favorites_sync_ad"} <= triggers
+
+
+def test_current_version_is_left_alone(v1_engine):
+    ensure_sqlite_schema(v1_engine)
+    with v1_engine.begin() as conn:
+        conn.exec_driver_sql("DROP TRIGGER favorites_sync_ai")
+    ensure_sqlite_schema(v1_engine)  # user_version が最新なら何もしない
+    with v1_engine.connect() as conn:
+        assert not conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'favorites_sync_ai'"
+        ).first()
+
+
+def test_newer_database_is_refused(v1_engine):
+    with v1_engine.begin() as conn:
+        conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+
+    with pytest.raises(SchemaVersionError):
+        ensure_sqlite_schema(v1_engine)
+    assert _user_version(v1_engine) == SCHEMA_VERSION + 1
+    with v1_engine.connect() as conn:
+        assert "ward_code" not in _columns(conn, "terrain_risk")  # 何も書き換えていない
@@ -0,0 +1,177 @@
+# 地理院タイルの中継（tile_proxy.py / scripts/prefetch_tiles.py）。上流は httpx.MockTransport
+import asyncio
+
+import httpx
+import pytest
+
+import prefetch_tiles
+import tile_proxy as tile_proxy_module
+from tile_proxy import DiskTileCache, TileEntry, TileProxy, TileUpstreamError
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+
+
+class Upstream:
+    # 上流の代わり。respond(request) を差し替えて振る舞いを変える
+    def __init__(self):
+        self.requests: list[httpx.Request] = []
+        self.delay = 0.0
+        self.respond = lambda request: httpx.Response(
+            200, content=PNG, headers={"ETag": '"v1"', "Cache-Control": "max-age=60", "Content-Type": "image/png"}
+        )
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.respond(request)
+
+
+@pytest.fixture
+def upstream():
+    return Upstream()
+
+
+@pytest.fixture
+def proxy(tmp_path, upstream):
+    proxy = TileProxy(DiskTileCache(tmp_path / "tiles", 10 * 1024 * 1024))
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    proxy._http = lambda: client
+    return proxy
+
+
+def expire_all(monkeypatch):
+    monkeypatch.setattr(tile_proxy_module, "TILE_CACHE_TTL_S", 0)
+
+
+def test_miss_then_hit(proxy, upstream):
+    async def run():
+        return await proxy.get("flood", 14, 14370, 6500), await proxy.get("flood", 14, 14370, 6500)
+
+    (first, outcome1), (second, outcome2) = asyncio.run(run())
+    assert (outcome1, outcome2) == ("MISS", "HIT")
+    assert second.body == PNG and second.etag == '"v1"'
+    assert len(upstream.requests) == 1
+    assert str(upstream.requests[0].url).endswith("/01_flood_l2_shinsuishin_data/14/14370/6500.png")
+
+
+def test_concurrent_misses_share_one_upstream_fetch(proxy, upstream):
+    upstream.delay = 0.2
+
+    async def run():
+        return await asyncio.gather(*(proxy.get("flood", 14, 1, 2) for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert len(upstream.requests) == 1
+    assert proxy.coalesced == 9
+    assert all(entry.body == PNG for entry, _ in results)
+    assert proxy.stats()["inflight"] == 0
+
+
+def test_not_modified_refreshes_stored_entry(proxy, upstream, monkeypatch):
+    asyncio.run(proxy.get("flood", 14, 1, 2))
+    before = proxy.cache.read(("flood", 14, 1, 2))
+    expire_all(monkeypatch)
+    upstream.respond = lambda request: httpx.Response(304, headers={"Cache-Control": "max-age=120"})
+
+    entry, outcome = asyncio.run(proxy.get("flood", 14, 1, 2))
+    assert outcome == "REVALIDATED"
+    assert upstream.requests[-1].headers["If-None-Match"] == '"v1"'
+    stored = proxy.cache.read(("flood", 14, 1, 2))
+    assert stored.body == PNG and stored.etag == '"v1"'
+    assert stored.fetched_at > before.fetched_at
+    assert stored.cache_control == "max-age=120"
+    assert proxy.upstream_not_modified == 1
+
+
+def test_upstream_404_is_cached(proxy, upstream):
+    upstream.respond = lambda request: httpx.Response(404)
+
+    async def run():
+        return await proxy.get("tsunami", 12, 3, 4), await proxy.get("tsunami", 12, 3, 4)
+
+    (first, outcome1), (second, outcome2) = asyncio.run(run())
+    assert (outcome1, outcome2) == ("MISS", "HIT")
+    assert first.status == second.status == 404 and second.body == b""
+    assert len(upstream.requests) == 1
+
+
+def raise_error(error_type):
+    def respond(request):
+        raise error_type("upstream down", request=request)
+    return respond
+
+
+@pytest.mark.parametrize("failure", [
+    lambda request: httpx.Response(503),
+    raise_error(httpx.ConnectError),
+    raise_error(httpx.ReadTimeout),
+], ids=["503", "connect-error", "timeout"])
+def test_stale_copy_served_when_upstream_fails(proxy, upstream, monkeypatch, failure):
+    asyncio.run(proxy.get("landslide", 15, 5, 6))
+    expire_all(monkeypatch)
+    upstream.respond = failure
+
+    entry, outcome = asyncio.run(proxy.get("landslide", 15, 5, 6))
+    assert outcome == "STALE"
+    assert entry.body == PNG
+    assert proxy.stale_served == 1 and proxy.upstream_errors == 1
+
+
+def test_upstream_failure_without_copy_raises(proxy, upstream):
+    upstream.respond = lambda request: httpx.Response(500)
+    with pytest.raises(TileUpstreamError):
+        asyncio.run(proxy.get("landslide", 15, 5, 6))
+    assert proxy.cache.read(("landslide", 15, 5, 6)) is None
+
+
+def _entry(size: int) -> TileEntry:
+    return TileEntry(status=200, body=b"x" * size, etag='"e"', upstream_etag=None, last_modified=None,
+                     cache_control=None, content_type="image/png", fetched_at=0.0)
+
+
+def test_byte_budget_evicts_least_recently_used(tmp_path):
+    one = len(_entry(1000).encode())
+    cache = DiskTileCache(tmp_path / "tiles", max_bytes=one * 2 + one // 2)
+    a, b, c = ("flood", 10, 0, 0), ("flood", 10, 0, 1), ("flood", 10, 0, 2)
+    cache.write(a, _entry(1000))
+    cache.write(b, _entry(1000))
+    assert cache.read(a) is not None  # a を最近使ったことにする → 追い出されるのは b
+    cache.write(c, _entry(1000))
+
+    assert cache.evictions == 1
+    assert cache.total_bytes == one * 2 <= cache.max_bytes
+    assert not (cache.root / cache.relpath(b)).exists()
+    assert cache.read(b) is None
+    assert cache.read(a) is not None and cache.read(c) is not None
+
+
+def test_scan_restores_lru_order_from_disk(tmp_path):
+    one = len(_entry(1000).encode())
+    cache = DiskTileCache(tmp_path / "tiles", max_bytes=10 * one)
+    keys = [("flood", 10, 0, i) for i in range(3)]
+    for key in keys:
+        cache.write(key, _entry(1000))
+
+    restarted = DiskTileCache(tmp_path / "tiles", max_bytes=one)
+    restarted.scan()
+    assert restarted.stats()["files"] == 1
+    assert restarted.read(keys[-1]) is not None  # 一番新しいものだけ残る
+
+
+def test_prefetch_fills_cache_and_resumes(proxy, upstream, monkeypatch):
+    monkeypatch.setattr(prefetch_tiles, "tile_proxy", proxy)
+    upstream.respond = lambda request: (
+        httpx.Response(404) if request.url.path.endswith("0.png")
+        else httpx.Response(200, content=PNG, headers={"ETag": '"v1"'})
+    )
+    bbox = (135.45, 34.65, 135.55, 34.72)
+    tiles = len(list(prefetch_tiles.tiles_in_bbox(bbox, 14)))
+
+    counts = asyncio.run(prefetch_tiles.prefetch(["flood"], [14], bbox, concurrency=4))
+    assert counts["MISS"] == tiles and counts["failed"] == 0
+    assert counts["empty"] == sum(r.url.path.endswith("0.png") for r in upstream.requests)
+
+    again = asyncio.run(prefetch_tiles.prefetch(["flood"], [14], bbox, concurrency=4))
+    assert again["HIT"] == tiles
+    assert len(upstream.requests) == tiles
@@ -0,0 +1,111 @@
+# 徒歩ネットワーク（/shelters/nearest?mode=walk）と避難所の入れ替え
+import json
+import logging
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app_API
+import spatial_index
+from build_walk_network import build as build_walk_network
+from dataset_versions import SHELTERS, bump_dataset_version
+from models import Shelter
+from spatial_index import WALK_SNAP_MAX_M
+
+GRID_LON = [round(135.50 + 0.002 * i, 3) for i in range(11)]
+GRID_LAT = [round(34.68 + 0.002 * i, 3) for i in range(11)]
+QUERY = {"lat": 34.690, "lon": 135.510}
+
+
+def _names(client, mode, limit=3, **point):
+    params = {**(point or QUERY), "mode": mode, "limit": limit}
+    res = client.get("/shelters/nearest", params=params)
+    assert res.status_code == 200
+    full = client.get("/risk/full", params=params).json()["shelters"]
+    names = [s["name"] for s in res.json()]
+    assert [s["name"] for s in full["items"]] == names
+    assert full["mode"] == res.headers["X-Shelter-Mode"]
+    return res.headers["X-Shelter-Mode"], names
+
+
+def _shelter(name, lat, lon):
+    return {"name": name, "ward": "27102", "type": "指定避難所", "capacity": 100, "lat": lat, "lon": lon}
+
+
+@pytest.fixture
+def walk_dir(tmp_path, monkeypatch):
+    # 格子状の道路（交差点で頂点を共有する）
+    roads = tmp_path / "roads.geojson"
+    features = [{"type": "Feature", "properties": {},
+                 "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lon in GRID_LON]}}
+                for lat in GRID_LAT]
+    features += [{"type": "Feature", "properties": {},
+                  "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat in GRID_LAT]}}
+                 for lon in GRID_LON]
+    roads.write_text(json.dumps({"type": "FeatureCollection", "features": features}), encoding="utf-8")
+    path = tmp_path / "walk_network"
+    monkeypatch.setattr(spatial_index, "WALK_NETWORK_DIR", str(path))
+    return roads, path
+
+
+def test_stale_walk_network_falls_back_to_straight(db, walk_dir, caplog):
+    roads, path = walk_dir
+    with db.begin() as conn:
+        conn.execute(Shelter.__table__.insert(), [
+            _shelter("北", 34.700, 135.500), _shelter("南", 34.680, 135.520), _shelter("東", 34.690, 135.520),
+        ])
+    build_walk_network(roads, path, 4, WALK_SNAP_MAX_M)
+
+    with TestClient(app_API.app) as client:
+        res = client.get("/shelters/nearest", params={**QUERY, "mode": "walk"})
+        assert res.headers["X-Shelter-Mode"] == "walk"
+        assert "walk_distance_km" in res.json()[0]
+
+        # 表を作り直さずに避難所を追加（問い合わせ地点のすぐそば）
+        with db.begin() as conn:
+            conn.execute(Shelter.__table__.insert(), [_shelter("新設", 34.690, 135.511)])
+        bump_dataset_version(db, SHELTERS)
+        with caplog.at_level(logging.WARNING, logger="app"):
+            assert client.portal.call(app_API.reload_changed_datasets) == {SHELTERS}
+        assert any("徒歩ネットワークの表" in r.getMessage() for r in caplog.records)
+
+        # 古い表には新しい避難所が載っていないので、直線距離で返したことをヘッダで示す
+        res = client.get("/shelters/nearest", params={**QUERY, "mode": "walk"})
+        assert res.headers["X-Shelter-Mode"] == "straight"
+        nearest = res.json()[0]
+        assert nearest["name"] == "新設"
+        assert "walk_distance_km" not in nearest
+
+        body = client.get("/risk/full", params={**QUERY, "mode": "walk"}).json()
+        assert body["shelters"]["mode"] == "straight"
+        assert body["shelters"]["items"][0]["name"] == "新設"
+        # 並びは mode=straight と同じ規則（問い合わせ地点からの直線距離）
+        assert _names(client, "walk", limit=3) == _names(client, "straight", limit=3)
+
+        # 表を作り直せば徒歩距離に戻る
+        build_walk_network(roads, path, 4, WALK_SNAP_MAX_M)
+        client.portal.call(app_API.reload_changed_datasets)
+        res = client.get("/shelters/nearest", params={**QUERY, "mode": "walk"})
+        assert res.headers["X-Shelter-Mode"] == "walk"
+        assert res.json()[0]["name"] == "新設"
+
+
+@pytest.mark.parametrize("case", ["no_network", "far_from_road"])
+def test_walk_falls_back_to_the_straight_ranking(db, walk_dir, monkeypatch, case):
+    roads, path = walk_dir
+    with db.begin() as conn:
+        conn.execute(Shelter.__table__.insert(), [
+            _shelter("北", 34.700, 135.500), _shelter("南", 34.680, 135.520), _shelter("東", 34.690, 135.520),
+            _shelter("遠い", 34.720, 135.560),
+        ])
+    build_walk_network(roads, path, 4, WALK_SNAP_MAX_M)
+    point = QUERY
+    if case == "no_network":
+        monkeypatch.setattr(spatial_index, "WALK_NETWORK_DIR", "")
+    else:
+        point = {"lat": 34.720, "lon": 135.555}  # 道路（格子）から WALK_SNAP_MAX_M 以上離れている
+
+    with TestClient(app_API.app) as client:
+        straight = _names(client, "straight", limit=4, **point)
+        assert straight[0] == "straight"
+        assert _names(client, "walk", limit=4, **point) == straight
@@ -0,0 +1,300 @@
+# tile_proxy.py
+# 地理院のラスタタイル（土地条件図・洪水・津波・土石流）を中継し、ディスクにキャッシュする
+#   GET /tiles/{layer}/{z}/{x}/{y}.png → キャッシュ → 無い / 古いときだけ上流へ
+#   ・キャッシュは sha1 で 2 段にシャーディングしたファイル（1 タイル 1 ファイル、ヘッダ JSON + 本体）
+#   ・合計サイズが TILE_CACHE_MAX_MB を超えたら最近使っていないものから消す（LRU、参照時に mtime を更新）
+#   ・同じタイルの取得が同時に来たら上流へは 1 回だけ取りに行き、結果を共有する
+#   ・上流の ETag / Last-Modified / Cache-Control をそのまま返し、期限切れ時は条件付き GET で再検証する
+#   ・上流に無いタイル（404。浸水想定の無い範囲など）もキャッシュして取りに行き直さない
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+
+TILE_CACHE_DIR = Path(os.getenv("TILE_CACHE_DIR", "./data/tile_cache"))
+TILE_CACHE_MAX_BYTES = int(float(os.getenv("TILE_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+TILE_CACHE_TTL_S = float(os.getenv("TILE_CACHE_TTL_S", str(7 * 24 * 3600)))  # これを過ぎたら上流に再検証
+TILE_CLIENT_MAX_AGE_S = int(os.getenv("TILE_CLIENT_MAX_AGE_S", "86400"))   # 上流が Cache-Control を返さないとき
+TILE_UPSTREAM_TIMEOUT_S = float(os.getenv("TILE_UPSTREAM_TIMEOUT_S", "10"))
+TILE_UPSTREAM_CONCURRENCY = int(os.getenv("TILE_UPSTREAM_CONCURRENCY", "16"))
+TILE_MAX_ZOOM = 18
+
+# 上流のベース URL（ローカルの代替サーバで試すときなどはホストごとに差し替える）
+TILE_UPSTREAMS = {
+    "cyberjapan": os.getenv("TILE_UPSTREAM_CYBERJAPAN", "https://cyberjapandata.gsi.go.jp/xyz").rstrip("/"),
+    "disaportal": os.getenv("TILE_UPSTREAM_DISAPORTAL", "https://disaportaldata.gsi.go.jp/raster").rstrip("/"),
+}
+# /tiles/{layer} の layer → (上流, 上流側のレイヤ名)
+TILE_LAYERS = {
+    "lcm25k_2012": ("cyberjapan", "lcm25k_2012"),
+    "landslide": ("disaportal", "05_dosekiryukeikaikuiki"),
+    "flood": ("disaportal", "01_flood_l2_shinsuishin_data"),
+    "tsunami": ("disaportal", "04_tsunami_newlegend_data"),
+}
+
+_HEADER_LEN = struct.Struct("!I")
+
+
+class TileUpstreamError(Exception):
+    # 上流から取れず、手元に古いコピーも無い
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class TileEntry:
+    status: int                  # 200 or 404（上流に無いタイル）
+    body: bytes
+    etag: str                    # クライアントに返す ETag（上流に無ければ本体のハッシュ）
+    upstream_etag: str | None    # 上流への再検証に使う
+    last_modified: str | None
+    cache_control: str | None
+    content_type: str
+    fetched_at: float
+
+    def is_fresh(self, now: float) -> bool:
+        return now - self.fetched_at < TILE_CACHE_TTL_S
+
+    def encode(self) -> bytes:
+        head = json.dumps({
+            "status": self.status, "etag": self.etag, "upstream_etag": self.upstream_etag,
+            "last_modified": self.last_modified, "cache_control": self.cache_control,
+            "content_type": self.content_type, "fetched_at": self.fetched_at,
+        }).encode()
+        return _HEADER_LEN.pack(len(head)) + head + self.body
+
+    @classmethod
+    def decode(cls, raw: bytes) -> "TileEntry":
+        (n,) = _HEADER_LEN.unpack_from(raw)
+        head = json.loads(raw[_HEADER_LEN.size:_HEADER_LEN.size + n])
+        return cls(body=raw[_HEADER_LEN.size + n:], **head)
+
+
+class DiskTileCache:
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index: OrderedDict = OrderedDict()  # 相対パス -> バイト数（古い順）
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.scanned = False
+
+    @staticmethod
+    def relpath(key: tuple) -> str:
+        h = hashlib.sha1("/".join(map(str, key)).encode()).hexdigest()
+        return f"{h[:2]}/{h[2:4]}/{h}.tile"
+
+    def scan(self):
+        # 既存のキャッシュを mtime 順に読み込んで LRU の並びを復元する（起動時にバックグラウンドで1回）
+        found = []
+        if self.root.exists():
+            for dirpath, _dirs, files in os.walk(self.root):
+                for name in files:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        if name.endswith(".tmp"):
+                            os.unlink(path)  # 書きかけで落ちた残り
+                            continue
+                        if not name.endswith(".tile"):
+                            continue
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    found.append((st.st_mtime, os.path.relpath(path, self.root).replace(os.sep, "/"), st.st_size))
+        found.sort()
+        with self._lock:
+            index = OrderedDict((rel, size) for _, rel, size in found if rel not in self._index)
+            index.update(self._index)  # スキャン中に書いた分は新しい扱い
+            self._index = index
+            self.total_bytes = sum(index.values())
+            self.scanned = True
+        self._evict()
+
+    def start_scan(self):
+        threading.Thread(target=self.scan, name="tile-cache-scan", daemon=True).start()
+
+    def read(self, key: tuple) -> TileEntry | None:
+        rel = self.relpath(key)
+        path = self.root / rel
+        try:
+            raw = path.read_bytes()
+            os.utime(path)  # 再起動後も LRU の並びが分かるように
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+                size = self._index.pop(rel, None)
+                if size is not None:
+                    self.total_bytes -= size  # 別ワーカーが消した
+            return None
+        with self._lock:
+            self.hits += 1
+            if rel in self._index:
+                self._index.move_to_end(rel)
+        return TileEntry.decode(raw)
+
+    def write(self, key: tuple, entry: TileEntry):
+        rel = self.relpath(key)
+        path = self.root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = entry.encode()
+        # 別ワーカーが同時に読んでいても壊れないよう、別名で書いて置き換える
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self.total_bytes += len(data) - self._index.pop(rel, 0)
+            self._index[rel] = len(data)
+        self._evict()
+
+    def _evict(self):
+        victims = []
+        with self._lock:
+            while self.total_bytes > self.max_bytes and len(self._index) > 1:
+                rel, size = self._index.popitem(last=False)
+                self.total_bytes -= size
+                self.evictions += 1
+                victims.append(rel)
+        for rel in victims:
+            try:
+                os.unlink(self.root / rel)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "dir": str(self.root),
+                "files": len(self._index),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "scanned": self.scanned,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+class TileProxy:
+    def __init__(self, cache: DiskTileCache):
+        self.cache = cache
+        self._client: httpx.AsyncClient | None = None
+        self._upstream_slots = asyncio.Semaphore(TILE_UPSTREAM_CONCURRENCY)
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.upstream_fetches = 0
+        self.upstream_not_modified = 0
+        self.upstream_errors = 0
+        self.coalesced = 0
+        self.stale_served = 0
+
+    @staticmethod
+    def upstream_url(layer: str, z: int, x: int, y: int) -> str:
+        host, name = TILE_LAYERS[layer]
+        return f"{TILE_UPSTREAMS[host]}/{name}/{z}/{x}/{y}.png"
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=TILE_UPSTREAM_TIMEOUT_S,
+                limits=httpx.Limits(max_connections=TILE_UPSTREAM_CONCURRENCY,
+                                    max_keepalive_connections=TILE_UPSTREAM_CONCURRENCY),
+                headers={"User-Agent": "osaka-risk-tile-proxy"},
+            )
+        return self._client
+
+    async def get(self, layer: str, z: int, x: int, y: int) -> tuple[TileEntry, str]:
+        # 戻り値: (タイル, "HIT" | "MISS" | "REVALIDATED" | "STALE")
+        key = (layer, z, x, y)
+        cached = await run_in_threadpool(self.cache.read, key)
+        if cached is not None and cached.is_fresh(time.time()):
+            return cached, "HIT"
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(key, cached))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # 最初に頼んだクライアントが切断しても、相乗りしている他のリクエストのために取得は続ける
+        return await asyncio.shield(task)
+
+    async def _refresh(self, key: tuple, stale: TileEntry | None) -> tuple[TileEntry, str]:
+        headers = {}
+        if stale is not None:
+            if stale.upstream_etag:
+                headers["If-None-Match"] = stale.upstream_etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+        try:
+            async with self._upstream_slots:
+                self.upstream_fetches += 1
+                res = await self._http().get(self.upstream_url(*key), headers=headers)
+        except httpx.HTTPError as e:
+            return self._fallback(stale, e)
+
+        now = time.time()
+        if res.status_code == 304 and stale is not None:
+            self.upstream_not_modified += 1
+            entry = replace(stale, fetched_at=now, cache_control=res.headers.get("cache-control", stale.cache_control))
+            outcome = "REVALIDATED"
+        elif res.status_code in (200, 404):
+            body = res.content if res.status_code == 200 else b""
+            upstream_etag = res.headers.get("etag")
+            entry = TileEntry(
+                status=res.status_code,
+                body=body,
+                etag=upstream_etag or f'"{hashlib.sha1(body).hexdigest()[:20]}"',
+                upstream_etag=upstream_etag,
+                last_modified=res.headers.get("last-modified"),
+                cache_control=res.headers.get("cache-control"),
+                content_type=res.headers.get("content-type", "image/png"),
+                fetched_at=now,
+            )
+            outcome = "MISS"
+        else:
+            return self._fallback(stale, TileUpstreamError(f"upstream status {res.status_code}"))
+
+        await run_in_threadpool(self.cache.write, key, entry)
+        return entry, outcome
+
+    def _fallback(self, stale: TileEntry | None, error: Exception) -> tuple[TileEntry, str]:
+        # 上流が落ちていても、期限切れのコピーがあればそれを返す
+        self.upstream_errors += 1
+        if stale is None:
+            raise TileUpstreamError(str(error)) from error
+        self.stale_served += 1
+        return stale, "STALE"
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "upstreams": TILE_UPSTREAMS,
+            "ttl_s": TILE_CACHE_TTL_S,
+            "inflight": len(self._inflight),
+            "upstream_fetches": self.upstream_fetches,
+            "upstream_not_modified": self.upstream_not_modified,
+            "upstream_errors": self.upstream_errors,
+            "coalesced": self.coalesced,
+            "stale_served": self.stale_served,
+            "disk": self.cache.stats(),
+        }
+
+
+tile_proxy = TileProxy(DiskTileCache(TILE_CACHE_DIR, TILE_CACHE_MAX_BYTES))
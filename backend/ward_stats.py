@@ -0,0 +1,276 @@
+# ward_stats.py
+# 区（国土数値情報 N03 行政区域）ごとの集計（GET /wards/{code}/stats）
+#   ・terrain_risk / shelters の各点を N03 の区ポリゴンに空間結合し、区コードを各行の ward_code 列に保存する
+#     （区ポリゴンの STRtree で候補を出し、prepare 済みのポリゴンと点の配列をまとめて intersects 判定する。点ごとのループは無し）
+#   ・区コードが未設定（NULL）の行だけ判定する。terrain_risk を入れ替えると全行 NULL に戻るので全件、
+#     --append や避難所の追加では追加分だけになる。区界ファイルが変わったら全件振り直す
+#   ・集計（overall_risk の分布・洪水/土砂/津波のある地点数・避難所数と収容人数）は ward_stats /
+#     ward_risk_counts に書く。作り直すのは点の増減があった区だけ
+#   ・import スクリプトが取り込みの最後に build_ward_stats() を呼ぶ（scripts/build_ward_stats.py で単独実行も可）
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+from sqlalchemy import text
+
+from geojson_stream import iter_features
+from models import Shelter, WardRiskCount, WardStats
+from schema import ensure_shelter_columns, ensure_terrain_risk_columns
+from spatial_index import fetch_array
+
+WARD_GEOJSON_PATH = os.getenv("WARD_GEOJSON_PATH", "./data/N03-19_27_190101.geojson")
+WARD_CODE_PREFIX = "27"   # 全国地方公共団体コード（大阪府）。frontend の 1map_layer.js と同じ絞り込み
+WARD_SNAP_MAX_DEG = 0.0005  # どの区にも入らない点を最寄りの区に寄せる最大距離（約 50m。海岸線・区界のわずかな外側）
+NO_WARD = ""              # 判定済みだがどの区にも入らない点の ward_code（NULL は未判定）
+
+_6674_to_lonlat = Transformer.from_crs("EPSG:6674", "EPSG:4326", always_xy=True)
+
+
+class WardBoundaries:
+    def __init__(self, codes: list[str], names: list[str], parts: np.ndarray, part_ward: np.ndarray, version: str):
+        self.codes = codes          # 区コード（N03_007）
+        self.names = names          # 区名（政令市の区は「大阪市北区」）
+        self.parts = parts          # ポリゴン（MultiPolygon は分解済み）
+        self.part_ward = part_ward  # parts と同じ並びで codes の位置
+        self.version = version      # 区界ファイルの版（内容のハッシュ）
+        self.tree = shapely.STRtree(parts)
+
+    @classmethod
+    def load(cls, path=WARD_GEOJSON_PATH, code_prefix: str = WARD_CODE_PREFIX) -> "WardBoundaries":
+        index_of: dict[str, int] = {}
+        codes, names, geoms, owners = [], [], [], []
+        for feature in iter_features(path):
+            props = feature.get("properties") or {}
+            code = props.get("N03_007")
+            if not code or not str(code).startswith(code_prefix) or not feature.get("geometry"):
+                continue  # 所属未定地などはコードが無い
+            code = str(code)
+            if code not in index_of:
+                index_of[code] = len(codes)
+                codes.append(code)
+                names.append("".join(props.get(k) or "" for k in ("N03_003", "N03_004")))
+            # 同じ区が島ごとに別 feature になっているので、区コードでまとめる
+            geoms.append(shapely.geometry.shape(feature["geometry"]))
+            owners.append(index_of[code])
+        if not geoms:
+            raise ValueError(f"{path} に区コード {code_prefix}* のポリゴンがありません")
+
+        parts, part_idx = shapely.get_parts(np.array(geoms, dtype=object), return_index=True)
+        shapely.prepare(parts)
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return cls(codes, names, parts, np.asarray(owners, dtype=np.int64)[part_idx], digest.hexdigest()[:12])
+
+    def assign(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        # 経度・緯度の配列 → codes の位置（どの区にも入らなければ -1）
+        n = len(lon)
+        ward = np.full(n, -1, dtype=np.int64)
+        if n == 0:
+            return ward
+        points = shapely.points(lon, lat)
+        # STRtree.query(predicate=...) は問い合わせ側（点）を prepare するので、区ポリゴンの頂点数ぶん毎回なめて遅い。
+        # 外接矩形で候補の組を出してから、prepare 済みのポリゴン側で intersects をまとめて判定する
+        point_idx, part_idx = self.tree.query(points)
+        inside = shapely.intersects(self.parts[part_idx], points[point_idx])
+        point_idx, part_idx = point_idx[inside], part_idx[inside]
+        if len(point_idx):
+            # 区界上の点は両側の区に当たるので、codes の若い方に決める（実行ごとに結果を変えない）
+            best = np.full(n, len(self.codes), dtype=np.int64)
+            np.minimum.at(best, point_idx, self.part_ward[part_idx])
+            hit = best < len(self.codes)
+            ward[hit] = best[hit]
+        miss = np.flatnonzero(ward < 0)
+        if len(miss):
+            point_idx, part_idx = self.tree.query_nearest(points[miss], max_distance=WARD_SNAP_MAX_DEG, all_matches=False)
+            ward[miss[point_idx]] = self.part_ward[part_idx]
+        return ward
+
+
+# -----------------------------------------------------------------------------
+# 区コードの割り当て（ward_code が NULL の行だけ）
+# -----------------------------------------------------------------------------
+def _assign_table(conn, wards: WardBoundaries, table: str, projected: bool) -> tuple[int, set[str]]:
+    # 戻り値: (判定した行数, 点が増えた区コード)
+    arr = fetch_array(conn, (
+        f"SELECT id, lon, lat FROM {table} "
+        "WHERE ward_code IS NULL AND lon IS NOT NULL AND lat IS NOT NULL"
+    ), 3)
+    if not len(arr):
+        return 0, set()
+    lon, lat = arr[:, 1], arr[:, 2]
+    if projected:
+        lon, lat = _6674_to_lonlat.transform(lon, lat)  # terrain_risk の lon/lat 列は EPSG:6674 の x/y [m]
+    ward = wards.assign(np.asarray(lon), np.asarray(lat))
+    codes = np.array(wards.codes + [NO_WARD], dtype=object)[ward]  # -1 → NO_WARD
+    # 数十万行あるので text() の名前付き引数ではなくタプルのまま渡す（SQLAlchemy 側の引数処理を省く）
+    conn.exec_driver_sql(
+        f"UPDATE {table} SET ward_code = ? WHERE id = ?",
+        list(zip(codes.tolist(), arr[:, 0].astype(np.int64).tolist())),
+    )
+    return len(arr), set(codes.tolist()) - {NO_WARD}
+
+
+# -----------------------------------------------------------------------------
+# 集計
+# -----------------------------------------------------------------------------
+def _placeholders(codes: list[str]) -> tuple[str, dict]:
+    params = {f"c{i}": c for i, c in enumerate(codes)}
+    return ", ".join(f":{k}" for k in params), params
+
+
+def _aggregate_terrain(conn, codes: list[str]) -> tuple[dict, list]:
+    marks, params = _placeholders(codes)
+    summary = {
+        code: row for code, *row in conn.execute(text(f"""
+            SELECT ward_code, COUNT(*), AVG(overall_risk),
+                   TOTAL(flood_risk > 0), TOTAL(landslide_risk > 0), TOTAL(tsunami_risk > 0)
+            FROM terrain_risk WHERE ward_code IN ({marks}) GROUP BY ward_code
+        """), params)
+    }
+    counts = conn.execute(text(f"""
+        SELECT ward_code, COALESCE(overall_risk, 0), COUNT(*)
+        FROM terrain_risk WHERE ward_code IN ({marks}) GROUP BY ward_code, COALESCE(overall_risk, 0)
+    """), params).all()
+    return summary, counts
+
+
+def build_ward_stats(conn, path=WARD_GEOJSON_PATH, rebuild: bool = False) -> dict:
+    # conn: 同期エンジンの Connection（engine.begin() の中で呼ぶ）
+    #   rebuild=True: 区コードを全行振り直し、全区を集計し直す
+    t0 = time.perf_counter()
+    wards = WardBoundaries.load(path)
+    versions = {v for (v,) in conn.exec_driver_sql("SELECT DISTINCT boundary_version FROM ward_stats")}
+    if rebuild or versions != {wards.version}:
+        # 区界ファイルが変わった（または初回）→ 全件振り直し
+        conn.exec_driver_sql("UPDATE terrain_risk SET ward_code = NULL")
+        conn.exec_driver_sql("UPDATE shelters SET ward_code = NULL")
+        conn.exec_driver_sql("DELETE FROM ward_risk_counts")
+        conn.exec_driver_sql("DELETE FROM ward_stats")
+
+    terrain_assigned, dirty = _assign_table(conn, wards, "terrain_risk", projected=True)
+    shelters_assigned, _ = _assign_table(conn, wards, "shelters", projected=False)
+
+    # 点が増えた区に加えて、点の数が保存済みの集計と合わない区（入れ替えで減った・無くなった区）も作り直す
+    current = dict(conn.exec_driver_sql(
+        "SELECT ward_code, COUNT(*) FROM terrain_risk WHERE ward_code IS NOT NULL GROUP BY ward_code"
+    ).all())
+    stored = dict(conn.exec_driver_sql("SELECT code, terrain_points FROM ward_stats").all())
+    dirty |= {code for code in wards.codes if current.get(code, 0) != stored.get(code)}
+    dirty = sorted(dirty)
+
+    summary, counts = _aggregate_terrain(conn, dirty) if dirty else ({}, [])
+    # 避難所は数千件なので毎回全区を集計する（収容人数の更新も拾える）
+    shelters = {
+        code: (n, int(capacity)) for code, n, capacity in conn.exec_driver_sql(
+            "SELECT ward_code, COUNT(*), TOTAL(capacity) FROM shelters "
+            "WHERE ward_code IS NOT NULL GROUP BY ward_code"
+        )
+    }
+
+    names = dict(zip(wards.codes, wards.names))
+    if dirty:
+        marks, params = _placeholders(dirty)
+        conn.execute(text(f"DELETE FROM ward_risk_counts WHERE code IN ({marks})"), params)
+        if counts:
+            conn.execute(
+                text("INSERT INTO ward_risk_counts (code, overall_risk, points) VALUES (:code, :risk, :points)"),
+                [{"code": code, "risk": int(risk), "points": points} for code, risk, points in counts],
+            )
+        conn.execute(text("""
+            INSERT INTO ward_stats (code, name, boundary_version, terrain_points, overall_risk_mean,
+                                    flood_points, landslide_points, tsunami_points, shelter_count, shelter_capacity,
+                                    updated_at)
+            VALUES (:code, :name, :version, :points, :mean, :flood, :landslide, :tsunami, 0, 0, datetime('now'))
+            ON CONFLICT (code) DO UPDATE SET
+                name = excluded.name, boundary_version = excluded.boundary_version,
+                terrain_points = excluded.terrain_points, overall_risk_mean = excluded.overall_risk_mean,
+                flood_points = excluded.flood_points, landslide_points = excluded.landslide_points,
+                tsunami_points = excluded.tsunami_points, updated_at = excluded.updated_at
+        """), [
+            {"code": code, "name": names[code], "version": wards.version,
+             "points": row[0], "mean": row[1], "flood": int(row[2]), "landslide": int(row[3]), "tsunami": int(row[4])}
+            for code in dirty
+            for row in [summary.get(code, (0, None, 0, 0, 0))]
+        ])
+    conn.execute(text("""
+        UPDATE ward_stats SET shelter_count = :n, shelter_capacity = :capacity WHERE code = :code
+    """), [{"code": code, "n": shelters.get(code, (0, 0))[0], "capacity": shelters.get(code, (0, 0))[1]}
+           for code in wards.codes])
+
+    unassigned = conn.exec_driver_sql(
+        "SELECT (SELECT COUNT(*) FROM terrain_risk WHERE ward_code = ''), "
+        "(SELECT COUNT(*) FROM shelters WHERE ward_code = '')"
+    ).one()
+    return {
+        "wards": len(wards.codes),
+        "boundary_version": wards.version,
+        "terrain_assigned": terrain_assigned,
+        "shelters_assigned": shelters_assigned,
+        "recomputed_wards": len(dirty),
+        "terrain_outside": unassigned[0],
+        "shelters_outside": unassigned[1],
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+
+
+def ensure_ward_tables(engine):
+    # 集計テーブルと ward_code 列（import スクリプトは API を一度も起動していない DB にも使うので）
+    for table in (Shelter.__table__, WardStats.__table__, WardRiskCount.__table__):
+        table.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        ensure_terrain_risk_columns(conn)
+        ensure_shelter_columns(conn)
+
+
+def build_ward_stats_if_available(engine, path=WARD_GEOJSON_PATH) -> dict | None:
+    # import スクリプト用。区界ファイルが無ければ何もしない
+    if not Path(path).exists():
+        return None
+    ensure_ward_tables(engine)
+    with engine.begin() as conn:
+        return build_ward_stats(conn, path)
+
+
+def print_ward_stats_result(result: dict | None, path=WARD_GEOJSON_PATH):
+    if result is None:
+        print(f"   区ごとの集計: {path} が無いのでスキップ（WARD_GEOJSON_PATH で指定）")
+        return
+    print(f"   区ごとの集計: {result['wards']} 区, 区コード判定 地点 {result['terrain_assigned']:,} /"
+          f" 避難所 {result['shelters_assigned']:,}, 再集計 {result['recomputed_wards']} 区"
+          f"（区外 地点 {result['terrain_outside']:,} / 避難所 {result['shelters_outside']:,}）{result['seconds']} 秒")
+
+
+# -----------------------------------------------------------------------------
+# API 側: 保存済みの集計 → 応答
+# -----------------------------------------------------------------------------
+def _share(points: int, total: int) -> float | None:
+    return round(points / total, 4) if total else None
+
+
+def ward_stats_json(row, counts: list[tuple[int, int]]) -> dict:
+    # row: ward_stats の1行、counts: [(overall_risk, 地点数), ...]（overall_risk 昇順）
+    total = row.terrain_points or 0
+    return {
+        "code": row.code,
+        "name": row.name,
+        "terrain": {
+            "points": total,
+            "overall_risk": {
+                "mean": round(row.overall_risk_mean, 2) if row.overall_risk_mean is not None else None,
+                "distribution": [{"overall_risk": risk, "points": n, "share": _share(n, total)} for risk, n in counts],
+            },
+            **{
+                hazard: {"points": points, "share": _share(points, total)}
+                for hazard, points in (("flood", row.flood_points), ("landslide", row.landslide_points),
+                                       ("tsunami", row.tsunami_points))
+            },
+        },
+        "shelters": {"count": row.shelter_count or 0, "capacity": row.shelter_capacity or 0},
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+    }
@@ -47,14 +47,38 @@ async function saveFavoriteToDB(point) {
 }
 
 // 一覧取得（GET）
+//   ・X-Next-Cursor が返る間はページを続けて取得
+//   ・前回の ETag を送り、変更が無ければ（304）前回の一覧をそのまま使う
+const FAVORITES_PAGE_SIZE = 200;
+let _favListCache = { token: null, etag: null, items: [] };
+
 async function loadFavoritesFromDB() {
   // 未ログインでは一覧取得を許可しない
-  if (!getToken()) throw new Error("LOGIN_REQUIRED");
-  const res = await fetch(`${API_BASE}/favorites`, {
-    headers: buildHeaders({ auth: true, json: false })
-  });
-  if (!res.ok) throw new Error("/favorites 取得失敗");
-  return res.json();
+  const token = getToken();
+  if (!token) throw new Error("LOGIN_REQUIRED");
+
+  const headers = buildHeaders({ auth: true, json: false });
+  if (_favListCache.token === token && _favListCache.etag) {
+    headers["If-None-Match"] = _favListCache.etag;
+  }
+
+  const items = [];
+  let etag = null;
+  let cursor = null;
+  do {
+    const params = new URLSearchParams({ limit: FAVORITES_PAGE_SIZE });
+    if (cursor) params.set("cursor", cursor);
+    const res = await fetch(`${API_BASE}/favorites?${params}`, { headers, cache: "no-store" });
+    if (res.status === 304) return _favListCache.items;   // 1ページ目だけ条件付きで送っている
+    if (!res.ok) throw new Error("/favorites 取得失敗");
+    if (!cursor) etag = res.headers.get("ETag");
+    items.push(...await res.json());
+    cursor = res.headers.get("X-Next-Cursor");
+    delete headers["If-None-Match"];
+  } while (cursor);
+
+  _favListCache = { token, etag, items };
+  return items;
 }
 
 // 削除（DELETE）
@@ -7,7 +7,7 @@ let shelterMarker = null;  // 最寄り1件を地図に出す用
 
 // 大阪府の概略範囲（大阪外は呼ばれても null を返す）
 const OSAKA_BOUNDS = { latMin: 34.35, latMax: 34.95, lngMin: 135.25, lngMax: 135.85 };
-function isInOsaka(lat, lng) {
+export function isInOsaka(lat, lng) {
   return lat >= OSAKA_BOUNDS.latMin && lat <= OSAKA_BOUNDS.latMax &&
          lng >= OSAKA_BOUNDS.lngMin && lng <= OSAKA_BOUNDS.lngMax;
 }
@@ -16,21 +16,36 @@ function isInOsaka(lat, lng) {
  * 近傍の避難所を API から取得（既定1件）
  * 返り値（limit=1時）: { shelter(互換用), name, distance }  distanceは[m]
  * showMarker=true で最寄りにピンを出す
+ * filters: { type, minCapacity, ward } を渡すとサーバ側で絞り込む（不要な結果を取得しない）
+ * filters.mode === "walk" で道のり（徒歩ネットワーク）の近い順。徒歩ネットワークが使えない時はサーバが直線距離の順で返す
+ * （X-Shelter-Mode: straight。/risk/full の shelters.mode と同じ規則なので、どちらで引いても同じ並びになる）
  */
-export async function findNearestShelter(lat, lng, showMarker = false, limit = 1) {
+export async function findNearestShelter(lat, lng, showMarker = false, limit = 1, filters = {}) {
   if (!isInOsaka(lat, lng)) {
     console.log("大阪府外なので避難所情報は表示しません");
     return null;
   }
 
-  const url = `${API_BASE}/shelters/nearest?lat=${encodeURIComponent(lat)}&lon=${encodeURIComponent(lng)}&limit=${encodeURIComponent(limit)}`;
-  const res = await fetch(url);
+  const params = new URLSearchParams({ lat, lon: lng, limit });
+  if (filters.type) params.set("type", filters.type);
+  if (filters.minCapacity != null) params.set("min_capacity", filters.minCapacity);
+  if (filters.ward) params.set("ward", filters.ward);
+
+  if (filters.mode === "walk") params.set("mode", "walk");
+
+  const res = await fetch(`${API_BASE}/shelters/nearest?${params}`);
   if (!res.ok) return null;
   const list = await res.json();
   if (!Array.isArray(list) || list.length === 0) return null;
 
-  const top = list[0]; // name / ward / address / lat / lon / distance_km / ...
+  return toNearestResult(list[0], showMarker);
+}
 
+/**
+ * API の避難所1件（/shelters/nearest・/risk/full の shelters.items[i]）→ findNearestShelter と同じ返り値
+ * top: name / ward / address / lat / lon / distance_km / (mode=walk 時) walk_distance_km / ...
+ */
+export function toNearestResult(top, showMarker = false) {
   // 既存コード互換のため GeoJSON風に整形
   const shelterCompat = {
     properties: {
@@ -45,7 +60,7 @@ export async function findNearestShelter(lat, lng, showMarker = false, limit = 1
     geometry: { type: "Point", coordinates: [top.lon, top.lat] }
   };
 
-  const distanceM = Math.round((top.distance_km ?? 0) * 1000);
+  const distanceM = Math.round((top.walk_distance_km ?? top.distance_km ?? 0) * 1000);
 
   if (showMarker) {
     if (!shelterMarker) {
@@ -54,13 +69,26 @@ export async function findNearestShelter(lat, lng, showMarker = false, limit = 1
       shelterMarker.setLatLng([top.lat, top.lon]);
     }
     shelterMarker
-      .bindPopup(`避難所: ${top.name}（約 ${distanceM} m）`)
+      .bindPopup(`避難所: ${top.name}（${top.walk_distance_km != null ? "道のり" : ""}約 ${distanceM} m）`)
       .openPopup();
   }
 
   return { shelter: shelterCompat, name: top.name, distance: distanceM };
 }
 
+/**
+ * 地図の表示範囲にある避難所を API から取得（件数は表示範囲・登録数によらず上限あり）
+ * 返り値: { zoom, cluster_zoom, count, truncated, items }
+ *   items[i].kind === "cluster" → { lat, lon, count, capacity, expansion_zoom }（低ズーム）
+ *   items[i].kind === "shelter" → 避難所1件（name / ward / address / type / capacity / lat / lon / ...）
+ */
+export async function fetchSheltersInView() {
+  const params = new URLSearchParams({ bbox: map.getBounds().toBBoxString(), zoom: map.getZoom() });
+  const res = await fetch(`${API_BASE}/shelters?${params}`);
+  if (!res.ok) return null;
+  return res.json();
+}
+
 // 互換のため残す（DB版では事前ロード不要）
 export async function initializeShelters() {
   return;
@@ -104,4 +104,17 @@ export async function listFavorites() {
   return res.json();
 }
 
+// オフライン中に溜めた追加・削除を1回で送る（返り値の version を次回の since に使う）
+//   creates: [{ client_id, lat, lon, title, ... }], deletes: [id, ...]
+export async function syncFavorites({ since = 0, creates = [], deletes = [] } = {}) {
+  const res = await fetch(`${API_BASE}/favorites/sync`, {
+    method: "POST",
+    headers: buildHeaders({ auth: !!getToken(), json: true }),
+    body: JSON.stringify({ since, creates, deletes })
+  });
+  const data = await res.json();
+  if (!res.ok) throw new Error(data.detail || res.statusText);
+  return data;
+}
+
 export function logout() { clearToken(); }
\ No newline at end of file
@@ -1,4 +1,5 @@
 // ===== mapLayer.js（動作確認用console.log追加版） =====
+import { API_BASE } from "./12auth.js";
 
 export const L = window.L  
 
@@ -49,7 +50,8 @@ console.log("map作成完了:", map)
 })();
 
 // ===== 2. 災害関連レイヤー定義 =====
-export const landLayer = L.tileLayer("https://cyberjapandata.gsi.go.jp/xyz/lcm25k_2012/{z}/{x}/{y}.png", {
+// 地理院のタイルはバックエンドの /tiles 経由（ディスクキャッシュ付きの中継）で読む
+export const landLayer = L.tileLayer(`${API_BASE}/tiles/lcm25k_2012/{z}/{x}/{y}.png`, {
   opacity: 0.5,
   attribution: "© 国土地理院",
   maxZoom: 18,
@@ -57,7 +59,7 @@ export const landLayer = L.tileLayer("https://cyberjapandata.gsi.go.jp/xyz/lcm25
 })
 console.log("landLayer作成完了:", landLayer)
 
-export const landslideLayer = L.tileLayer("https://disaportaldata.gsi.go.jp/raster/05_dosekiryukeikaikuiki/{z}/{x}/{y}.png", {
+export const landslideLayer = L.tileLayer(`${API_BASE}/tiles/landslide/{z}/{x}/{y}.png`, {
   opacity: 0.7,
   attribution: "© 国土地理院",
   maxZoom: 18,
@@ -65,7 +67,7 @@ export const landslideLayer = L.tileLayer("https://disaportaldata.gsi.go.jp/rast
 })
 console.log("landslideLayer作成完了:", landslideLayer)
 
-export const floodLayer = L.tileLayer("https://disaportaldata.gsi.go.jp/raster/01_flood_l2_shinsuishin_data/{z}/{x}/{y}.png", {
+export const floodLayer = L.tileLayer(`${API_BASE}/tiles/flood/{z}/{x}/{y}.png`, {
   opacity: 0.7,
   attribution: "© 国土地理院",
   maxZoom: 18,
@@ -73,7 +75,7 @@ export const floodLayer = L.tileLayer("https://disaportaldata.gsi.go.jp/raster/0
 })
 console.log("floodLayer作成完了:", floodLayer)
 
-export const tsunamiLayer = L.tileLayer("https://disaportaldata.gsi.go.jp/raster/04_tsunami_newlegend_data/{z}/{x}/{y}.png", {
+export const tsunamiLayer = L.tileLayer(`${API_BASE}/tiles/tsunami/{z}/{x}/{y}.png`, {
   opacity: 0.7,
   attribution: "© 国土地理院",
   maxZoom: 18,
@@ -81,6 +83,15 @@ export const tsunamiLayer = L.tileLayer("https://disaportaldata.gsi.go.jp/raster
 })
 console.log("tsunamiLayer作成完了:", tsunamiLayer)
 
+// terrain_risk の総合リスクスコアを描いたタイル（/risk/tiles。サーバ側で描画・キャッシュ）
+export const riskHeatLayer = L.tileLayer(`${API_BASE}/risk/tiles/overall/{z}/{x}/{y}.png`, {
+  opacity: 0.8,
+  attribution: "総合リスク（計算値）",
+  maxZoom: 18,
+  minZoom: 10,
+})
+console.log("riskHeatLayer作成完了:", riskHeatLayer)
+
 // ===== 3. レイヤーコントロールの追加 =====
 export const baseLayers = { 地図: baseMap }
 export const overlays = {
@@ -88,6 +99,7 @@ export const overlays = {
   津波浸水想定区域: tsunamiLayer,
   洪水浸水想定区域: floodLayer,
   土石流警戒区域: landslideLayer,
+  総合リスク: riskHeatLayer,
 }
 L.control.layers(baseLayers, overlays).addTo(map)
 landLayer.addTo(map) // 初期表示レイヤー
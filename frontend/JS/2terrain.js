@@ -1,142 +1,31 @@
 // =====  地形判別機能 =====
+// 地理院の地形分類タイル（z14）はサーバ側で持っているので、/terrain に座標を投げて結果だけ受け取る
+import { API_BASE } from "./12auth.js";
 
-
-// --- 静かなフェッチ（404/非JSONは黙って無視） ---
 window.__DEBUG ??= false; // 必要なとき DevTools から true に
 
-async function fetchGeoJSONSafe(url, label){
-  try{
-    const res = await fetch(url, { cache: "no-store" });
-    if (res.status === 404) { if (window.__DEBUG) console.debug(label, "404:", url); return null; }
-    if (!res.ok)           { if (window.__DEBUG) console.warn (label, res.status, url); return null; }
-    const ct = (res.headers.get("content-type") || "").toLowerCase();
-    if (!ct.includes("application/json")) { if (window.__DEBUG) console.warn(label, "non-JSON:", ct, url); return null; }
-    return await res.json();
-  }catch(e){
-    if (window.__DEBUG) console.error(label, "fetch error:", e);
-    return null;
-  }
-}
-
 
 // 座標から地形分類を取得するメイン関数
 export async function getTerrainFromAPI(lat, lng) {
   try {
     if (window.__DEBUG) console.log(`地形判別開始: 座標 ${lat}, ${lng}`);
 
-    const zoom = 14;
-    const tileX = Math.floor(((lng + 180) / 360) * Math.pow(2, zoom));
-    const tileY = Math.floor(
-      ((1 - Math.log(Math.tan((lat * Math.PI) / 180) + 1 / Math.cos((lat * Math.PI) / 180)) / Math.PI) / 2) *
-      Math.pow(2, zoom)
-    );
-    if (window.__DEBUG) console.log(`タイル座標: ${zoom}/${tileX}/${tileY}`);
-
-    const urls = [
-      { url: `https://cyberjapandata.gsi.go.jp/xyz/experimental_landformclassification1/${zoom}/${tileX}/${tileY}.geojson`, type: "natural"     },
-      { url: `https://cyberjapandata.gsi.go.jp/xyz/experimental_landformclassification2/${zoom}/${tileX}/${tileY}.geojson`, type: "artificial"  },
-    ];
-
-    let bestMatch = null;
-    let minDistance = Number.POSITIVE_INFINITY;
-
-    for (const { url, type } of urls) {
-      const data = await fetchGeoJSONSafe(url, type);
-      if (!data?.features?.length) continue;
-
-      for (const feature of data.features) {
-        if (window.__DEBUG) { console.debug(`フィーチャー (${type})`, feature.properties); }
-
-        if (!(feature.geometry && feature.geometry.coordinates)) continue;
-
-        let isInside = false;
-        let featureLat, featureLng;
-
-        if (feature.geometry.type === "Point") {
-          [featureLng, featureLat] = feature.geometry.coordinates;
-          const distance = Math.hypot(lat - featureLat, lng - featureLng);
-          if (distance < 0.001) isInside = true; // 約100m以内
-        } else if (feature.geometry.type === "Polygon") {
-          const ring = feature.geometry.coordinates[0];
-          isInside = isPointInPolygon([lng, lat], ring);
-          // 重心（ざっくり）
-          featureLng = ring.reduce((s, c) => s + c[0], 0) / ring.length;
-          featureLat = ring.reduce((s, c) => s + c[1], 0) / ring.length;
-        } else if (feature.geometry.type === "MultiPolygon") {
-          for (const polygon of feature.geometry.coordinates) {
-            if (isPointInPolygon([lng, lat], polygon[0])) { isInside = true; break; }
-          }
-          const first = feature.geometry.coordinates?.[0]?.[0];
-          if (first?.length) {
-            featureLng = first.reduce((s, c) => s + c[0], 0) / first.length;
-            featureLat = first.reduce((s, c) => s + c[1], 0) / first.length;
-          }
-        }
-
-        if (isInside || (featureLat && featureLng)) {
-          const distance = (featureLat && featureLng) ? Math.hypot(lat - featureLat, lng - featureLng) : 0;
-          if (isInside || distance < minDistance) {
-            minDistance = distance;
-            bestMatch = { feature, type };
-            if (window.__DEBUG) console.debug(`マッチ更新 (${type})`, feature.properties);
-          }
-        }
-      }
-    }
-
-    if (bestMatch?.feature?.properties) {
-      const props = bestMatch.feature.properties;
-      if (window.__DEBUG) console.log("全プロパティ:", props);
-
-      const code =
-        props.LandformClassification ||
-        props.landform_classification ||
-        props.code || props.type || props.class || props.classification ||
-        props.landform || props.地形分類 || props.分類コード || props.CODE || props.TYPE || props.CLASS;
-
-      if (window.__DEBUG) console.log("取得したコード:", code, "データタイプ:", bestMatch.type);
-
-      if (code) {
-        const terrainName = getLandformName(code);
-        if (window.__DEBUG) console.log("変換後の地形名:", terrainName);
-        return terrainName;
-      } else {
-        if (window.__DEBUG) console.log("地形分類コード見つからず:", Object.keys(props));
-        return `地形データあり（${bestMatch.type === "natural" ? "自然地形" : "人工地形"}）`;
-      }
-    } else {
-      if (window.__DEBUG) console.log("該当する地形分類が見つかりませんでした");
-      return "地形分類データなし";
+    const params = new URLSearchParams({ lat, lon: lng });
+    const res = await fetch(`${API_BASE}/terrain?${params}`);
+    if (!res.ok) {
+      if (window.__DEBUG) console.warn("terrain", res.status);
+      return "データ取得エラー";
     }
+    const data = await res.json();
+    // data: { status: "ok" | "no_data", code, name, layer: "natural" | "artificial", match: "inside" | "nearest", tile }
+    if (window.__DEBUG) console.log("地形判別結果:", data);
+    return data.name || "地形分類データなし";
   } catch (error) {
     console.error("地形取得エラー:", error);
     return "データ取得エラー";
   }
 }
 
-
-// ポリゴン内判定関数(点がポリゴン内にあるかどうか）
-function isPointInPolygon(point, polygon) { // pointは判定したい点の座標
-  // 初期化
-  const x = point[0],
-    y = point[1]
-  let inside = false
-
-//   レイキャスティング法
-// 「点から右向きに水平な光線を引いて、ポリゴンの辺と交差する回数が奇数なら中、偶数なら外」
-  for (let i = 0, j = polygon.length - 1; i < polygon.length; j = i++) {
-    const xi = polygon[i][0],
-      yi = polygon[i][1]
-    const xj = polygon[j][0],
-      yj = polygon[j][1]
-
-    if (yi > y !== yj > y && x < ((xj - xi) * (y - yi)) / (yj - yi) + xi) {
-      inside = !inside
-    }
-  }
-  return inside
-}
-
 export function getLandformName(code) {
   const landformTypes = {
     // === ベクトルタイル「地形分類」 ===
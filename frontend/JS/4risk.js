@@ -1,4 +1,8 @@
 // 4risk.js
+import { API_BASE } from "./12auth.js";
+import { getTerrainFromAPI } from "./2terrain.js";
+import { findNearestShelter, isInOsaka, toNearestResult } from "./11nearestShelter/11nearestShelter.js";
+
 let riskDatabase = {};
 
 export async function loadRiskDatabase(csvPath = "/data/geodata.csv") {
@@ -73,3 +77,52 @@ export async function assessDisasterRisk(lat, lng, terrainType) {
     simplerisk_warnings: msg,
   };
 }
+
+// 地形名 → CSV の簡易リスク（loadRiskDatabase 済みのとき）
+export function getDetailedRiskByTerrain(terrainType) {
+  return riskDatabase[terrainType] || null;
+}
+
+// 精密リスク（/risk）。返り値: { status: "ok" | "no_match", overall_risk, risk_description, explanation }
+export async function fetchRiskFromAPI(lat, lng) {
+  try {
+    const params = new URLSearchParams({ lat, lon: lng });
+    const res = await fetch(`${API_BASE}/risk?${params}`);
+    if (!res.ok) return null;
+    return await res.json();
+  } catch (e) {
+    console.error("リスク取得エラー:", e);
+    return null;
+  }
+}
+
+/**
+ * 1地点の表示に必要なもの（地形・精密リスク・最寄り避難所）を /risk/full の1往復で取得
+ * 返り値: { terrainType, detailedRisk, nearest }  nearest は findNearestShelter と同じ形（大阪府外・該当なしは null）
+ * options: { mode: "walk" | "straight", showMarker }
+ * /risk/full が使えないサーバでは従来の3リクエストに戻す
+ */
+export async function fetchLocationFromAPI(lat, lng, { mode = "straight", showMarker = false } = {}) {
+  try {
+    const params = new URLSearchParams({ lat, lon: lng, limit: 1, mode });
+    const res = await fetch(`${API_BASE}/risk/full?${params}`);
+    if (res.ok) {
+      const data = await res.json();
+      // data: { risk, shelters: { mode, items }, terrain: { status, code, name, ... } }
+      const top = data.shelters?.items?.[0];
+      return {
+        terrainType: data.terrain?.name || "地形分類データなし",
+        detailedRisk: data.risk,
+        nearest: top && isInOsaka(lat, lng) ? toNearestResult(top, showMarker) : null,
+      };
+    }
+  } catch (e) {
+    console.warn("/risk/full 取得失敗（個別取得に切り替え）:", e);
+  }
+  const [terrainType, detailedRisk, nearest] = await Promise.all([
+    getTerrainFromAPI(lat, lng),
+    fetchRiskFromAPI(lat, lng),
+    findNearestShelter(lat, lng, showMarker, 1, { mode }),
+  ]);
+  return { terrainType, detailedRisk, nearest };
+}
@@ -1,11 +1,10 @@
 console.log("7current_UI.js loaded");
 import { map, L } from "./1map_layer.js";
-import { getTerrainFromAPI } from "./2terrain.js";
-import { getDetailedRiskByTerrain, assessDisasterRisk, loadRiskDatabase, fetchRiskFromAPI } from "./4risk.js?v=2";
+import { getDetailedRiskByTerrain, assessDisasterRisk, loadRiskDatabase, fetchLocationFromAPI } from "./4risk.js?v=2";
 import { showLocationInfo } from "./6infoUI.js";
 import { showLocation } from "./3location.js";
 import { setFavoriteButton } from "./10favorite.js";
-import { initializeShelters, findNearestShelter } from "./11nearestShelter/11nearestShelter.js";
+import { initializeShelters } from "./11nearestShelter/11nearestShelter.js";
 import { API_BASE } from "./12auth.js";
 
 
@@ -87,7 +86,8 @@ async function hasDbMatch(lat, lng) {
 
 
 // === 現在地情報更新 ===
-export async function updateCurrentLocationInfo(lat, lng) {
+// location: main3.js などで取得済みの fetchLocationFromAPI の結果（省略時はここで取得）
+export async function updateCurrentLocationInfo(lat, lng, location = null) {
   const currentLocationInfo = document.getElementById("currentLocationInfo");
   const infoCardMessage = document.getElementById("infoCardMessage");
 
@@ -95,16 +95,13 @@ export async function updateCurrentLocationInfo(lat, lng) {
   if (currentLocationInfo) currentLocationInfo.style.display = "block";
 
   try {
-    const terrainType = await getTerrainFromAPI(lat, lng);
+    // 地形・精密リスク（API）・最寄り避難所を1往復で
+    const { terrainType, detailedRisk, nearest } = location || await fetchLocationFromAPI(lat, lng);
 
     // 簡易リスク
     const simpleRisk = getDetailedRiskByTerrain(terrainType)
                     || await assessDisasterRisk(lat, lng, terrainType);
 
-    // 精密リスク（API）
-    const detailedRisk = await fetchRiskFromAPI(lat, lng);
-
-    const nearest = await findNearestShelter(lat, lng);
     // const nearestName = nearest ? nearest.shelter.properties.P20_002 : "情報なし";
 
     const nearestName = nearest
@@ -194,18 +191,15 @@ function setupMapClickEvent() {
     if (currentLocationInfo) currentLocationInfo.style.display = "block";
 
     try {
-      const terrainType = await getTerrainFromAPI(lat, lng);
+      // 地形・精密リスク（API）・最寄り避難所を1往復で
+      const { terrainType, detailedRisk, nearest } = await fetchLocationFromAPI(lat, lng);
 
       // 簡易リスク
       const simpleRisk = getDetailedRiskByTerrain(terrainType)
                       || await assessDisasterRisk(lat, lng, terrainType);
-      
-      // 精密リスク（API）
-      const detailedRisk = await fetchRiskFromAPI(lat, lng);
 
       console.log("判定結果:", terrainType, simpleRisk, detailedRisk);
 
-      const nearest = await findNearestShelter(lat, lng, false);
       // const nearestName = nearest ? nearest.shelter.properties.P20_002 : "情報なし";
 
       const nearestName = nearest
@@ -4,14 +4,12 @@ import { initializeLegend } from "./8legend/8legend.js";
 
 import { setupLocationFeatures } from "./3location.js";
 
-import { getTerrainFromAPI } from "./2terrain.js";
-import { assessDisasterRisk, fetchRiskFromAPI, loadRiskDatabase } from "./4risk.js?v=2";
+import { assessDisasterRisk, fetchLocationFromAPI, loadRiskDatabase } from "./4risk.js?v=2";
 
 import { setupTerrainToggle } from "./9terrain_btn.js";
 
 import { updateCurrentLocationInfo, initializeTerrainModule } from "./7current_UI.js";
 import { initializeFavorites, addFavoritePoint, toggleFavoriteMarkers, showFavoriteListButton, setFavoriteButton } from "./10favorite.js";
-import { findNearestShelter } from "./11nearestShelter/11nearestShelter.js";
 import {
   register, login, logout, claimDevice, me,
   API_BASE, getToken
@@ -58,12 +56,10 @@ document.addEventListener("DOMContentLoaded", async () => {
     
 
 
-    const terrainType = await getTerrainFromAPI(lat, lng);
+    // 地形・詳細リスク・最寄り避難所（道のり優先、用意が無ければ直線距離）を /risk/full の1往復で取得
+    const location = await fetchLocationFromAPI(lat, lng, { mode: "walk", showMarker: true });
+    const { terrainType, detailedRisk, nearest } = location;
     lastTerrainType = terrainType;
-
-    // 詳細リスク取得
-    let detailedRisk = await fetchRiskFromAPI(lat, lng);
-    let simpleRisk = null;
     
     // ✅ 「status」が ok のときのみ詳細リスクを使う
     if (detailedRisk && detailedRisk.status === "ok") {
@@ -84,18 +80,12 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
 
 
-    // 📍 クリックした地点から最寄り避難所を探す
-    const nearest = await findNearestShelter(lat, lng, true);
     if (nearest) {
       const { shelter, distance } = nearest;
       console.log("Nearest Shelter:", shelter.properties, distance.toFixed(0) + "m");
       // TODO: showShelterInfo(shelter.properties, distance);
     }
-    updateCurrentLocationInfo(
-      lat, lng, terrainType,
-      lastDetailedRisk || lastSimpleRisk,
-      nearest
-    );
+    updateCurrentLocationInfo(lat, lng, location);  // 取得済みの結果を渡す（同じ問い合わせを繰り返さない）
     setFavoriteButton(lat, lng, terrainType, lastSimpleRisk, lastDetailedRisk);
   });
 